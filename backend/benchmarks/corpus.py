@@ -0,0 +1,145 @@
+import io
+import random
+import struct
+import wave
+from collections import namedtuple
+import numpy as np
+from PIL import Image, ImageDraw
+
+# Synthetic, seeded corpus: text PDFs, scanned (text-less) PDFs, phone photos,
+# screenshots, tall scans and lecture recordings, in English and Arabic.
+# Every document is unique, so uploads don't short-circuit on the content hash.
+
+CorpusFile = namedtuple("CorpusFile", "filename content content_type media_type language")
+
+EN_SENTENCES = (
+    "Photosynthesis converts light energy into chemical energy stored in glucose.",
+    "The second law of thermodynamics states that entropy never decreases in an isolated system.",
+    "Enzymes lower the activation energy of biochemical reactions.",
+    "A market reaches equilibrium when supply equals demand.",
+    "Newton's second law relates force, mass and acceleration.",
+    "Cell membranes control which molecules enter and leave the cell.",
+)
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def make_pdf(pages: list, marker: str = "", scanned: bool = False) -> bytes:
+    """Minimal PDF with one Helvetica text block per page; empty pages have no text layer.
+
+    scanned=True also draws a page-sized (1x1 gray) image on every page, like a scan.
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in below
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        b"<< /Type /XObject /Subtype /Image /Width 1 /Height 1 /ColorSpace /DeviceGray "
+        b"/BitsPerComponent 8 /Length 1 >>\nstream\n\x80\nendstream",
+    ]
+    resources = b"<< /Font << /F1 3 0 R >> /XObject << /Im1 4 0 R >> >>" if scanned else b"<< /Font << /F1 3 0 R >> >>"
+    page_ids = []
+    for lines in pages:
+        body = f"% {marker}\n" if marker else ""
+        if scanned:
+            body += "q 612 0 0 792 0 0 cm /Im1 Do Q\n"
+        if lines:
+            body += "BT /F1 11 Tf 14 TL 56 760 Td " + " ".join(f"({_escape(line)}) Tj T*" for line in lines) + " ET"
+        stream = body.encode()
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources %s /Contents %d 0 R >>" % (resources, len(objects))
+        )
+        page_ids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        " ".join(f"{i} 0 R" for i in page_ids).encode(), len(page_ids)
+    )
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return out
+
+def text_pdf(rng: random.Random, pages: int) -> bytes:
+    return make_pdf([
+        [f"Lecture {rng.randrange(10 ** 6)}, page {page + 1}."] + [rng.choice(EN_SENTENCES) for _ in range(45)]
+        for page in range(pages)
+    ])
+
+def scanned_pdf(rng: random.Random, pages: int, language: str) -> bytes:
+    """Page images without a text layer, so every page goes through OCR"""
+    return make_pdf([[] for _ in range(pages)], marker=f"lang={language} id={rng.randrange(10 ** 9)}", scanned=True)
+
+def photo(rng: random.Random, size=(3024, 4032)) -> bytes:
+    """Phone photo of a whiteboard: strokes on a noisy background, high-quality JPEG"""
+    noise = np.random.default_rng(rng.randrange(2 ** 32)).normal(128, 24, (size[1], size[0]))
+    image = Image.fromarray(noise.clip(0, 255).astype(np.uint8)).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for _ in range(300):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.line((x, y, x + rng.randrange(40, 400), y + rng.randrange(-20, 20)), fill=(20, 20, 120), width=6)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=95)
+    return buffer.getvalue()
+
+def screenshot(rng: random.Random, size=(1280, 800), tall: bool = False) -> bytes:
+    """Slide or page screenshot: text-like bars on white, PNG"""
+    if tall:
+        size = (1080, 7200)
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    for y in range(40, size[1] - 40, 28):
+        draw.rectangle((48, y, 48 + rng.randrange(200, size[0] - 96), y + 14), fill=(30, 30, 30))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def recording(rng: random.Random, seconds: int, rate: int = 8000) -> bytes:
+    """Mono 16-bit WAV: a warbling tone standing in for speech"""
+    pitch = rng.uniform(120, 240)
+    t = np.arange(seconds * rate) / rate
+    signal = 0.3 * np.sin(2 * np.pi * pitch * t) * (0.6 + 0.4 * np.sin(2 * np.pi * 3 * t))
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as audio:
+        audio.setnchannels(1)
+        audio.setsampwidth(2)
+        audio.setframerate(rate)
+        audio.writeframes((signal * 32767).astype("<i2").tobytes())
+    return buffer.getvalue()
+
+def build(documents: int = 24, seed: int = 0, audio_seconds=(60, 180, 720)) -> list:
+    """`documents` corpus files cycling through every kind and both languages"""
+    rng = random.Random(seed)
+    kinds = (
+        ("pdf", "en"), ("scanned_pdf", "ar"), ("photo", "en"), ("pdf", "en"), ("screenshot", "ar"),
+        ("audio", "ar"), ("scanned_pdf", "en"), ("tall_scan", "ar"), ("audio", "en"),
+    )
+    recordings = {}
+    audio_files = 0
+    files = []
+    for index in range(documents):
+        kind, language = kinds[index % len(kinds)]
+        name = f"{index:03d}-{kind}-{language}"
+        if kind == "pdf":
+            files.append(CorpusFile(f"{name}.pdf", text_pdf(rng, rng.randrange(4, 30)), "application/pdf", "pdf", language))
+        elif kind == "scanned_pdf":
+            files.append(CorpusFile(f"{name}.pdf", scanned_pdf(rng, rng.randrange(1, 6), language), "application/pdf", "pdf", language))
+        elif kind == "photo":
+            files.append(CorpusFile(f"{name}.jpg", photo(rng), "image/jpeg", "image", language))
+        elif kind in ("screenshot", "tall_scan"):
+            files.append(CorpusFile(f"{name}.png", screenshot(rng, tall=kind == "tall_scan"), "image/png", "image", language))
+        else:
+            seconds = audio_seconds[audio_files % len(audio_seconds)]
+            audio_files += 1
+            # Each length is synthesized once; copies are made unique by their last sample
+            if seconds not in recordings:
+                recordings[seconds] = recording(rng, seconds)
+            content = recordings[seconds][:-2] + struct.pack("<h", index)
+            files.append(CorpusFile(f"{name}.wav", content, "audio/wav", "audio", language))
+    return files
@@ -0,0 +1,177 @@
+import asyncio
+import hashlib
+import json
+import random
+import re
+from services import llm, remote_files
+
+# Deterministic offline stand-in for the LLM providers. It answers every prompt
+# ai_engine sends (analysis, quiz, flashcards, study sets, OCR, transcription)
+# with well-formed output of a realistic size, after a configurable delay, and
+# fails a configurable share of calls with a retryable error.
+
+EN_WORDS = (
+    "energy cell membrane protein enzyme reaction gradient equilibrium entropy pressure "
+    "volume temperature molecule structure function system process theory model data"
+).split()
+AR_WORDS = (
+    "الطاقة الخلية الغشاء البروتين الإنزيم التفاعل التدرج التوازن الإنتروبيا الضغط "
+    "الحجم الحرارة الجزيء البنية الوظيفة النظام العملية النظرية النموذج البيانات"
+).split()
+
+class FakeProviderError(Exception):
+    """Looks like a 503 to the gateway, so it is retried"""
+    code = 503
+
+def _digest(value) -> int:
+    return int.from_bytes(hashlib.sha256(value).digest()[:8], "big")
+
+class FakeProvider:
+    name = "gemini"
+    key_id = "fake"
+    model_name = "fake-llm"
+
+    def __init__(self, latency_ms: float = 200, jitter_ms: float = 50, failure_rate: float = 0.0,
+                 seed: int = 0, stream_chunk_chars: int = 40):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self.stream_chunk_chars = stream_chunk_chars
+        self.calls = 0
+        self.failures = 0
+        self._attempts = {}
+
+    def _content_bytes(self, contents) -> bytes:
+        """Prompt text plus attached file/image bytes (file handles are resolved locally)"""
+        if isinstance(contents, str):
+            return contents.encode()
+        parts = []
+        for part in contents:
+            if isinstance(part, str):
+                parts.append(part.encode())
+            elif "data" in part:
+                parts.append(part["data"])
+            elif "file_data" in part:
+                parts.append(self._file_head(part["file_data"]["file_uri"]))
+        return b"\n".join(parts)
+
+    def _file_head(self, uri: str) -> bytes:
+        api = remote_files.get_file_api()
+        path = getattr(api, "files", {}).get(uri.split("://", 1)[-1])
+        if path is None:
+            return uri.encode()
+        try:
+            with open(path, "rb") as f:
+                return f.read(256 * 1024)
+        except OSError:
+            return uri.encode()
+
+    def _rng(self, key: int) -> random.Random:
+        # Same prompt, same attempt number -> same latency and failure decision,
+        # whatever order concurrent requests arrive in
+        attempt = self._attempts.get(key, 0)
+        self._attempts[key] = attempt + 1
+        return random.Random(hash((self.seed, key, attempt)))
+
+    async def _delay(self, rng: random.Random):
+        await asyncio.sleep(max(0.0, self.latency_ms + rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000)
+
+    def _maybe_fail(self, rng: random.Random):
+        if rng.random() < self.failure_rate:
+            self.failures += 1
+            raise FakeProviderError("injected failure")
+
+    async def generate(self, contents, **options) -> llm.LLMResult:
+        self.calls += 1
+        data = self._content_bytes(contents)
+        rng = self._rng(_digest(data))
+        await self._delay(rng)
+        self._maybe_fail(rng)
+        prompt = contents if isinstance(contents, str) else contents[0]
+        text = respond(prompt, data)
+        return llm.LLMResult(text=text, provider=self.name, model=self.model_name,
+                             input_tokens=len(data) // 4, output_tokens=len(text) // 4)
+
+    async def stream(self, contents, **options):
+        self.calls += 1
+        data = self._content_bytes(contents)
+        rng = self._rng(_digest(data))
+        # Time to first token, then the rest of the response in small deltas
+        await self._delay(rng)
+        self._maybe_fail(rng)
+        prompt = contents if isinstance(contents, str) else contents[0]
+        text = respond(prompt, data)
+        for start in range(0, len(text), self.stream_chunk_chars):
+            await asyncio.sleep(0.002)
+            yield text[start:start + self.stream_chunk_chars]
+        yield llm.LLMUsage(input_tokens=len(data) // 4, output_tokens=len(text) // 4)
+
+def _words(rng: random.Random, arabic: bool, count: int) -> str:
+    return " ".join(rng.choice(AR_WORDS if arabic else EN_WORDS) for _ in range(count))
+
+def _count(prompt: str, default: int) -> int:
+    match = re.search(r"Create (\d+)", prompt)
+    return int(match.group(1)) if match else default
+
+def _concepts(rng, arabic, count=6):
+    return [{"term": _words(rng, arabic, 2), "definition": _words(rng, arabic, 12)} for _ in range(count)]
+
+def _questions(rng, arabic, count):
+    return [
+        {"id": i + 1, "question": _words(rng, arabic, 10) + "?", "options": [_words(rng, arabic, 3) for _ in range(4)],
+         "correct_answer_index": rng.randrange(4)}
+        for i in range(count)
+    ]
+
+def respond(prompt: str, data: bytes) -> str:
+    """The response ai_engine expects for this prompt"""
+    rng = random.Random(_digest(data))
+    arabic = "in Arabic" in prompt
+
+    if "[mm:ss]" in prompt:
+        # Transcription of one clip, timestamped relative to its start
+        minutes = re.search(r"about (\d+) minutes", prompt)
+        seconds = int(minutes.group(1)) * 60 if minutes else 120
+        arabic = b"lang=ar" in data or rng.random() < 0.5
+        return "\n".join(
+            f"[{t // 60:02d}:{t % 60:02d}] {_words(rng, arabic, 14)}" for t in range(0, max(seconds, 30), 15)
+        )
+    scanned_pages = re.search(r"This PDF has (\d+) scanned pages", prompt)
+    if scanned_pages:
+        arabic = b"lang=ar" in data or rng.random() < 0.5
+        return "\n".join(
+            f"--- Page {page} ---\n" + "\n".join(_words(rng, arabic, 16) for _ in range(20))
+            for page in range(1, int(scanned_pages.group(1)) + 1)
+        )
+    if "Perform OCR" in prompt or "extract all the text" in prompt or "transcription" in prompt:
+        arabic = b"lang=ar" in data or rng.random() < 0.5
+        return "\n".join(_words(rng, arabic, 16) for _ in range(20))
+    if '"cards"' in prompt:
+        return json.dumps({
+            "summary": _words(rng, arabic, 60), "concepts": _concepts(rng, arabic),
+            "questions": _questions(rng, arabic, 5), "cards": _concepts(rng, arabic, 8)
+        }, ensure_ascii=False)
+    if "Answer the student" in prompt:
+        return json.dumps({"answer": _words(rng, arabic, 40) + " [1]"}, ensure_ascii=False)
+    if "quiz generator" in prompt:
+        questions = _questions(rng, arabic, _count(prompt, 5))
+        if "JSON Lines" in prompt:
+            return "\n".join(json.dumps({k: v for k, v in q.items() if k != "id"}, ensure_ascii=False) for q in questions)
+        return json.dumps(questions, ensure_ascii=False)
+    if "flashcard generator" in prompt:
+        cards = _concepts(rng, arabic, _count(prompt, 8))
+        if "JSON Lines" in prompt:
+            return "\n".join(json.dumps(card, ensure_ascii=False) for card in cards)
+        return json.dumps(cards, ensure_ascii=False)
+    if "###CONCEPTS###" in prompt:
+        return f"{_words(rng, arabic, 80)}\n###CONCEPTS###\n{json.dumps(_concepts(rng, arabic), ensure_ascii=False)}"
+    return json.dumps({"summary": _words(rng, arabic, 80), "concepts": _concepts(rng, arabic)}, ensure_ascii=False)
+
+def install(**options) -> FakeProvider:
+    """Route every LLM and File API call of this process to local fakes"""
+    provider = FakeProvider(**options)
+    llm.gateway.register("gemini", lambda: provider)
+    llm.gateway.register("openai", lambda: provider)
+    remote_files.set_file_api(remote_files.LocalFileAPI())
+    return provider
@@ -0,0 +1,119 @@
+"""Worker boot time: how long `import main` and the startup hooks take, and which imports dominate.
+
+Run from backend/:
+
+    python -m benchmarks.import_time --repeat 5 --top 20
+
+Every run is a fresh interpreter (`python -X importtime`) against a throwaway
+database, so the numbers are cold-start times as an autoscaled worker sees them.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child: time the import, then the startup hooks (lifespan)
+BOOT_SCRIPT = """
+import asyncio, json, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+async def boot():
+    async with main.app.router.lifespan_context(main.app):
+        return time.perf_counter()
+booted = asyncio.run(boot())
+print(json.dumps({"import_s": imported - started, "startup_s": booted - imported}))
+"""
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="fresh interpreters to time (median is reported)")
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to list")
+    parser.add_argument("--out", help="write the report as JSON")
+    return parser.parse_args(argv)
+
+def _parse_importtime(stderr: str) -> list:
+    """[(module, self_us, cumulative_us, depth)] from -X importtime output"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|", 2)
+        if not self_us.strip().isdigit():
+            continue  # header line
+        depth = (len(module) - len(module.lstrip())) // 2
+        rows.append((module.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+def _boot_once(workdir: str) -> tuple:
+    env = {
+        **os.environ,
+        "PYTHONPATH": BACKEND_DIR,
+        "SQLALCHEMY_DATABASE_URL": f"sqlite:///{workdir}/boot.db",
+        "LLM_CACHE_PATH": f"{workdir}/llm_cache.db",
+        "GEMINI_API_KEY": os.getenv("GEMINI_API_KEY", "import-time"),
+        "AUTO_MIGRATE": "1",
+    }
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", BOOT_SCRIPT],
+        cwd=workdir, env=env, capture_output=True, text=True, check=True
+    )
+    timings = json.loads(completed.stdout.strip().splitlines()[-1])
+    return timings, _parse_importtime(completed.stderr)
+
+def report(repeat: int = 3, top: int = 15) -> dict:
+    timings, rows = [], []
+    for _ in range(max(1, repeat)):
+        workdir = tempfile.mkdtemp(prefix="learnsync-boot-")
+        try:
+            run_timings, rows = _boot_once(workdir)
+            timings.append(run_timings)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    # Per top-level package: sum of self times, i.e. what dropping that dependency would save
+    packages = {}
+    for module, self_us, _, _ in rows:
+        package = module.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+    slowest = sorted(rows, key=lambda row: row[2], reverse=True)
+
+    return {
+        "import_s": statistics.median(t["import_s"] for t in timings),
+        "startup_s": statistics.median(t["startup_s"] for t in timings),
+        "runs": timings,
+        "packages_ms": {
+            name: round(us / 1000, 1) for name, us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+        },
+        "slowest_imports_ms": [
+            {"module": module, "cumulative_ms": round(cumulative / 1000, 1), "self_ms": round(self_us / 1000, 1)}
+            for module, self_us, cumulative, _ in slowest[:top]
+        ],
+    }
+
+def print_report(result: dict):
+    print(f"import main: {result['import_s'] * 1000:.0f} ms, startup hooks: {result['startup_s'] * 1000:.0f} ms "
+          f"(median of {len(result['runs'])})")
+    print("\nBy package (self time):")
+    for name, ms in result["packages_ms"].items():
+        print(f"  {name:<40}{ms:>10.1f} ms")
+    print("\nSlowest imports (cumulative):")
+    for row in result["slowest_imports_ms"]:
+        print(f"  {row['module']:<60}{row['cumulative_ms']:>10.1f} ms")
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = report(args.repeat, args.top)
+    print_report(result)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == "__main__":
+    main()
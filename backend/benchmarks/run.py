@@ -0,0 +1,324 @@
+"""End-to-end benchmark of the API against an offline fake LLM.
+
+Run from backend/:
+
+    python -m benchmarks.run --documents 24 --concurrency 8 --out bench.json
+    python -m benchmarks.run --out after.json --compare bench.json
+
+Each workload (upload, list, analyze, quiz, flashcards) runs as its own phase
+so peak RSS can be attributed to it; `extract:<media>` is the time from upload
+until the document is ready.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="LearnSync API benchmark with an offline fake LLM")
+    parser.add_argument("--documents", type=int, default=24, help="corpus size (cycles through PDFs, images and WAVs)")
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=48, help="requests per workload after the uploads")
+    parser.add_argument("--workloads", default="upload,list,analyze,quiz,flashcards")
+    parser.add_argument("--latency-ms", type=float, default=200, help="fake LLM latency per call")
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of LLM calls failing with a retryable error")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm-cache", action="store_true", help="keep the persistent LLM response cache enabled")
+    parser.add_argument("--out", help="write results as JSON")
+    parser.add_argument("--compare", help="baseline results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent change reported as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    return parser.parse_args(argv)
+
+def _configure_environment(args, workdir: str):
+    """Must run before the app is imported: everything lives in a throwaway directory"""
+    os.environ.update({
+        "SQLALCHEMY_DATABASE_URL": f"sqlite:///{workdir}/bench.db",
+        "LLM_CACHE_PATH": f"{workdir}/llm_cache.db",
+        "LLM_CACHE_ENABLED": "1" if args.llm_cache else "0",
+        "GEMINI_API_KEY": "benchmark",
+        "AUTO_MIGRATE": "1",
+        # The fake has no quota; keep the in-flight cap and retries realistic
+        "GEMINI_RPM": "1000000",
+        "LLM_BACKOFF_BASE_SECONDS": "0.05",
+    })
+    os.chdir(workdir)
+    sys.path.insert(0, BACKEND_DIR)
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Peak since start (KB on Linux, bytes on macOS); good enough off Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+class RSSSampler:
+    """Highest resident set size seen while the block runs"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, _rss_bytes())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.start_rss = _rss_bytes()
+        self.peak = self.start_rss
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_bytes())
+
+def _percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def summarize(latencies: list, errors: int, wall_seconds: float, sampler: RSSSampler) -> dict:
+    values = sorted(latencies)
+    return {
+        "requests": len(values) + errors,
+        "errors": errors,
+        "throughput_rps": round(len(values) / wall_seconds, 2) if wall_seconds > 0 else 0.0,
+        "mean_ms": round(1000 * sum(values) / len(values), 1) if values else 0.0,
+        "p50_ms": round(1000 * _percentile(values, 50), 1),
+        "p95_ms": round(1000 * _percentile(values, 95), 1),
+        "p99_ms": round(1000 * _percentile(values, 99), 1),
+        "max_ms": round(1000 * values[-1], 1) if values else 0.0,
+        "peak_rss_mb": round(sampler.peak / 2 ** 20, 1),
+        "rss_growth_mb": round((sampler.peak - sampler.start_rss) / 2 ** 20, 1),
+    }
+
+async def _timed_request(client, method: str, url: str, **kwargs):
+    started = time.perf_counter()
+    response = await client.request(method, url, **kwargs)
+    return response, time.perf_counter() - started
+
+async def _run_phase(name: str, calls: list, concurrency: int, results: dict):
+    """Run the (client, method, url, kwargs) calls with bounded concurrency and record their latencies.
+
+    Returns (response, finished_at) per call, in order.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def run(call):
+        nonlocal errors
+        client, method, url, kwargs = call
+        async with semaphore:
+            response, elapsed = await _timed_request(client, method, url, **kwargs)
+        if response.status_code < 400:
+            latencies.append(elapsed)
+        else:
+            errors += 1
+        return response, time.perf_counter()
+
+    with RSSSampler() as sampler:
+        started = time.perf_counter()
+        responses = await asyncio.gather(*(run(call) for call in calls))
+        wall = time.perf_counter() - started
+    results[name] = summarize(latencies, errors, wall, sampler)
+    return responses
+
+async def _wait_until_processed(client, documents: list, headers_for: dict, results: dict, timeout: float = 600):
+    """extract:<media> = upload to ready/failed, polled every 50 ms"""
+    pending = {doc["id"]: doc for doc in documents}
+    latencies = {}
+    failures = {}
+    with RSSSampler() as sampler:
+        started = time.perf_counter()
+        while pending and time.perf_counter() - started < timeout:
+            for doc_id, doc in list(pending.items()):
+                response = await client.get(f"/documents/{doc_id}/status", headers=headers_for[doc_id])
+                status = response.json().get("status") if response.status_code == 200 else None
+                if status in ("ready", "failed"):
+                    media = doc["media_type"]
+                    if status == "ready":
+                        latencies.setdefault(media, []).append(time.perf_counter() - doc["uploaded_at"])
+                    else:
+                        failures[media] = failures.get(media, 0) + 1
+                    del pending[doc_id]
+            await asyncio.sleep(0.05)
+        wall = time.perf_counter() - started
+    for media in sorted(set(latencies) | set(failures)):
+        results[f"extract:{media}"] = summarize(latencies.get(media, []), failures.get(media, 0), wall, sampler)
+    if pending:
+        print(f"{len(pending)} documents still processing after {timeout:.0f}s")
+
+async def run_benchmark(args) -> dict:
+    import httpx
+    import main as app_module
+    from benchmarks import corpus, fake_llm
+
+    provider = fake_llm.install(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, failure_rate=args.failure_rate, seed=args.seed
+    )
+    rng = random.Random(args.seed)
+    workloads = [w.strip() for w in args.workloads.split(",") if w.strip()]
+    results = {}
+
+    print(f"Building corpus of {args.documents} documents...")
+    files = corpus.build(args.documents, seed=args.seed)
+
+    app = app_module.app
+    transport = httpx.ASGITransport(app=app)
+    # ASGITransport doesn't send lifespan events; run startup/shutdown (job workers) here
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            users = []
+            for index in range(args.users):
+                credentials = {"email": f"bench{index}@example.com", "password": "benchmark"}
+                await client.post("/auth/register", json={**credentials, "full_name": f"Bench {index}"})
+                token = (await client.post(
+                    "/auth/token", data={"username": credentials["email"], "password": credentials["password"]}
+                )).json()["access_token"]
+                headers = {"Authorization": f"Bearer {token}"}
+                course = (await client.post("/courses/", json={"title": f"Course {index}"}, headers=headers)).json()
+                users.append((headers, course["id"]))
+
+            # Uploads (always needed by the other workloads)
+            calls = []
+            for index, file in enumerate(files):
+                headers, course_id = users[index % len(users)]
+                calls.append((client, "POST", "/documents/upload", {
+                    "files": {"file": (file.filename, file.content, file.content_type)},
+                    "data": {"course_id": str(course_id)},
+                    "headers": headers,
+                }))
+            print("Uploading...")
+            responses = await _run_phase("upload", calls, args.concurrency, results)
+            documents, headers_for = [], {}
+            for index, (response, uploaded_at) in enumerate(responses):
+                if response.status_code < 400:
+                    doc = response.json()
+                    documents.append({"id": doc["id"], "media_type": doc["media_type"], "uploaded_at": uploaded_at})
+                    headers_for[doc["id"]] = users[index % len(users)][0]
+            print("Waiting for extraction...")
+            await _wait_until_processed(client, documents, headers_for, results)
+            if "upload" not in workloads:
+                del results["upload"]
+
+            ready = [doc["id"] for doc in documents]
+            endpoints = {
+                "list": lambda doc_id: ("GET", "/documents/", {"params": {"limit": 50}}),
+                "analyze": lambda doc_id: ("POST", f"/documents/{doc_id}/analyze", {"params": {"refresh": "true"}}),
+                "quiz": lambda doc_id: ("POST", f"/documents/{doc_id}/quiz", {}),
+                "flashcards": lambda doc_id: ("POST", f"/documents/{doc_id}/flashcards", {}),
+            }
+            for workload in workloads:
+                if workload == "upload":
+                    continue
+                if workload not in endpoints:
+                    print(f"Unknown workload {workload!r}, skipped")
+                    continue
+                calls = []
+                for _ in range(args.requests):
+                    doc_id = rng.choice(ready)
+                    method, url, kwargs = endpoints[workload](doc_id)
+                    calls.append((client, method, url, {**kwargs, "headers": headers_for[doc_id]}))
+                print(f"Running {workload}...")
+                await _run_phase(workload, calls, args.concurrency, results)
+
+    return {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare", "fail_on_regression")},
+            "llm_calls": provider.calls,
+            "llm_injected_failures": provider.failures,
+        },
+        "endpoints": results,
+    }
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+COLUMNS = ("requests", "errors", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "peak_rss_mb")
+# For these, lower is better; for throughput, higher is better
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "peak_rss_mb")
+
+def print_table(results: dict):
+    print(f"\n{'endpoint':<16}" + "".join(f"{column:>16}" for column in COLUMNS))
+    for name, stats in results["endpoints"].items():
+        print(f"{name:<16}" + "".join(f"{stats[column]:>16}" for column in COLUMNS))
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Print per-endpoint changes against a baseline run; returns the regressions"""
+    regressions = []
+    print(f"\nCompared with {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')}):")
+    print(f"{'endpoint':<16}" + "".join(f"{column:>24}" for column in LOWER_IS_BETTER + ("throughput_rps",)))
+    for name, stats in results["endpoints"].items():
+        before = baseline["endpoints"].get(name)
+        if before is None:
+            continue
+        cells = []
+        for column in LOWER_IS_BETTER + ("throughput_rps",):
+            old, new = before[column], stats[column]
+            change = 100.0 * (new - old) / old if old else 0.0
+            worse = change > threshold if column in LOWER_IS_BETTER else change < -threshold
+            if worse:
+                regressions.append((name, column, old, new))
+            cells.append(f"{old}->{new} ({change:+.0f}%){'!' if worse else ''}")
+        print(f"{name:<16}" + "".join(f"{cell:>24}" for cell in cells))
+    return regressions
+
+def main(argv=None):
+    args = _parse_args(argv)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    out = os.path.abspath(args.out) if args.out else None
+
+    workdir = tempfile.mkdtemp(prefix="learnsync-bench-")
+    _configure_environment(args, workdir)
+    try:
+        results = asyncio.run(run_benchmark(args))
+    finally:
+        os.chdir(BACKEND_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+    print_table(results)
+
+    if out:
+        with open(out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {out}")
+    if baseline:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
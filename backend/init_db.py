@@ -4,11 +4,10 @@ import os
 # Add parent directory to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from database import engine, Base
-from models import User, Document, Quiz, FlashcardDeck
+import migrations
 
-# Create all tables
-Base.metadata.create_all(bind=engine)
+# Create all tables, or bring an existing database up to date
+migrations.upgrade()
 
 print("✅ Database initialized successfully!")
-print("📊 Tables created: users, documents, quizzes, flashcard_decks")
+print(f"📊 Schema version {migrations.current_version()}: users, documents, quizzes, quiz_questions, flashcard_decks, flashcards, card_reviews, jobs, transcript_segments, remote_files, documents_fts")
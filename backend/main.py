@@ -1,16 +1,24 @@
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse
+from sqlalchemy import text
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import os
+import time
 
 # Import routers
-from routers import auth, upload, analysis, study_tools, courses
+from routers import auth, upload, analysis, study_tools, courses, reviews, search as search_router
 # Import models to register them with SQLAlchemy
 import models
 import database
+import migrations
+import security
+from services import jobs, cache, llm_cache, ai_engine, remote_files, metrics
 
-# Create tables (checkfirst=True prevents errors if tables exist)
-database.Base.metadata.create_all(bind=database.engine, checkfirst=True)
+# Schema changes are applied by `python migrations.py` before the workers start;
+# with AUTO_MIGRATE=1 each worker applies pending ones on startup instead.
+# A database without any schema yet (fresh checkout) is always set up on startup.
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "0") == "1"
 
 app = FastAPI(title="LearnSync AI", version="1.0.0")
 
@@ -22,7 +30,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing"],
 )
+# Request latency per route and per-stage Server-Timing headers, see services/metrics.py
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Create uploads directory if it doesn't exist
 os.makedirs("uploads", exist_ok=True)
@@ -31,17 +42,73 @@ app.mount("/static", StaticFiles(directory="uploads"), name="static")
 # Include routers AFTER CORS
 app.include_router(auth.router)
 app.include_router(courses.router)
+# Before the document routers so /documents/search isn't taken for a document id
+app.include_router(search_router.router)
 app.include_router(upload.router)
 app.include_router(analysis.router)
 app.include_router(study_tools.router)
+app.include_router(reviews.router)
+
+# Registered first: the other startup hooks query the database
+@app.on_event("startup")
+def apply_migrations():
+    version = migrations.current_version()
+    if AUTO_MIGRATE or version == 0:
+        migrations.upgrade()
+        return
+    waiting = migrations.pending()
+    if waiting:
+        raise RuntimeError(
+            f"Database schema is at version {version}, {len(waiting)} migrations pending: "
+            f"run `python migrations.py` (or set AUTO_MIGRATE=1)"
+        )
+
+@app.on_event("startup")
+def start_job_workers():
+    jobs.start()
+
+@app.on_event("startup")
+def purge_stale_llm_responses():
+    removed = llm_cache.purge_stale(ai_engine.PROMPT_VERSIONS)
+    if removed:
+        print(f"Purged {removed} stale cached LLM responses")
+
+@app.on_event("startup")
+def start_remote_file_gc():
+    remote_files.start_gc()
+
+@app.on_event("shutdown")
+def stop_job_workers():
+    jobs.shutdown()
+
+@app.on_event("shutdown")
+def stop_remote_file_gc():
+    remote_files.stop_gc()
 
 @app.get("/")
 async def root():
     return {"message": "LearnSync AI Backend is running", "status": "ok"}
 
 @app.get("/health")
-async def health_check():
-    return {"status": "healthy", "database": "connected"}
+def health_check():
+    started = time.perf_counter()
+    try:
+        with database.engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except Exception as e:
+        # The error can include SQL and connection details, so it is only logged
+        print(f"Health check failed: {e}")
+        return JSONResponse(status_code=503, content={"status": "unhealthy"})
+    return {"status": "healthy", "database": "connected", "database_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Prometheus text exposition format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    return {**cache.cache_stats(), "llm_responses": llm_cache.stats(), "principals": security.principal_cache_stats(), "remote_files": remote_files.stats()}
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,128 @@
+import sys
+from datetime import datetime
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+import database
+import models
+from services import search, srs
+
+# Versioned schema migrations. The applied versions are recorded in the
+# schema_version table; `python migrations.py` (or init_db.py) applies the
+# pending ones. Run it once per deploy before starting the workers, or set
+# AUTO_MIGRATE=1 to apply them on application startup.
+#
+# Every step must be safe on databases created by any earlier release: version 1
+# creates missing tables from the current models, so later steps only add what
+# create_all skips on tables that already existed (columns, indexes) and must
+# check before they change anything.
+
+def _columns(conn, table: str) -> set:
+    return {column["name"] for column in inspect(conn).get_columns(table)}
+
+def _add_columns(conn, table: str, columns: list):
+    """columns: [(name, "TYPE [DEFAULT ...]")], existing ones are skipped"""
+    existing = _columns(conn, table)
+    for name, ddl in columns:
+        if name not in existing:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+            print(f"Added column {table}.{name}")
+
+def _create_indexes(conn, model):
+    for index in model.__table__.indexes:
+        index.create(conn, checkfirst=True)
+
+def _create_tables(conn):
+    database.Base.metadata.create_all(bind=conn, checkfirst=True)
+
+def _add_missing_columns(conn):
+    """Columns added to tables that databases from earlier releases already have"""
+    _add_columns(conn, "users", [("password_changed_at", "DATETIME")])
+    _add_columns(conn, "documents", [
+        ("content_hash", "VARCHAR"),
+        ("language_stats", "TEXT"),
+        ("status", "VARCHAR DEFAULT 'ready'"),
+    ])
+    _add_columns(conn, "jobs", [
+        ("progress", "INTEGER DEFAULT 0"),
+        ("total", "INTEGER DEFAULT 0"),
+        ("result", "TEXT"),
+        ("course_id", "INTEGER REFERENCES courses (id)"),
+    ])
+    for model in (models.User, models.Document, models.Job):
+        _create_indexes(conn, model)
+
+def _create_search_index(conn):
+    if search.init_index(conn):
+        search.rebuild_index(Session(bind=conn))
+
+def _create_flight_leases(conn):
+    models.FlightLease.__table__.create(conn, checkfirst=True)
+
+def _move_legacy_study_items(conn):
+    moved = srs.backfill_legacy(Session(bind=conn))
+    if moved:
+        print(f"Moved {moved} legacy quizzes/decks into question and card rows")
+
+def _add_job_heartbeats(conn):
+    _add_columns(conn, "jobs", [("worker", "VARCHAR"), ("heartbeat_at", "DATETIME")])
+
+# (version, description, step); append new steps, never edit applied ones
+MIGRATIONS = [
+    (1, "create tables", _create_tables),
+    (2, "add columns and indexes missing from older databases", _add_missing_columns),
+    (3, "full-text search index", _create_search_index),
+    (4, "single-flight leases", _create_flight_leases),
+    (5, "move legacy quiz and deck JSON into rows", _move_legacy_study_items),
+    (6, "job worker heartbeats", _add_job_heartbeats),
+]
+
+def _ensure_version_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            "version INTEGER PRIMARY KEY, description VARCHAR, applied_at TIMESTAMP)"
+        ))
+
+def current_version(engine=None) -> int:
+    engine = engine or database.engine
+    if not inspect(engine).has_table("schema_version"):
+        return 0
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+def pending(engine=None) -> list:
+    version = current_version(engine)
+    return [(number, description) for number, description, _ in MIGRATIONS if number > version]
+
+def upgrade(engine=None) -> list:
+    """Apply pending migrations in order; returns the versions applied"""
+    engine = engine or database.engine
+    _ensure_version_table(engine)
+    applied = []
+    for number, description, step in MIGRATIONS:
+        if number <= current_version(engine):
+            continue
+        try:
+            # Each step commits together with its version row. Inserting the row
+            # first takes the write lock, so a concurrent upgrade waits and then
+            # fails on the primary key instead of applying the step twice.
+            with engine.begin() as conn:
+                conn.execute(
+                    text("INSERT INTO schema_version (version, description, applied_at) VALUES (:v, :d, :t)"),
+                    {"v": number, "d": description, "t": datetime.utcnow()}
+                )
+                step(conn)
+        except IntegrityError:
+            print(f"Migration {number} was applied by another process")
+            continue
+        print(f"Applied migration {number}: {description}")
+        applied.append(number)
+    return applied
+
+if __name__ == "__main__":
+    if "--status" in sys.argv[1:]:
+        print(f"Schema version {current_version()}, pending: {pending() or 'none'}")
+    else:
+        applied = upgrade()
+        print(f"Schema is at version {current_version()} ({len(applied)} migrations applied)")
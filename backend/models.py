@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Enum, Text, DateTime
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Enum, Text, DateTime, Float, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 import enum
 from datetime import datetime
@@ -17,6 +17,7 @@ class User(database.Base):
     hashed_password = Column(String)
     is_active = Column(Boolean, default=True)
     preferred_language = Column(String, default="ar")
+    password_changed_at = Column(DateTime, nullable=True)
 
     # Relationships
     documents = relationship("Document", back_populates="owner")
@@ -39,12 +40,15 @@ class Document(database.Base):
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String, index=True)
     file_path = Column(String)
+    content_hash = Column(String, index=True, nullable=True) # SHA-256 of the uploaded bytes
     upload_date = Column(DateTime, default=datetime.utcnow)
     media_type = Column(String, default="pdf", index=True) # pdf, audio, video, image
     extracted_text = Column(Text, nullable=True)
-    language = Column(String, default="en") # Detected language
+    language = Column(String, default="en") # Detected (dominant) language
+    language_stats = Column(Text, nullable=True) # JSON: script shares and per-page/segment language tags
     summary = Column(Text, nullable=True)
     key_concepts = Column(Text, nullable=True) # Stored as JSON string potentially
+    status = Column(String, default="ready", index=True) # processing, ready, failed
     
     owner_id = Column(Integer, ForeignKey("users.id"), index=True)
     owner = relationship("User", back_populates="documents")
@@ -52,9 +56,88 @@ class Document(database.Base):
     course_id = Column(Integer, ForeignKey("courses.id"), index=True, nullable=True)
     course = relationship("Course", back_populates="documents")
     
+    # Keyset pagination indexes for listings (newest first)
+    __table_args__ = (
+        Index("ix_documents_owner_upload", "owner_id", "upload_date", "id"),
+        Index("ix_documents_course_upload", "course_id", "upload_date", "id"),
+    )
+
     # Relationships
     quizzes = relationship("Quiz", back_populates="document")
     flashcard_decks = relationship("FlashcardDeck", back_populates="document")
+    jobs = relationship("Job", back_populates="document")
+    transcript_segments = relationship("TranscriptSegment", back_populates="document", order_by="TranscriptSegment.index")
+
+# Large text columns that document listings don't load
+DOCUMENT_TEXT_COLUMNS = (Document.extracted_text, Document.summary, Document.key_concepts, Document.language_stats)
+
+class Job(database.Base):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, index=True) # extract, study_pack
+    status = Column(String, default="queued", index=True) # queued, running, done, failed
+    attempts = Column(Integer, default=0)
+    error = Column(Text, nullable=True)
+    progress = Column(Integer, default=0) # items finished so far
+    total = Column(Integer, default=0)
+    result = Column(Text, nullable=True) # JSON, kind specific
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    worker = Column(String, nullable=True) # host:pid:boot of the process running it
+    heartbeat_at = Column(DateTime, nullable=True) # renewed while it runs
+
+    document_id = Column(Integer, ForeignKey("documents.id"), index=True, nullable=True)
+    document = relationship("Document", back_populates="jobs")
+    course_id = Column(Integer, ForeignKey("courses.id"), index=True, nullable=True)
+
+class TranscriptSegment(database.Base):
+    """One time slice of an audio/video document, transcribed independently"""
+    __tablename__ = "transcript_segments"
+
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), index=True)
+    index = Column(Integer)
+    start_seconds = Column(Float)
+    end_seconds = Column(Float, nullable=True) # None when the length is unknown (whole file)
+    status = Column(String, default="pending") # pending, done, failed
+    attempts = Column(Integer, default=0)
+    text = Column(Text, nullable=True) # "[mm:ss] ..." lines relative to start_seconds
+    error = Column(Text, nullable=True)
+
+    document = relationship("Document", back_populates="transcript_segments")
+
+    __table_args__ = (
+        UniqueConstraint("document_id", "index", name="uq_transcript_segments_document_index"),
+    )
+
+class RemoteFile(database.Base):
+    """A file uploaded to the LLM provider's file API, reusable until it expires"""
+    __tablename__ = "remote_files"
+
+    id = Column(Integer, primary_key=True, index=True)
+    content_hash = Column(String, index=True)
+    mime_type = Column(String)
+    key_id = Column(String) # uploads belong to the API key's project
+    name = Column(String) # provider file name, e.g. files/abc123
+    uri = Column(String)
+    size_bytes = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, index=True)
+    last_used_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("content_hash", "mime_type", "key_id", name="uq_remote_files_content"),
+    )
+
+class FlightLease(database.Base):
+    """Cross-process lock on an in-flight computation, see services/singleflight.py"""
+    __tablename__ = "flight_leases"
+
+    key = Column(String, primary_key=True)
+    owner = Column(String) # host:pid:flight of the leader
+    expires_at = Column(DateTime) # renewed while the leader is working
 
 class Quiz(database.Base):
     __tablename__ = "quizzes"
@@ -63,9 +146,22 @@ class Quiz(database.Base):
     document_id = Column(Integer, ForeignKey("documents.id"))
     created_at = Column(DateTime, default=datetime.utcnow)
     title = Column(String)
-    questions = Column(Text) # JSON string of questions
+    questions = Column(Text, nullable=True) # legacy JSON blob, moved into quiz_questions rows
     
     document = relationship("Document", back_populates="quizzes")
+    items = relationship("QuizQuestion", back_populates="quiz", order_by="QuizQuestion.position", cascade="all, delete-orphan")
+
+class QuizQuestion(database.Base):
+    __tablename__ = "quiz_questions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    quiz_id = Column(Integer, ForeignKey("quizzes.id"), index=True)
+    position = Column(Integer)
+    question = Column(Text)
+    options = Column(Text) # JSON list of answer options
+    correct_answer_index = Column(Integer)
+
+    quiz = relationship("Quiz", back_populates="items")
 
 class FlashcardDeck(database.Base):
     __tablename__ = "flashcard_decks"
@@ -74,6 +170,40 @@ class FlashcardDeck(database.Base):
     document_id = Column(Integer, ForeignKey("documents.id"))
     created_at = Column(DateTime, default=datetime.utcnow)
     title = Column(String)
-    cards = Column(Text) # JSON string of cards
+    cards = Column(Text, nullable=True) # legacy JSON blob, moved into flashcards rows
     
     document = relationship("Document", back_populates="flashcard_decks")
+    items = relationship("Flashcard", back_populates="deck", order_by="Flashcard.position", cascade="all, delete-orphan")
+
+class Flashcard(database.Base):
+    __tablename__ = "flashcards"
+
+    id = Column(Integer, primary_key=True, index=True)
+    deck_id = Column(Integer, ForeignKey("flashcard_decks.id"), index=True)
+    position = Column(Integer)
+    term = Column(Text)
+    definition = Column(Text)
+
+    deck = relationship("FlashcardDeck", back_populates="items")
+
+class CardReview(database.Base):
+    """Per-user SM-2 review state of one flashcard"""
+    __tablename__ = "card_reviews"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    flashcard_id = Column(Integer, ForeignKey("flashcards.id"), index=True)
+    ease_factor = Column(Float, default=2.5)
+    interval_days = Column(Integer, default=0)
+    repetitions = Column(Integer, default=0)
+    lapses = Column(Integer, default=0)
+    due_at = Column(DateTime, default=datetime.utcnow)
+    last_reviewed_at = Column(DateTime, nullable=True)
+
+    flashcard = relationship("Flashcard")
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "flashcard_id", name="uq_card_reviews_user_card"),
+        # Due queue: range scan on (user_id, due_at <= now) ordered by due_at
+        Index("ix_card_reviews_user_due", "user_id", "due_at"),
+    )
@@ -1,7 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import models, database, security
-from services import ai_engine, cache
+from services import ai_engine, cache, storage, llm, search, sse, singleflight
 import json
 
 router = APIRouter(
@@ -9,45 +11,136 @@ router = APIRouter(
     tags=["analysis"]
 )
 
-@router.post("/{document_id}/analyze")
-def analyze_document(
-    document_id: int,
-    current_user: models.User = Depends(security.get_current_user_from_token),
-    db: Session = Depends(database.get_db)
-):
-    # Check cache first
-    cache_key = f"analyze_{document_id}"
-    cached_result = cache.get_cached_result(cache_key)
-    if cached_result:
-        return cached_result
-    
-    # Fetch doc
-    doc = db.query(models.Document).filter(models.Document.id == document_id, models.Document.owner_id == current_user.id).first()
+async def _get_analyzable_document(db: AsyncSession, document_id: int, user_id: int) -> models.Document:
+    doc = (await db.execute(
+        select(models.Document).where(models.Document.id == document_id, models.Document.owner_id == user_id)
+    )).scalar_one_or_none()
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
-    
     if not doc.extracted_text:
         raise HTTPException(status_code=400, detail="Document has no text to analyze")
+    return doc
 
-    # Perform Analysis in ONE call to save quota
-    analysis_result = ai_engine.analyze_document_content(doc.extracted_text, doc.language)
-    summary = analysis_result.get("summary", "Summary failed")
-    concepts_json = json.dumps(analysis_result.get("concepts", []))
+async def _reusable_analysis(db: AsyncSession, doc: models.Document):
+    """An identical upload may already be analyzed; returns its (summary, concepts_json) or None"""
+    existing = await db.run_sync(storage.find_reusable_document, doc.content_hash) if doc.content_hash else None
+    if existing and existing.id != doc.id and existing.summary:
+        return existing.summary, existing.key_concepts or "[]"
+    return None
 
-    # Update DB
+async def _save_analysis(db: AsyncSession, doc: models.Document, summary: str, concepts_json: str, user_id: int) -> dict:
+    """Persist an analysis, reindex the document and cache the response"""
     doc.summary = summary
     doc.key_concepts = concepts_json
-    
-    db.commit()
-    db.refresh(doc)
-    
+    await db.commit()
+    await db.run_sync(search.safe_index_document, doc)
+    return _cache_analysis(doc, user_id)
+
+def _cache_analysis(doc: models.Document, user_id: int) -> dict:
     result = {
         "id": doc.id,
         "summary": doc.summary,
-        "key_concepts": json.loads(doc.key_concepts)
+        "key_concepts": json.loads(doc.key_concepts or "[]")
     }
-    
-    # Cache the result
-    cache.set_cached_result(cache_key, result)
-    
+    cache.set_cached_result(cache.make_key("analyze", user_id, doc.id), result, tags=cache.tags_for(user_id, doc.id))
     return result
+
+@router.post("/{document_id}/analyze")
+async def analyze_document(
+    document_id: int,
+    refresh: bool = False,
+    current_user: security.Principal = Depends(security.get_current_user_from_token),
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    # Check cache first (keys are scoped per user and document)
+    cache_key = cache.make_key("analyze", current_user.id, document_id)
+    if refresh:
+        cache.invalidate_document(document_id)
+    else:
+        cached_result = cache.get_cached_result(cache_key)
+        if cached_result:
+            return cached_result
+
+    previous_summary = (await _get_analyzable_document(db, document_id, current_user.id)).summary
+    user_id = current_user.id
+    # Hand the connection back to the pool while waiting on the flight
+    await db.close()
+
+    async def analyze():
+        # Its own session: the flight may outlive the request that started it
+        async with database.async_session() as session:
+            doc = await session.get(models.Document, document_id)
+            reused = None if refresh else await _reusable_analysis(session, doc)
+            if reused:
+                summary, concepts_json = reused
+            else:
+                # Perform Analysis in ONE call to save quota
+                try:
+                    analysis_result = await ai_engine.analyze_document_content(doc.extracted_text, doc.language)
+                except llm.LLMResponseError as e:
+                    raise HTTPException(status_code=502, detail=f"AI service returned an invalid response, please retry: {e}")
+                except llm.LLMError as e:
+                    raise HTTPException(status_code=503, detail=f"AI service unavailable, please retry: {e}")
+                summary = analysis_result.get("summary", "Summary failed")
+                concepts_json = json.dumps(analysis_result.get("concepts", []))
+            return await _save_analysis(session, doc, summary, concepts_json, user_id)
+
+    async def analyzed_elsewhere():
+        # Another worker process held the lease: reuse the analysis it saved meanwhile
+        async with database.async_session() as session:
+            doc = await session.get(models.Document, document_id)
+            if doc and doc.summary and doc.summary != previous_summary:
+                return _cache_analysis(doc, user_id)
+        return None
+
+    # Concurrent requests for the same document share one analysis and one commit, also across worker processes
+    flight_key = cache.make_key("analyze", None, document_id, *(["refresh"] if refresh else []))
+    return await singleflight.run(flight_key, analyze, recheck=analyzed_elsewhere, lease=True)
+
+@router.post("/{document_id}/analyze/stream")
+async def analyze_document_stream(
+    document_id: int,
+    refresh: bool = False,
+    current_user: security.Principal = Depends(security.get_current_user_from_token),
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    """Server-sent events: `progress` events while a long document's sections are analyzed,
+    `summary` events carry text as it is generated, `done` carries the saved analysis"""
+    cache_key = cache.make_key("analyze", current_user.id, document_id)
+    if refresh:
+        cache.invalidate_document(document_id)
+    cached_result = None if refresh else cache.get_cached_result(cache_key)
+
+    doc = await _get_analyzable_document(db, document_id, current_user.id)
+    reused = None if refresh or cached_result else await _reusable_analysis(db, doc)
+    text, language, user_id = doc.extracted_text, doc.language, current_user.id
+
+    async def events():
+        if cached_result:
+            yield sse.format_event("done", cached_result)
+            return
+        if reused:
+            summary, concepts_json = reused
+        else:
+            try:
+                async for kind, payload in ai_engine.stream_analysis(text, language):
+                    if kind == "summary":
+                        yield sse.format_event("summary", {"text": payload})
+                    elif kind == "progress":
+                        yield sse.format_event("progress", payload)
+                    else:
+                        summary, concepts_json = payload["summary"], json.dumps(payload["concepts"])
+            except llm.LLMResponseError as e:
+                yield sse.format_event("error", {"detail": f"AI service returned an invalid response, please retry: {e}"})
+                return
+            except llm.LLMError as e:
+                yield sse.format_event("error", {"detail": f"AI service unavailable, please retry: {e}"})
+                return
+
+        # The request's session may already be closed once streaming starts
+        async with database.async_session() as session:
+            doc = await session.get(models.Document, document_id)
+            result = await _save_analysis(session, doc, summary, concepts_json, user_id)
+        yield sse.format_event("done", result)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=sse.STREAM_HEADERS)
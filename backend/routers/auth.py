@@ -2,7 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 import models, schemas, security, database
 from fastapi.security import OAuth2PasswordRequestForm
-from datetime import timedelta
+from datetime import datetime, timedelta
 
 router = APIRouter(
     prefix="/auth",
@@ -30,7 +30,7 @@ def register(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
 @router.post("/token", response_model=schemas.Token)
 def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
     user = db.query(models.User).filter(models.User.email == form_data.username).first()
-    if not user or not security.verify_password(form_data.password, user.hashed_password):
+    if not user or not user.is_active or not security.verify_password(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -39,6 +39,31 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db:
     
     access_token_expires = timedelta(minutes=security.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = security.create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data={"sub": user.email, "uid": user.id}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
+
+@router.post("/change-password", status_code=status.HTTP_204_NO_CONTENT)
+def change_password(
+    body: schemas.PasswordChange,
+    current_user: security.Principal = Depends(security.get_current_user_from_token),
+    db: Session = Depends(database.get_db)
+):
+    """Set a new password; tokens issued before the change stop working"""
+    user = db.get(models.User, current_user.id)
+    if not security.verify_password(body.current_password, user.hashed_password):
+        raise HTTPException(status_code=400, detail="Current password is incorrect")
+    user.hashed_password = security.get_password_hash(body.new_password)
+    user.password_changed_at = datetime.utcnow()
+    db.commit()
+    security.invalidate_user(user.id)
+
+@router.post("/deactivate", status_code=status.HTTP_204_NO_CONTENT)
+def deactivate_account(
+    current_user: security.Principal = Depends(security.get_current_user_from_token),
+    db: Session = Depends(database.get_db)
+):
+    user = db.get(models.User, current_user.id)
+    user.is_active = False
+    db.commit()
+    security.invalidate_user(user.id)
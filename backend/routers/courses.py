@@ -1,7 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-import models, schemas, database, security
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
+from sqlalchemy import select
+from sqlalchemy.orm import Session, defer
+from sqlalchemy.ext.asyncio import AsyncSession
+import models, schemas, schemas_study, database, security
+from services import ai_engine, llm, vector_index, pagination, jobs, study_pack, language
+from typing import List, Optional
+import asyncio
+import json
 
 router = APIRouter(
     prefix="/courses",
@@ -12,7 +17,7 @@ router = APIRouter(
 def create_course(
     course: schemas.CourseCreate,
     db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(security.get_current_user_from_token)
+    current_user: security.Principal = Depends(security.get_current_user_from_token)
 ):
     print(f"Creating course '{course.title}' for user {current_user.id}")
     new_course = models.Course(
@@ -33,7 +38,7 @@ def create_course(
 @router.get("/", response_model=List[schemas.Course])
 def list_courses(
     db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(security.get_current_user_from_token)
+    current_user: security.Principal = Depends(security.get_current_user_from_token)
 ):
     return db.query(models.Course).filter(models.Course.owner_id == current_user.id).all()
 
@@ -41,7 +46,7 @@ def list_courses(
 def get_course(
     course_id: int,
     db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(security.get_current_user_from_token)
+    current_user: security.Principal = Depends(security.get_current_user_from_token)
 ):
     course = db.query(models.Course).filter(
         models.Course.id == course_id, 
@@ -51,11 +56,14 @@ def get_course(
         raise HTTPException(status_code=404, detail="Course not found")
     return course
 
-@router.get("/{course_id}/documents", response_model=List[schemas.Document])
+@router.get("/{course_id}/documents", response_model=List[schemas.DocumentSummary])
 def list_course_documents(
     course_id: int,
+    response: Response,
+    limit: int = Query(100, ge=1, le=200),
+    cursor: Optional[str] = None,
     db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(security.get_current_user_from_token)
+    current_user: security.Principal = Depends(security.get_current_user_from_token)
 ):
     # Verify course belongs to user
     course = db.query(models.Course).filter(
@@ -64,5 +72,95 @@ def list_course_documents(
     ).first()
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
-        
-    return db.query(models.Document).filter(models.Document.course_id == course_id).all()
+
+    query = db.query(models.Document).options(
+        *[defer(column) for column in models.DOCUMENT_TEXT_COLUMNS]
+    ).filter(models.Document.course_id == course_id)
+    try:
+        documents, next_cursor = pagination.keyset_page(query, models.Document.upload_date, models.Document.id, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return documents
+
+@router.post("/{course_id}/ask", response_model=schemas.CourseAnswer)
+async def ask_course(
+    course_id: int,
+    body: schemas.CourseQuestion,
+    db: AsyncSession = Depends(database.get_async_db),
+    current_user: security.Principal = Depends(security.get_current_user_from_token)
+):
+    course = (await db.execute(
+        select(models.Course).where(models.Course.id == course_id, models.Course.owner_id == current_user.id)
+    )).scalar_one_or_none()
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found")
+
+    # Only the best matching chunks are sent to the LLM, not whole documents
+    hits = (await asyncio.to_thread(vector_index.retrieve, course_id, [body.question], max(1, min(body.k, 10))))[0]
+    if not hits:
+        return {"answer": "", "sources": []}
+
+    docs = {d.id: d for d in (await db.execute(
+        select(models.Document).where(models.Document.id.in_({h[0] for h in hits}))
+    )).scalars()}
+    sources = [
+        {"document_id": doc_id, "filename": docs[doc_id].filename, "excerpt": docs[doc_id].extracted_text[start:end], "score": score}
+        for doc_id, start, end, score in hits if doc_id in docs
+    ]
+
+    question_language = language.primary_language(language.detect(body.question))
+    try:
+        answer = await ai_engine.answer_question(body.question, [s["excerpt"] for s in sources], question_language)
+    except llm.LLMError as e:
+        raise HTTPException(status_code=503, detail=f"AI service unavailable, please retry: {e}")
+    return {"answer": answer, "sources": sources}
+
+def _get_own_course(db: Session, course_id: int, user_id: int) -> models.Course:
+    course = db.query(models.Course).filter(
+        models.Course.id == course_id,
+        models.Course.owner_id == user_id
+    ).first()
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found")
+    return course
+
+@router.post("/{course_id}/study-pack", response_model=schemas_study.StudyPackJob, status_code=status.HTTP_202_ACCEPTED)
+def create_study_pack(
+    course_id: int,
+    refresh: bool = False,
+    db: Session = Depends(database.get_db),
+    current_user: security.Principal = Depends(security.get_current_user_from_token)
+):
+    """Generate analysis, quiz and flashcards for every document of the course in the background.
+
+    Documents that already have all three are skipped unless refresh is set.
+    Poll GET /courses/{course_id}/study-pack for progress and the combined pack.
+    """
+    _get_own_course(db, course_id, current_user.id)
+
+    # One pack per course at a time
+    active = db.query(models.Job).filter(
+        models.Job.kind == "study_pack",
+        models.Job.course_id == course_id,
+        models.Job.status.in_(["queued", "running"])
+    ).first()
+    if active:
+        return active
+    return jobs.enqueue(db, "study_pack", course_id=course_id, result=json.dumps({"refresh": refresh, "documents": {}}))
+
+@router.get("/{course_id}/study-pack", response_model=schemas_study.StudyPack)
+def get_study_pack(
+    course_id: int,
+    db: Session = Depends(database.get_db),
+    current_user: security.Principal = Depends(security.get_current_user_from_token)
+):
+    _get_own_course(db, course_id, current_user.id)
+    job = db.query(models.Job).filter(
+        models.Job.kind == "study_pack",
+        models.Job.course_id == course_id
+    ).order_by(models.Job.id.desc()).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="No study pack has been requested for this course")
+    return study_pack.build_pack(db, job)
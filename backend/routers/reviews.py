@@ -0,0 +1,50 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+import models, database, security, schemas_study
+from services import srs
+from typing import List
+
+router = APIRouter(
+    prefix="/reviews",
+    tags=["reviews"]
+)
+
+def _due_card(review: models.CardReview, card: models.Flashcard) -> dict:
+    return {
+        "flashcard_id": card.id,
+        "deck_id": card.deck_id,
+        "term": card.term,
+        "definition": card.definition,
+        "due_at": review.due_at,
+        "interval_days": review.interval_days,
+        "repetitions": review.repetitions,
+        "ease_factor": review.ease_factor
+    }
+
+@router.get("/due", response_model=List[schemas_study.DueCard])
+def get_due_cards(
+    limit: int = Query(20, ge=1, le=200),
+    db: Session = Depends(database.get_db),
+    current_user: security.Principal = Depends(security.get_current_user_from_token)
+):
+    """Next cards to review across all of the user's decks, most overdue first"""
+    return [_due_card(review, card) for review, card in srs.due_cards(db, current_user.id, limit)]
+
+@router.post("/{flashcard_id}", response_model=schemas_study.DueCard)
+def review_card(
+    flashcard_id: int,
+    body: schemas_study.ReviewGrade,
+    db: Session = Depends(database.get_db),
+    current_user: security.Principal = Depends(security.get_current_user_from_token)
+):
+    """Record an answer (grade 0-5) and reschedule the card"""
+    review = db.query(models.CardReview).filter(
+        models.CardReview.user_id == current_user.id,
+        models.CardReview.flashcard_id == flashcard_id
+    ).first()
+    if not review:
+        raise HTTPException(status_code=404, detail="Card not found")
+
+    srs.schedule(review, body.grade)
+    db.commit()
+    return _due_card(review, review.flashcard)
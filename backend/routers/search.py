@@ -0,0 +1,20 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+import schemas, database, security
+from services import search
+from typing import List, Optional
+
+router = APIRouter(
+    prefix="/documents",
+    tags=["search"]
+)
+
+@router.get("/search", response_model=List[schemas.SearchResult])
+def search_documents(
+    q: str = Query(..., min_length=1),
+    course_id: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=100),
+    current_user: security.Principal = Depends(security.get_current_user_from_token),
+    db: Session = Depends(database.get_db)
+):
+    return search.search_documents(db, current_user.id, q, course_id=course_id, limit=limit)
@@ -1,79 +1,175 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import models, database, security, schemas_study
-from services import ai_engine
+from services import ai_engine, cache, llm, sse, study_pack, singleflight
 import json
+from datetime import datetime
 
 router = APIRouter(
     prefix="/documents",
     tags=["study-tools"]
 )
 
-@router.post("/{document_id}/quiz", response_model=schemas_study.Quiz)
-def generate_quiz(
-    document_id: int,
-    current_user: models.User = Depends(security.get_current_user_from_token),
-    db: Session = Depends(database.get_db)
-):
-    doc = db.query(models.Document).filter(models.Document.id == document_id, models.Document.owner_id == current_user.id).first()
+async def _get_document_with_text(db: AsyncSession, document_id: int, user_id: int) -> models.Document:
+    doc = (await db.execute(
+        select(models.Document).where(models.Document.id == document_id, models.Document.owner_id == user_id)
+    )).scalar_one_or_none()
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
-    
     if not doc.extracted_text:
         raise HTTPException(status_code=400, detail="Document has no text")
+    return doc
 
-    # Generate
-    questions_json = ai_engine.generate_quiz(doc.extracted_text, doc.language)
-    
-    # Save
-    new_quiz = models.Quiz(
-        document_id=doc.id,
-        title=f"Quiz for {doc.filename}",
-        questions=questions_json
-    )
-    db.add(new_quiz)
-    db.commit()
-    db.refresh(new_quiz)
-    
-    # Deserialize for response matching schema
-    return {
-        "id": new_quiz.id,
-        "title": new_quiz.title,
-        "created_at": new_quiz.created_at,
-        "questions": json.loads(new_quiz.questions),
-        "document_id": new_quiz.document_id
-    }
+def _doc_info(doc: models.Document) -> dict:
+    return {"id": doc.id, "owner_id": doc.owner_id, "filename": doc.filename}
+
+async def _save_quiz(db: AsyncSession, doc: dict, questions: list) -> dict:
+    new_quiz = study_pack.add_quiz(db, doc["id"], doc["filename"], questions)
+    await db.commit()
+    return study_pack.quiz_payload(new_quiz)
+
+async def _save_deck(db: AsyncSession, doc: dict, cards: list) -> dict:
+    new_deck = study_pack.add_deck(db, doc["id"], doc["owner_id"], doc["filename"], cards)
+    await db.commit()
+    return study_pack.deck_payload(new_deck)
+
+def _created_since(model, payload, doc: dict, since: datetime):
+    """Flight recheck: the quiz or deck another worker saved for the document while this one waited"""
+    async def recheck():
+        async with database.async_session() as session:
+            def find(sync_session):
+                found = study_pack.created_since(sync_session, model, doc["id"], since)
+                return payload(found) if found else None
+            return await session.run_sync(find)
+    return recheck
+
+def _stream_items(doc: models.Document, generate, save):
+    """SSE response relaying `progress` and item events, then `done` with the saved result.
+
+    Nothing is saved when the response had no usable item.
+    """
+    text, language = doc.extracted_text, doc.language
+    info = _doc_info(doc)
+
+    async def events():
+        items = []
+        try:
+            async for event, payload in generate(text, language):
+                if event != "progress":
+                    items.append(payload)
+                yield sse.format_event(event, payload)
+        except llm.LLMResponseError as e:
+            yield sse.format_event("error", {"detail": f"AI service returned an invalid response, please retry: {e}"})
+            return
+        except llm.LLMError as e:
+            yield sse.format_event("error", {"detail": f"AI service unavailable, please retry: {e}"})
+            return
+
+        # The request's session may already be closed once streaming starts
+        async with database.async_session() as session:
+            result = await save(session, info, items)
+        yield sse.format_event("done", result)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=sse.STREAM_HEADERS)
+
+@router.post("/{document_id}/quiz", response_model=schemas_study.Quiz)
+async def generate_quiz(
+    document_id: int,
+    current_user: security.Principal = Depends(security.get_current_user_from_token),
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    doc = await _get_document_with_text(db, document_id, current_user.id)
+    text, language, info = doc.extracted_text, doc.language, _doc_info(doc)
+    # Hand the connection back to the pool while waiting on the flight
+    await db.close()
+
+    async def generate():
+        try:
+            questions_json = await ai_engine.generate_quiz(text, language)
+        except llm.LLMResponseError as e:
+            raise HTTPException(status_code=502, detail=f"AI service returned an invalid response, please retry: {e}")
+        except llm.LLMError as e:
+            raise HTTPException(status_code=503, detail=f"AI service unavailable, please retry: {e}")
+        async with database.async_session() as session:
+            return await _save_quiz(session, info, json.loads(questions_json))
+
+    # Concurrent requests for the same document get the same new quiz, also across worker processes
+    recheck = _created_since(models.Quiz, study_pack.quiz_payload, info, datetime.utcnow())
+    return await singleflight.run(cache.make_key("quiz", None, document_id), generate, recheck=recheck, lease=True)
+
+@router.post("/{document_id}/quiz/stream")
+async def generate_quiz_stream(
+    document_id: int,
+    current_user: security.Principal = Depends(security.get_current_user_from_token),
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    """Server-sent events: one `question` event per question as it is generated, then `done` with the saved quiz"""
+    doc = await _get_document_with_text(db, document_id, current_user.id)
+    return _stream_items(doc, ai_engine.stream_quiz, _save_quiz)
 
 @router.post("/{document_id}/flashcards", response_model=schemas_study.FlashcardDeck)
-def generate_flashcards(
+async def generate_flashcards(
     document_id: int,
-    current_user: models.User = Depends(security.get_current_user_from_token),
-    db: Session = Depends(database.get_db)
+    current_user: security.Principal = Depends(security.get_current_user_from_token),
+    db: AsyncSession = Depends(database.get_async_db)
 ):
-    doc = db.query(models.Document).filter(models.Document.id == document_id, models.Document.owner_id == current_user.id).first()
-    if not doc:
-        raise HTTPException(status_code=404, detail="Document not found")
-        
-    if not doc.extracted_text:
-        raise HTTPException(status_code=400, detail="Document has no text")
+    doc = await _get_document_with_text(db, document_id, current_user.id)
+    text, language, info = doc.extracted_text, doc.language, _doc_info(doc)
+    # Hand the connection back to the pool while waiting on the flight
+    await db.close()
+
+    async def generate():
+        try:
+            cards_json = await ai_engine.generate_flashcards(text, language)
+        except llm.LLMResponseError as e:
+            raise HTTPException(status_code=502, detail=f"AI service returned an invalid response, please retry: {e}")
+        except llm.LLMError as e:
+            raise HTTPException(status_code=503, detail=f"AI service unavailable, please retry: {e}")
+        async with database.async_session() as session:
+            return await _save_deck(session, info, json.loads(cards_json))
+
+    # Concurrent requests for the same document get the same new deck, also across worker processes
+    recheck = _created_since(models.FlashcardDeck, study_pack.deck_payload, info, datetime.utcnow())
+    return await singleflight.run(cache.make_key("flashcards", None, document_id), generate, recheck=recheck, lease=True)
+
+@router.post("/{document_id}/flashcards/stream")
+async def generate_flashcards_stream(
+    document_id: int,
+    current_user: security.Principal = Depends(security.get_current_user_from_token),
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    """Server-sent events: one `card` event per flashcard as it is generated, then `done` with the saved deck"""
+    doc = await _get_document_with_text(db, document_id, current_user.id)
+    return _stream_items(doc, ai_engine.stream_flashcards, _save_deck)
+
+@router.post("/{document_id}/study-set", response_model=schemas_study.StudySet)
+async def generate_study_set(
+    document_id: int,
+    current_user: security.Principal = Depends(security.get_current_user_from_token),
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    """Summary, key concepts, quiz and flashcards from a single LLM call, saved together"""
+    doc = await _get_document_with_text(db, document_id, current_user.id)
+
+    try:
+        artifacts = await ai_engine.generate_study_artifacts(doc.extracted_text, doc.language)
+    except llm.LLMResponseError as e:
+        raise HTTPException(status_code=502, detail=f"AI service returned an invalid response, please retry: {e}")
+    except llm.LLMError as e:
+        raise HTTPException(status_code=503, detail=f"AI service unavailable, please retry: {e}")
+
+    quiz, deck = await db.run_sync(study_pack.save_study_set, doc, artifacts)
+
+    # The analysis endpoint can now answer from cache
+    analysis = {"id": doc.id, "summary": doc.summary, "key_concepts": artifacts["concepts"]}
+    cache.set_cached_result(cache.make_key("analyze", current_user.id, doc.id), analysis, tags=cache.tags_for(current_user.id, doc.id))
 
-    # Generate
-    cards_json = ai_engine.generate_flashcards(doc.extracted_text, doc.language)
-    
-    # Save
-    new_deck = models.FlashcardDeck(
-        document_id=doc.id,
-        title=f"Flashcards for {doc.filename}",
-        cards=cards_json
-    )
-    db.add(new_deck)
-    db.commit()
-    db.refresh(new_deck)
-    
     return {
-        "id": new_deck.id,
-        "title": new_deck.title,
-        "created_at": new_deck.created_at,
-        "cards": json.loads(new_deck.cards),
-        "document_id": new_deck.document_id
+        "document_id": doc.id,
+        "summary": doc.summary,
+        "key_concepts": artifacts["concepts"],
+        "quiz": study_pack.quiz_payload(quiz),
+        "flashcards": study_pack.deck_payload(deck)
     }
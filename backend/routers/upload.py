@@ -1,8 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, status, Form
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, status, Form, Query, Response
+from sqlalchemy.orm import Session, defer
+from sqlalchemy.ext.asyncio import AsyncSession
 import models, schemas, database, security
-from services import extraction, transcription, ocr
-import shutil
+from services import jobs, storage, search, vector_index, pagination
+import asyncio
 import os
 from datetime import datetime
 from typing import List, Optional
@@ -12,18 +13,18 @@ router = APIRouter(
     tags=["documents"]
 )
 
-UPLOAD_DIR = "uploads"
+UPLOAD_DIR = storage.UPLOAD_DIR
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-def get_current_user(user: models.User = Depends(security.get_current_user_from_token)):
+def get_current_user(user: security.Principal = Depends(security.get_current_user_from_token)):
     return user
 
 @router.post("/upload", response_model=schemas.Document)
 async def upload_file(
     file: UploadFile = File(...), 
     course_id: Optional[int] = Form(None),
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(database.get_db)
+    current_user: security.Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(database.get_async_db)
 ):
     valid_types = {
         'application/pdf': 'pdf', 
@@ -49,52 +50,153 @@ async def upload_file(
     else:
         raise HTTPException(status_code=400, detail="Unsupported file type. Allowed: PDF, Media (MP3/MP4), Images (JPG/PNG)")
 
-    # Safe filename
-    file_location = os.path.join(UPLOAD_DIR, file.filename)
-    
-    # Save file
-    with open(file_location, "wb+") as file_object:
-        shutil.copyfileobj(file.file, file_object)
-
-    # Extract/Transcribe/OCR
-    extracted_text = ""
-    detected_lang = "en"
-    
-    if media_type == 'pdf':
-        extracted_text = extraction.extract_text_from_pdf(file_location)
-    elif media_type == 'image':
-        extracted_text = ocr.extract_text_from_image(file_location)
-    else:
-        # Audio/Video
-        extracted_text = transcription.transcribe_media(file_location)
-
-    # Check language
-    is_arabic = any('\u0600' <= char <= '\u06FF' for char in extracted_text) if extracted_text else False
-    detected_lang = "ar" if is_arabic else "en"
+    # Stream the file into the content-addressed blob store
+    try:
+        stored = await storage.save_upload(file, media_type)
+    except storage.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    file_location, content_hash = stored.path, stored.content_hash
 
-    # Save to DB
     new_doc = models.Document(
         filename=file.filename,
         file_path=file_location,
+        content_hash=content_hash,
         media_type=media_type,
-        extracted_text=extracted_text,
-        language=detected_lang,
+        status="processing",
         owner_id=current_user.id,
         course_id=course_id
     )
-    
+
+    # Same bytes already processed? Reuse the text and analysis instead of re-extracting
+    existing = await db.run_sync(storage.find_reusable_document, content_hash)
+    if existing:
+        storage.copy_extraction(existing, new_doc)
+
     db.add(new_doc)
-    db.commit()
-    db.refresh(new_doc)
+    await db.commit()
+    await db.refresh(new_doc)
+
+    # Otherwise extraction runs in the background job queue
+    if new_doc.status == "processing":
+        await db.run_sync(jobs.enqueue, "extract", document_id=new_doc.id)
+        await db.refresh(new_doc)
+    else:
+        await db.run_sync(search.safe_index_document, new_doc)
+        await asyncio.to_thread(vector_index.safe_index_document, new_doc)
     
     return new_doc
 
-@router.get("/", response_model=List[schemas.Document])
+@router.get("/", response_model=List[schemas.DocumentSummary])
 def get_my_documents(
-    skip: int = 0, 
-    limit: int = 100, 
-    current_user: models.User = Depends(get_current_user),
+    response: Response,
+    limit: int = Query(100, ge=1, le=200),
+    cursor: Optional[str] = None,
+    current_user: security.Principal = Depends(get_current_user),
     db: Session = Depends(database.get_db)
 ):
-    documents = db.query(models.Document).filter(models.Document.owner_id == current_user.id).offset(skip).limit(limit).all()
+    """List documents newest first; pass the X-Next-Cursor header back as `cursor` for the next page"""
+    query = db.query(models.Document).options(
+        *[defer(column) for column in models.DOCUMENT_TEXT_COLUMNS]
+    ).filter(models.Document.owner_id == current_user.id)
+    try:
+        documents, next_cursor = pagination.keyset_page(query, models.Document.upload_date, models.Document.id, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return documents
+
+@router.get("/{document_id}", response_model=schemas.Document)
+def get_document(
+    document_id: int,
+    current_user: security.Principal = Depends(get_current_user),
+    db: Session = Depends(database.get_db)
+):
+    """Full document including extracted text, summary and key concepts"""
+    doc = db.query(models.Document).filter(models.Document.id == document_id, models.Document.owner_id == current_user.id).first()
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return doc
+
+@router.get("/{document_id}/status", response_model=schemas.DocumentStatus)
+def get_document_status(
+    document_id: int,
+    current_user: security.Principal = Depends(get_current_user),
+    db: Session = Depends(database.get_db)
+):
+    doc = db.query(models.Document).filter(models.Document.id == document_id, models.Document.owner_id == current_user.id).first()
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    job = db.query(models.Job).filter(models.Job.document_id == doc.id).order_by(models.Job.id.desc()).first()
+    return {
+        "id": doc.id,
+        "status": doc.status,
+        "job_status": job.status if job else None,
+        "attempts": job.attempts if job else 0,
+        "error": job.error if job else None
+    }
+
+@router.get("/{document_id}/segments", response_model=List[schemas.TranscriptSegment])
+def get_transcript_segments(
+    document_id: int,
+    current_user: security.Principal = Depends(get_current_user),
+    db: Session = Depends(database.get_db)
+):
+    """Per-segment transcription state of an audio/video document"""
+    doc = db.query(models.Document).filter(models.Document.id == document_id, models.Document.owner_id == current_user.id).first()
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return doc.transcript_segments
+
+@router.post("/{document_id}/segments/{index}/retry", response_model=schemas.DocumentStatus, status_code=status.HTTP_202_ACCEPTED)
+def retry_transcript_segment(
+    document_id: int,
+    index: int,
+    current_user: security.Principal = Depends(get_current_user),
+    db: Session = Depends(database.get_db)
+):
+    """Transcribe one segment again; the other segments are reused when the transcript is merged"""
+    doc = db.query(models.Document).filter(models.Document.id == document_id, models.Document.owner_id == current_user.id).first()
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    segment = db.query(models.TranscriptSegment).filter(
+        models.TranscriptSegment.document_id == doc.id,
+        models.TranscriptSegment.index == index
+    ).first()
+    if not segment:
+        raise HTTPException(status_code=404, detail="Segment not found")
+
+    active = db.query(models.Job).filter(
+        models.Job.document_id == doc.id,
+        models.Job.kind == "extract",
+        models.Job.status.in_(["queued", "running"])
+    ).first()
+    if active:
+        raise HTTPException(status_code=409, detail="Document is already being processed")
+
+    segment.status = "pending"
+    segment.error = None
+    doc.status = "processing"
+    job = jobs.enqueue(db, "extract", document_id=doc.id)
+    return {"id": doc.id, "status": doc.status, "job_status": job.status, "attempts": job.attempts, "error": None}
+
+@router.get("/{document_id}/related", response_model=List[schemas.RelatedDocument])
+def get_related_documents(
+    document_id: int,
+    k: int = 5,
+    current_user: security.Principal = Depends(get_current_user),
+    db: Session = Depends(database.get_db)
+):
+    doc = db.query(models.Document).filter(models.Document.id == document_id, models.Document.owner_id == current_user.id).first()
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if doc.course_id is None:
+        return []
+
+    ranked = vector_index.related_documents(doc.course_id, doc.id, k=max(1, min(k, 20)))
+    docs = {d.id: d for d in db.query(models.Document).filter(models.Document.id.in_([doc_id for doc_id, _ in ranked]))}
+    return [
+        {"id": doc_id, "filename": docs[doc_id].filename, "media_type": docs[doc_id].media_type, "score": score}
+        for doc_id, score in ranked if doc_id in docs
+    ]
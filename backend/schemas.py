@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional
+from pydantic import BaseModel, EmailStr, Json
+from typing import Any, List, Optional
 from datetime import datetime
 import models
 
@@ -22,6 +22,10 @@ class User(UserBase):
     class Config:
         from_attributes = True
 
+class PasswordChange(BaseModel):
+    current_password: str
+    new_password: str
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -46,15 +50,71 @@ class DocumentBase(BaseModel):
 class DocumentCreate(DocumentBase):
     course_id: Optional[int] = None
 
-class Document(DocumentBase):
+class DocumentSummary(DocumentBase):
+    """Listing view without the large text columns"""
     id: int
     upload_date: datetime
+    file_path: Optional[str] = None
     media_type: str = "pdf"
-    extracted_text: Optional[str] = None
     language: str
+    status: str = "ready"
     owner_id: int
     course_id: Optional[int] = None
 
     class Config:
         from_attributes = True
 
+class Document(DocumentSummary):
+    extracted_text: Optional[str] = None
+    summary: Optional[str] = None
+    key_concepts: Optional[str] = None
+    language_stats: Optional[Json[Any]] = None
+
+class SearchResult(BaseModel):
+    id: int
+    filename: str
+    media_type: str
+    course_id: Optional[int] = None
+    upload_date: datetime
+    snippet: str
+    rank: float
+
+class RelatedDocument(BaseModel):
+    id: int
+    filename: str
+    media_type: str
+    score: float
+
+class CourseQuestion(BaseModel):
+    question: str
+    k: int = 5
+
+class AnswerSource(BaseModel):
+    document_id: int
+    filename: str
+    excerpt: str
+    score: float
+
+class CourseAnswer(BaseModel):
+    answer: str
+    sources: List[AnswerSource]
+
+class DocumentStatus(BaseModel):
+    id: int
+    status: str
+    job_status: Optional[str] = None
+    attempts: int = 0
+    error: Optional[str] = None
+
+class TranscriptSegment(BaseModel):
+    index: int
+    start_seconds: float
+    end_seconds: Optional[float] = None
+    status: str
+    attempts: int = 0
+    text: Optional[str] = None
+    error: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
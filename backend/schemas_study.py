@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import datetime
 
@@ -21,6 +21,7 @@ class Quiz(QuizBase):
         orm_mode = True
 
 class FlashcardBase(BaseModel):
+    id: Optional[int] = None
     term: str
     definition: str
 
@@ -35,3 +36,45 @@ class FlashcardDeck(FlashcardDeckBase):
 
     class Config:
         orm_mode = True
+
+class StudyPackJob(BaseModel):
+    id: int
+    status: str
+    progress: int
+    total: int
+    attempts: int
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
+
+class StudySet(BaseModel):
+    document_id: int
+    summary: Optional[str] = None
+    key_concepts: List[dict] = []
+    quiz: Optional[Quiz] = None
+    flashcards: Optional[FlashcardDeck] = None
+
+class StudyPackDocument(StudySet):
+    filename: str
+    status: str  # pending, generated, skipped, failed
+
+class StudyPack(BaseModel):
+    course_id: int
+    job: StudyPackJob
+    documents: List[StudyPackDocument] = []
+
+class ReviewGrade(BaseModel):
+    grade: int = Field(..., ge=0, le=5)  # 0 = forgot completely, 5 = perfect recall
+
+class DueCard(BaseModel):
+    flashcard_id: int
+    deck_id: int
+    term: str
+    definition: str
+    due_at: datetime
+    interval_days: int
+    repetitions: int
+    ease_factor: float
@@ -1,3 +1,6 @@
+import calendar
+import os
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import jwt
@@ -8,6 +11,10 @@ SECRET_KEY = "YOUR_SUPER_SECRET_KEY_HERE" # In production, get from .env
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440 # 24 hours
 
+# Verified principals are cached per token so most requests skip the users query
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "4096"))
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=4)
 
 def verify_password(plain_password, hashed_password):
@@ -22,20 +29,59 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "iat": datetime.utcnow()})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 # Reusable dependency for other routers
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
 import database
 import models
+from services.cache import TTLCache
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
-def get_current_user_from_token(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+@dataclass(frozen=True)
+class Principal:
+    """Read-only snapshot of the authenticated user, safe to share between requests"""
+    id: int
+    email: str
+    full_name: str
+    is_active: bool
+    preferred_language: str
+
+_principals = TTLCache(max_entries=PRINCIPAL_CACHE_MAX_ENTRIES, default_ttl=PRINCIPAL_CACHE_TTL_SECONDS, name="principals")
+
+def invalidate_user(user_id: int):
+    """Forget cached principals of a user (call on deactivation or password change)"""
+    _principals.invalidate_tag(f"user:{user_id}")
+
+def principal_cache_stats() -> dict:
+    return _principals.stats()
+
+def _load_principal(payload: dict) -> Optional[Principal]:
+    db = database.SessionLocal()
+    try:
+        user_id = payload.get("uid")
+        if user_id is not None:
+            user = db.get(models.User, user_id)
+        else:
+            # Tokens issued before the uid claim existed
+            user = db.query(models.User).filter(models.User.email == payload.get("sub")).first()
+        if user is None or not user.is_active:
+            return None
+        if user.password_changed_at and payload.get("iat", 0) < calendar.timegm(user.password_changed_at.utctimetuple()):
+            return None
+        return Principal(user.id, user.email, user.full_name, user.is_active, user.preferred_language)
+    finally:
+        db.close()
+
+def get_current_user_from_token(token: str = Depends(oauth2_scheme)) -> Principal:
+    principal = _principals.get(token)
+    if principal is not None:
+        return principal
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -43,12 +89,16 @@ def get_current_user_from_token(token: str = Depends(oauth2_scheme), db: Session
     )
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
+        if payload.get("sub") is None:
             raise credentials_exception
     except jwt.JWTError:
         raise credentials_exception
-    user = db.query(models.User).filter(models.User.email == email).first()
-    if user is None:
+    principal = _load_principal(payload)
+    if principal is None:
         raise credentials_exception
-    return user
+
+    # Never cache past the token's own expiry
+    ttl = min(PRINCIPAL_CACHE_TTL_SECONDS, payload["exp"] - calendar.timegm(datetime.utcnow().utctimetuple()))
+    if ttl > 0:
+        _principals.set(token, principal, ttl=ttl, tags=(f"user:{principal.id}",))
+    return principal
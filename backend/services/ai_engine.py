@@ -1,115 +1,708 @@
 import os
-import google.generativeai as genai
-from dotenv import load_dotenv
+import asyncio
 import json
+from typing import List
+from services import llm, llm_cache, image_prep, remote_files, metrics, singleflight
+from services.language import prompt_instruction
 
-# Load environment variables
-load_dotenv()
+# Generation goes through the shared LLM gateway (services/llm.py) and uploads
+# through services/remote_files.py; both create their clients on first use, so
+# importing this module doesn't load the Gemini SDK.
 
-# Initialize Gemini
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-# Using 'gemini-flash-latest' as it has active quota on this key
-model = genai.GenerativeModel('gemini-flash-latest')
+# Bump a version whenever its prompt changes; cached responses of older versions are purged
+PROMPT_VERSIONS = {
+    "analysis": "1",
+    "analysis_chunk": "1",
+    "analysis_reduce": "1",
+    "analysis_merge": "1",
+    # Stored map output of a whole document; bump with analysis_chunk or analysis_merge
+    "analysis_sections": "1",
+    "quiz": "1",
+    "flashcards": "1",
+    "course_qa": "1",
+    "analysis_stream": "1",
+    "analysis_reduce_stream": "1",
+    "quiz_stream": "1",
+    "flashcards_stream": "1",
+    "study_set": "1",
+}
+
+async def _generate_json(prompt: str, template: str, **params):
+    """Generate and parse a JSON response, served from the persistent response cache when possible"""
+    version = PROMPT_VERSIONS[template]
+    key = llm_cache.fingerprint(llm.gateway.model_name(), template, version, params, prompt)
+    cached = await asyncio.to_thread(llm_cache.get, key)
+    if cached is not None:
+        return json.loads(cached)
+
+    async def generate():
+        result = await llm.gateway.generate(prompt)
+        content = _clean_json(result.text)
+        try:
+            json.loads(content)
+        except ValueError:
+            metrics.LLM_JSON_ERRORS.inc(template=template)
+            raise
+        # Only well-formed responses are cached
+        await asyncio.to_thread(
+            llm_cache.put, key, content, result.model, template, version,
+            result.input_tokens, result.output_tokens
+        )
+        return content
+
+    async def cached_elsewhere():
+        return await asyncio.to_thread(llm_cache.get, key)
+
+    # Identical prompts in flight at the same time (e.g. a class opening the same
+    # shared document) make one call, also across worker processes when the
+    # response cache can hand the result over. The text is shared and parsed per
+    # caller so callers can't see each other's changes.
+    content = await singleflight.run(f"llm:{key}", generate, recheck=cached_elsewhere,
+                                     lease=llm_cache.LLM_CACHE_ENABLED)
+    return json.loads(content)
+
+async def _stream_text(prompt: str, template: str, validate=None, **params):
+    """Yield raw text deltas; a cached response is replayed as a single delta.
+
+    The full response is cached at the end if validate (when given) accepts it.
+    """
+    version = PROMPT_VERSIONS[template]
+    key = llm_cache.fingerprint(llm.gateway.model_name(), template, version, params, prompt)
+    cached = await asyncio.to_thread(llm_cache.get, key)
+    if cached is not None:
+        yield cached
+        return
+
+    parts = []
+    async for delta in llm.gateway.stream(prompt):
+        parts.append(delta)
+        yield delta
+    content = "".join(parts)
+    if validate is None or validate(content):
+        await asyncio.to_thread(llm_cache.put, key, content, llm.gateway.model_name(), template, version)
+    else:
+        metrics.LLM_JSON_ERRORS.inc(template=template)
+
+# Long documents are analyzed chunk by chunk (map) and then combined (reduce)
+# instead of truncating to the first CHUNK_CHARS characters. Section summaries
+# that don't fit one reduce prompt are merged in rounds first, and the result is
+# stored per document content, so later analyses, quizzes and decks skip the map.
+CHUNK_CHARS = int(os.getenv("ANALYSIS_CHUNK_CHARS", "8000"))
+CHUNK_OVERLAP = int(os.getenv("ANALYSIS_CHUNK_OVERLAP", "400"))
+MAP_CONCURRENCY = int(os.getenv("ANALYSIS_MAP_CONCURRENCY", "4"))
+MAX_CONCEPTS = 7
+
+def _clean_json(content: str) -> str:
+    """Strip markdown code fences around a JSON response"""
+    content = content.strip()
+    if "```json" in content:
+        content = content.split("```json")[1].split("```")[0].strip()
+    elif "```" in content:
+        content = content.split("```")[1].split("```")[0].strip()
+    return content
+
+def split_text(text: str, chunk_chars: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """Split text into overlapping chunks, preferring paragraph/sentence boundaries"""
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_chars, len(text))
+        if end < len(text):
+            boundary = max(text.rfind("\n\n", start + chunk_chars // 2, end), text.rfind(". ", start + chunk_chars // 2, end))
+            if boundary > start:
+                end = boundary + 1
+        chunks.append(text[start:end])
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+async def _analyze_chunk(chunk: str, index: int, total: int, language: str) -> dict:
+    """Map step: summarize one section and list its concepts"""
+    lang_instruction = prompt_instruction(language, chunk)
+    prompt = (
+        f"You are an educational assistant. The following text is section {index + 1} of {total} of a longer document. Work {lang_instruction}.\n"
+        f"1. Summarize this section in a few sentences.\n"
+        f"2. List the key concepts it introduces with short definitions.\n"
+        f"Return ONLY a JSON object with this structure: {{\"summary\": \"...\", \"concepts\": [{{ \"term\": \"...\", \"definition\": \"...\" }}]}}\n\n"
+        f"Text: {chunk}"
+    )
+    return await _generate_json(prompt, "analysis_chunk", language=language)
+
+async def _map_chunks(text: str, language: str, progress: asyncio.Queue = None) -> List[dict]:
+    """Analyze all chunks concurrently (bounded), keeping document order and skipping failed sections.
+
+    When given, `progress` receives one item per finished section.
+    """
+    chunks = split_text(text)
+    semaphore = asyncio.Semaphore(MAP_CONCURRENCY)
+    errors = []
+
+    async def run(index):
+        async with semaphore:
+            try:
+                return await _analyze_chunk(chunks[index], index, len(chunks), language)
+            except Exception as e:
+                print(f"Gemini chunk {index + 1}/{len(chunks)} analysis error: {e}")
+                errors.append(e)
+                return None
+            finally:
+                if progress is not None:
+                    progress.put_nowait(index)
+
+    results = await asyncio.gather(*(run(i) for i in range(len(chunks))))
+    partials = [r for r in results if r]
+    if not partials and errors:
+        raise llm.LLMError(f"All {len(chunks)} sections failed: {errors[-1]}")
+    return partials
+
+def _dedupe_concepts(concepts: List[dict]) -> List[dict]:
+    seen = set()
+    unique = []
+    for concept in concepts:
+        term = str(concept.get("term", "")).strip()
+        key = " ".join(term.casefold().split())
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(concept)
+    return unique
+
+def _section_digest(partials: List[dict]) -> str:
+    return "\n\n".join(f"Section {i + 1}: {p.get('summary', '')}" for i, p in enumerate(partials))
+
+async def _reduce_analysis(partials: List[dict], language: str) -> dict:
+    """Reduce step: merge section summaries and candidate concepts into the final analysis"""
+    candidates = _dedupe_concepts([c for p in partials for c in p.get("concepts", []) if isinstance(c, dict)])
+    try:
+        lang_instruction = prompt_instruction(language, _section_digest(partials))
+        prompt = (
+            f"You are an educational assistant. Below are summaries of consecutive sections of one document and candidate key concepts. Work {lang_instruction}.\n"
+            f"1. Write one concise summary of the whole document.\n"
+            f"2. Choose the 5-7 most important concepts (merge duplicates) with definitions.\n"
+            f"Return ONLY a JSON object with this structure: {{\"summary\": \"...\", \"concepts\": [{{ \"term\": \"...\", \"definition\": \"...\" }}]}}\n\n"
+            f"Section summaries:\n{_section_digest(partials)}\n\n"
+            f"Candidate concepts: {json.dumps(candidates, ensure_ascii=False)}"
+        )
+        result = await _generate_json(prompt, "analysis_reduce", language=language)
+        result["concepts"] = _dedupe_concepts(result.get("concepts", []))
+        return result
+    except Exception as e:
+        print(f"Gemini reduce error: {e}")
+        # Fall back to the map output so the whole document is still covered
+        return {
+            "summary": "\n\n".join(p.get("summary", "") for p in partials),
+            "concepts": candidates[:MAX_CONCEPTS]
+        }
+
+def _digest_batches(partials: List[dict]) -> List[List[dict]]:
+    """Consecutive sections whose digest fits in CHUNK_CHARS, at least two per batch so every round shrinks"""
+    batches, batch, size = [], [], 0
+    for partial in partials:
+        length = len(partial.get("summary", "")) + len("Section 00: \n\n")
+        if len(batch) >= 2 and size + length > CHUNK_CHARS:
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(partial)
+        size += length
+    if len(batch) == 1 and batches:
+        batches[-1].append(batch[0])
+    elif batch:
+        batches.append(batch)
+    return batches
+
+async def _merge_sections(batch: List[dict], language: str) -> dict:
+    """One reduce round: combine consecutive section summaries into the summary of that part"""
+    candidates = _dedupe_concepts([c for p in batch for c in p.get("concepts", []) if isinstance(c, dict)])
+    try:
+        lang_instruction = prompt_instruction(language, _section_digest(batch))
+        prompt = (
+            f"You are an educational assistant. Below are summaries of consecutive sections of one part of a longer document and candidate key concepts. Work {lang_instruction}.\n"
+            f"1. Summarize this part in one or two paragraphs, keeping the facts a quiz could ask about.\n"
+            f"2. Keep the 10 most important concepts (merge duplicates) with definitions.\n"
+            f"Return ONLY a JSON object with this structure: {{\"summary\": \"...\", \"concepts\": [{{ \"term\": \"...\", \"definition\": \"...\" }}]}}\n\n"
+            f"Section summaries:\n{_section_digest(batch)}\n\n"
+            f"Candidate concepts: {json.dumps(candidates, ensure_ascii=False)}"
+        )
+        result = await _generate_json(prompt, "analysis_merge", language=language)
+        if not isinstance(result, dict) or not result.get("summary"):
+            raise ValueError("merged section has no summary")
+        result["concepts"] = _dedupe_concepts([c for c in result.get("concepts", []) if isinstance(c, dict)])
+        return result
+    except llm.LLMError:
+        raise
+    except Exception as e:
+        print(f"Gemini section merge error: {e}")
+        return {"summary": " ".join(p.get("summary", "") for p in batch), "concepts": candidates}
+
+async def _condense_sections(partials: List[dict], language: str) -> List[dict]:
+    """Merge consecutive sections in rounds until their digest fits one reduce prompt"""
+    semaphore = asyncio.Semaphore(MAP_CONCURRENCY)
+
+    async def merge(batch):
+        async with semaphore:
+            return await _merge_sections(batch, language)
+
+    while len(partials) > 1 and len(_section_digest(partials)) > CHUNK_CHARS:
+        batches = _digest_batches(partials)
+        print(f"Merging {len(partials)} section summaries into {len(batches)}")
+        partials = list(await asyncio.gather(*(merge(batch) for batch in batches)))
+    return partials
+
+async def _document_sections(text: str, language: str, progress: asyncio.Queue = None) -> List[dict]:
+    """Section summaries of a long document, condensed to fit one reduce prompt.
+
+    Stored by content, so the map step runs once per document; a result with
+    failed sections isn't stored, so they are retried next time.
+    """
+    version = PROMPT_VERSIONS["analysis_sections"]
+    params = {"language": language, "chunk_chars": CHUNK_CHARS, "overlap": CHUNK_OVERLAP}
+    key = llm_cache.fingerprint(llm.gateway.model_name(), "analysis_sections", version, params, text)
+    cached = await asyncio.to_thread(llm_cache.get, key)
+    if cached is not None:
+        return json.loads(cached)
+
+    partials = await _map_chunks(text, language, progress)
+    complete = len(partials) == len(split_text(text))
+    partials = await _condense_sections(partials, language)
+    if complete:
+        await asyncio.to_thread(
+            llm_cache.put, key, json.dumps(partials, ensure_ascii=False),
+            llm.gateway.model_name(), "analysis_sections", version
+        )
+    return partials
+
+async def _study_context(text: str, language: str, progress: asyncio.Queue = None) -> str:
+    """Text for quiz/flashcard prompts: the document itself, or a digest of all its sections if it is long"""
+    if len(text) <= CHUNK_CHARS:
+        return text
+    partials = await _document_sections(text, language, progress)
+    if not partials:
+        return text[:CHUNK_CHARS]
+    digest = [_section_digest(partials)]
+    concepts = _dedupe_concepts([c for p in partials for c in p.get("concepts", []) if isinstance(c, dict)])
+    if concepts:
+        digest.append("Key concepts:\n" + "\n".join(f"- {c.get('term')}: {c.get('definition', '')}" for c in concepts))
+    return "\n\n".join(digest)
+
+async def analyze_document_content(text: str, language: str) -> dict:
+    """Perform both summary and concept extraction in ONE call to save API quota (fix 429).
+
+    Documents longer than CHUNK_CHARS go through a map-reduce over overlapping chunks.
+    Raises llm.LLMError when the model is unavailable after retries and
+    llm.LLMResponseError when its response can't be used.
+    """
+    if len(text) > CHUNK_CHARS:
+        partials = await _document_sections(text, language)
+        if not partials:
+            raise llm.LLMResponseError("No section of the document could be analyzed")
+        return await _reduce_analysis(partials, language)
 
-def analyze_document_content(text: str, language: str) -> dict:
-    """Perform both summary and concept extraction in ONE call to save API quota (fix 429)"""
     try:
-        lang_instruction = "in Arabic" if language == "ar" else "in English"
+        lang_instruction = prompt_instruction(language, text)
         prompt = (
             f"You are an educational assistant. Analyze the following text {lang_instruction}.\n"
             f"1. Provide a concise summary.\n"
             f"2. Extract 5-7 key concepts with definitions.\n"
             f"Return ONLY a JSON object with this structure: {{\"summary\": \"...\", \"concepts\": [{{ \"term\": \"...\", \"definition\": \"...\" }}]}}\n\n"
-            f"Text: {text[:8000]}"
+            f"Text: {text}"
         )
         
-        response = model.generate_content(prompt)
-        content = response.text.strip()
-        
-        # Clean potential markdown
-        if "```json" in content:
-            content = content.split("```json")[1].split("```")[0].strip()
-        elif "```" in content:
-            content = content.split("```")[1].split("```")[0].strip()
-            
-        return json.loads(content)
+        result = await _generate_json(prompt, "analysis", language=language)
+    except llm.LLMError:
+        raise
     except Exception as e:
         print(f"Gemini Analysis Error: {e}")
-        return {
-            "summary": f"Error generating summary: {str(e)}",
-            "concepts": [{"term": "Error", "definition": "Failed to extract concepts"}]
-        }
+        raise llm.LLMResponseError(f"Invalid analysis response: {e}") from e
+    if not isinstance(result, dict) or not result.get("summary"):
+        raise llm.LLMResponseError("Analysis response has no summary")
+    return result
 
-def summarize_document(text: str, language: str) -> str:
+async def summarize_document(text: str, language: str) -> str:
     """Generate a summary (now uses unified call if called individually)"""
-    result = analyze_document_content(text, language)
+    result = await analyze_document_content(text, language)
     return result.get("summary", "Summary generation failed")
 
-def extract_concepts(text: str, language: str) -> str:
+async def extract_concepts(text: str, language: str) -> str:
     """Extract key concepts (now uses unified call if called individually)"""
-    result = analyze_document_content(text, language)
+    result = await analyze_document_content(text, language)
     return json.dumps(result.get("concepts", []))
 
-def generate_quiz(text: str, language: str, num_questions: int = 5) -> str:
-    """Generate quiz questions using Gemini"""
+def _valid_questions(items) -> list:
+    questions = [q for q in items if isinstance(q, dict) and "question" in q and isinstance(q.get("options"), list)] if isinstance(items, list) else []
+    for number, question in enumerate(questions, start=1):
+        question["id"] = number
+    return questions
+
+def _valid_cards(items) -> list:
+    return [c for c in items if isinstance(c, dict) and "term" in c and "definition" in c] if isinstance(items, list) else []
+
+async def generate_quiz(text: str, language: str, num_questions: int = 5) -> str:
+    """Generate quiz questions using Gemini.
+
+    Raises llm.LLMResponseError when no question can be parsed from the response.
+    """
     try:
-        lang_instruction = "in Arabic" if language == "ar" else "in English"
+        context = await _study_context(text, language)
+        lang_instruction = prompt_instruction(language, context)
         prompt = (
             f"You are an educational quiz generator. Create {num_questions} multiple-choice questions {lang_instruction} based on the provided text. "
             f"Return ONLY valid JSON array: [{{\"id\": 1, \"question\": \"...\", \"options\": [\"A\", \"B\", \"C\", \"D\"], \"correct_answer_index\": 0}}]\n\n"
-            f"Text: {text[:8000]}"
+            f"Text: {context}"
         )
         
-        response = model.generate_content(prompt)
-        content = response.text.strip()
-        
-        if "```json" in content:
-            content = content.split("```json")[1].split("```")[0].strip()
-        elif "```" in content:
-            content = content.split("```")[1].split("```")[0].strip()
-            
-        return content
+        questions = _valid_questions(await _generate_json(prompt, "quiz", language=language, num_questions=num_questions))
+    except llm.LLMError:
+        raise
     except Exception as e:
         print(f"Quiz generation error: {e}")
-        return '[]'
+        raise llm.LLMResponseError(f"Invalid quiz response: {e}") from e
+    if not questions:
+        raise llm.LLMResponseError("Quiz response has no questions")
+    return json.dumps(questions, ensure_ascii=False)
 
-def generate_flashcards(text: str, language: str, num_cards: int = 8) -> str:
-    """Generate flashcards using Gemini"""
+async def generate_flashcards(text: str, language: str, num_cards: int = 8) -> str:
+    """Generate flashcards using Gemini.
+
+    Raises llm.LLMResponseError when no card can be parsed from the response.
+    """
     try:
-        lang_instruction = "in Arabic" if language == "ar" else "in English"
+        context = await _study_context(text, language)
+        lang_instruction = prompt_instruction(language, context)
         prompt = (
             f"You are an educational flashcard generator. Create {num_cards} flashcards {lang_instruction} with term/definition pairs. "
             f"Return ONLY valid JSON array: [{{\"term\": \"...\", \"definition\": \"...\"}}]\n\n"
-            f"Text: {text[:8000]}"
+            f"Text: {context}"
         )
         
-        response = model.generate_content(prompt)
-        content = response.text.strip()
-        
-        if "```json" in content:
-            content = content.split("```json")[1].split("```")[0].strip()
-        elif "```" in content:
-            content = content.split("```")[1].split("```")[0].strip()
-            
-        return content
+        cards = _valid_cards(await _generate_json(prompt, "flashcards", language=language, num_cards=num_cards))
+    except llm.LLMError:
+        raise
     except Exception as e:
         print(f"Flashcard generation error: {e}")
-        return '[]'
+        raise llm.LLMResponseError(f"Invalid flashcards response: {e}") from e
+    if not cards:
+        raise llm.LLMResponseError("Flashcards response has no cards")
+    return json.dumps(cards, ensure_ascii=False)
+
+async def answer_question(question: str, passages: List[str], language: str) -> str:
+    """Answer a question using only the retrieved course passages"""
+    context = "\n\n".join(f"[{i + 1}] {p}" for i, p in enumerate(passages))
+    lang_instruction = prompt_instruction(language, context)
+    prompt = (
+        f"You are an educational assistant. Answer the student's question {lang_instruction} using only the numbered course excerpts below. "
+        f"Cite excerpts like [1]. If the excerpts don't contain the answer, say so.\n"
+        f"Return ONLY a JSON object with this structure: {{\"answer\": \"...\"}}\n\n"
+        f"Excerpts:\n{context}\n\n"
+        f"Question: {question}"
+    )
+    result = await _generate_json(prompt, "course_qa", language=language)
+    return result.get("answer", "")
+
+def _normalize_study_set(result: dict) -> dict:
+    return {
+        "summary": result.get("summary", "Summary failed"),
+        "concepts": _dedupe_concepts([c for c in result.get("concepts", []) if isinstance(c, dict)]),
+        "questions": _valid_questions(result.get("questions", [])),
+        "cards": _valid_cards(result.get("cards", [])),
+    }
+
+async def generate_study_artifacts(text: str, language: str, num_questions: int = 5, num_cards: int = 8) -> dict:
+    """Summary, concepts, quiz and flashcards from ONE prompt over the text (one pass instead of three).
+
+    Long documents are mapped to section digests first, as for analysis.
+    Raises llm.LLMError when the model is unavailable after retries and
+    llm.LLMResponseError when its response can't be used; nothing is returned
+    that could be saved as if it were generated material.
+    """
+    context = await _study_context(text, language)
+    lang_instruction = prompt_instruction(language, context)
+    prompt = (
+        f"You are an educational assistant. Using the text below, work {lang_instruction} and produce:\n"
+        f"1. A concise summary.\n"
+        f"2. 5-7 key concepts with definitions.\n"
+        f"3. {num_questions} multiple-choice quiz questions.\n"
+        f"4. {num_cards} flashcards with term/definition pairs.\n"
+        f"Return ONLY a JSON object with this structure: {{\"summary\": \"...\", "
+        f"\"concepts\": [{{ \"term\": \"...\", \"definition\": \"...\" }}], "
+        f"\"questions\": [{{\"id\": 1, \"question\": \"...\", \"options\": [\"A\", \"B\", \"C\", \"D\"], \"correct_answer_index\": 0}}], "
+        f"\"cards\": [{{\"term\": \"...\", \"definition\": \"...\"}}]}}\n\n"
+        f"Text: {context}"
+    )
+    try:
+        result = await _generate_json(prompt, "study_set", language=language, num_questions=num_questions, num_cards=num_cards)
+    except llm.LLMError:
+        raise
+    except Exception as e:
+        print(f"Study set generation error: {e}")
+        raise llm.LLMResponseError(f"Invalid study set response: {e}") from e
+    if not isinstance(result, dict) or not result.get("summary"):
+        raise llm.LLMResponseError("Study set response has no summary")
+    return _normalize_study_set(result)
+
+async def _with_map_progress(text: str, map_step):
+    """Run map_step(progress_queue) while yielding ("progress", {...}) as sections finish, then ("result", its result).
+
+    Long documents are mapped before the streamed call starts; the progress events
+    give clients something to show in the meantime.
+    """
+    sections = len(split_text(text))
+    queue = asyncio.Queue()
+    task = asyncio.create_task(map_step(queue))
+    task.add_done_callback(lambda _: queue.put_nowait(None))
+    try:
+        done = 0
+        yield ("progress", {"sections_done": done, "sections": sections})
+        while await queue.get() is not None:
+            done += 1
+            yield ("progress", {"sections_done": done, "sections": sections})
+        yield ("result", await task)
+    finally:
+        # The client went away mid-map
+        task.cancel()
+
+# Streaming variants: formats the client can consume before the response is complete.
+# Analysis streams the summary as plain text followed by a marker line and the concepts
+# as JSON; quizzes and flashcards stream as JSON Lines, one item per line.
+CONCEPTS_MARKER = "###CONCEPTS###"
+
+def _split_streamed_analysis(content: str) -> dict:
+    summary, _, concepts = content.partition(CONCEPTS_MARKER)
+    try:
+        parsed = json.loads(_clean_json(concepts)) if concepts.strip() else []
+    except ValueError:
+        parsed = []
+    return {
+        "summary": summary.strip(),
+        "concepts": _dedupe_concepts([c for c in parsed if isinstance(c, dict)]) if isinstance(parsed, list) else []
+    }
+
+def _is_complete_analysis(content: str) -> bool:
+    return CONCEPTS_MARKER in content and bool(_split_streamed_analysis(content)["concepts"])
+
+async def stream_analysis(text: str, language: str):
+    """Yield ("summary", text delta) events as the summary is generated, then ("result", analysis dict).
+
+    Long documents run the (non-streamed) map step first, reporting ("progress", {...})
+    events, and stream the reduce step.
+    Raises llm.LLMError when the model is unavailable after retries and
+    llm.LLMResponseError when its response isn't a summary followed by concepts.
+    """
+    lang_instruction = prompt_instruction(language, text)
+    output_format = (
+        f"Write the summary first as plain text (no JSON, no heading). Then write a line containing only {CONCEPTS_MARKER} "
+        f"followed by ONLY a JSON array of concepts: [{{ \"term\": \"...\", \"definition\": \"...\" }}]\n\n"
+    )
+    if len(text) > CHUNK_CHARS:
+        partials = None
+        async for kind, payload in _with_map_progress(text, lambda queue: _document_sections(text, language, queue)):
+            if kind == "progress":
+                yield (kind, payload)
+            else:
+                partials = payload
+        if not partials:
+            raise llm.LLMResponseError("No section of the document could be analyzed")
+        candidates = _dedupe_concepts([c for p in partials for c in p.get("concepts", []) if isinstance(c, dict)])
+        template = "analysis_reduce_stream"
+        prompt = (
+            f"You are an educational assistant. Below are summaries of consecutive sections of one document and candidate key concepts. Work {lang_instruction}.\n"
+            f"1. Write one concise summary of the whole document.\n"
+            f"2. Choose the 5-7 most important concepts (merge duplicates) with definitions.\n"
+            f"{output_format}"
+            f"Section summaries:\n{_section_digest(partials)}\n\n"
+            f"Candidate concepts: {json.dumps(candidates, ensure_ascii=False)}"
+        )
+    else:
+        template = "analysis_stream"
+        prompt = (
+            f"You are an educational assistant. Analyze the following text {lang_instruction}.\n"
+            f"1. Provide a concise summary.\n"
+            f"2. Extract 5-7 key concepts with definitions.\n"
+            f"{output_format}"
+            f"Text: {text}"
+        )
+
+    buffer = ""
+    emitted = 0
+    async for delta in _stream_text(prompt, template, validate=_is_complete_analysis, language=language):
+        buffer += delta
+        marker_at = buffer.find(CONCEPTS_MARKER)
+        # Hold back a marker-sized tail so a partially received marker is never sent as summary
+        limit = marker_at if marker_at != -1 else len(buffer) - len(CONCEPTS_MARKER)
+        if limit > emitted:
+            yield ("summary", buffer[emitted:limit])
+            emitted = limit
+
+    result = _split_streamed_analysis(buffer)
+    tail = buffer.partition(CONCEPTS_MARKER)[0]
+    if len(tail) > emitted:
+        yield ("summary", tail[emitted:])
+    if CONCEPTS_MARKER not in buffer or not result["summary"]:
+        raise llm.LLMResponseError("Analysis response is not a summary followed by concepts")
+    yield ("result", result)
+
+def _parse_json_line(line: str):
+    line = line.strip().rstrip(",")
+    if not line or line.startswith("```") or line in ("[", "]"):
+        return None
+    try:
+        item = json.loads(line)
+    except ValueError:
+        return None
+    return item if isinstance(item, dict) else None
+
+def _json_document_items(content: str, key: str) -> list:
+    """Objects of a response that ignored the JSON Lines format: an array, or an object holding one under `key`"""
+    try:
+        parsed = json.loads(_clean_json(content))
+    except ValueError:
+        return []
+    if isinstance(parsed, dict):
+        parsed = parsed.get(key, [])
+    return [item for item in parsed if isinstance(item, dict)] if isinstance(parsed, list) else []
+
+def _has_json_lines(content: str) -> bool:
+    return any(_parse_json_line(line) for line in content.splitlines())
+
+async def _stream_json_lines(prompt: str, template: str, key: str, **params):
+    """Yield each JSON object as soon as its line is complete.
+
+    A response that is one (pretty-printed) JSON array instead is parsed once it is complete.
+    """
+    content = ""
+    buffer = ""
+    found = False
+    validate = lambda text: _has_json_lines(text) or bool(_json_document_items(text, key))
+    async for delta in _stream_text(prompt, template, validate=validate, **params):
+        content += delta
+        buffer += delta
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            item = _parse_json_line(line)
+            if item is not None:
+                found = True
+                yield item
+    item = _parse_json_line(buffer)
+    if item is not None:
+        found = True
+        yield item
+    if not found:
+        for item in _json_document_items(content, key):
+            yield item
+
+async def _stream_study_items(text: str, language: str, build_prompt, template: str, key: str, **params):
+    """("progress", {...}) while a long document is mapped, then ("item", object) per generated line"""
+    context = None
+    async for kind, payload in _with_map_progress(text, lambda queue: _study_context(text, language, queue)):
+        if kind == "progress":
+            if len(text) > CHUNK_CHARS:
+                yield (kind, payload)
+        else:
+            context = payload
+    async for item in _stream_json_lines(build_prompt(context), template, key, language=language, **params):
+        yield ("item", item)
+
+async def stream_quiz(text: str, language: str, num_questions: int = 5):
+    """Yield ("question", question) events one by one as they are generated, after ("progress", {...}) events for long documents.
+
+    Raises llm.LLMResponseError when no question could be parsed from the response.
+    """
+    def build_prompt(context: str) -> str:
+        lang_instruction = prompt_instruction(language, context)
+        return (
+            f"You are an educational quiz generator. Create {num_questions} multiple-choice questions {lang_instruction} based on the provided text. "
+            f"Return ONLY JSON Lines: one JSON object per line, no array and no code fences. Each line: "
+            f"{{\"question\": \"...\", \"options\": [\"A\", \"B\", \"C\", \"D\"], \"correct_answer_index\": 0}}\n\n"
+            f"Text: {context}"
+        )
+    count = 0
+    async for kind, item in _stream_study_items(text, language, build_prompt, "quiz_stream", "questions", num_questions=num_questions):
+        if kind == "progress":
+            yield (kind, item)
+        elif "question" in item and isinstance(item.get("options"), list):
+            count += 1
+            item["id"] = count
+            yield ("question", item)
+    if not count:
+        raise llm.LLMResponseError("Quiz response has no questions")
+
+async def stream_flashcards(text: str, language: str, num_cards: int = 8):
+    """Yield ("card", card) events one by one as they are generated, after ("progress", {...}) events for long documents.
+
+    Raises llm.LLMResponseError when no card could be parsed from the response.
+    """
+    count = 0
+    def build_prompt(context: str) -> str:
+        lang_instruction = prompt_instruction(language, context)
+        return (
+            f"You are an educational flashcard generator. Create {num_cards} flashcards {lang_instruction} with term/definition pairs. "
+            f"Return ONLY JSON Lines: one JSON object per line, no array and no code fences. Each line: "
+            f"{{\"term\": \"...\", \"definition\": \"...\"}}\n\n"
+            f"Text: {context}"
+        )
+    async for kind, item in _stream_study_items(text, language, build_prompt, "flashcards_stream", "cards", num_cards=num_cards):
+        if kind == "progress":
+            yield (kind, item)
+        elif "term" in item and "definition" in item:
+            count += 1
+            yield ("card", item)
+    if not count:
+        raise llm.LLMResponseError("Flashcards response has no cards")
+
+# The provider reports a file_data URI it no longer has (deleted or expired remotely) with these
+_MISSING_FILE_STATUS_CODES = {403, 404}
+
+def _generate_with_file(prompt: str, file_path: str, mime_type: str, **options) -> llm.LLMResult:
+    """generate_sync on the prompt plus the uploaded file, uploading it again once if the model rejects the handle"""
+    # Reuses an earlier upload of the same content while it is live
+    uploaded_file = remote_files.get_or_upload(file_path, mime_type)
+    try:
+        return llm.gateway.generate_sync([prompt, uploaded_file], **options)
+    except llm.LLMError as e:
+        if llm._status_code(e.__cause__) not in _MISSING_FILE_STATUS_CODES:
+            raise
+        print(f"Remote file for {os.path.basename(file_path)} was rejected ({e}), uploading it again")
+        remote_files.invalidate(file_path, mime_type, uploaded_file["file_data"]["file_uri"])
+        uploaded_file = remote_files.get_or_upload(file_path, mime_type)
+        return llm.gateway.generate_sync([prompt, uploaded_file], **options)
+
+def transcribe_segment(file_path: str, mime_type: str, duration_seconds: float = None, timeout: float = None) -> str:
+    """Transcribe one audio clip with [mm:ss] timestamps relative to its start (blocking, raises on failure)"""
+    length = f" The clip is about {int(duration_seconds // 60)} minutes long." if duration_seconds else ""
+    prompt = (
+        "Please provide a detailed and accurate transcription of the speech in this media."
+        f"{length} Start every line with the time it is spoken, as [mm:ss] measured from the start of this clip. "
+        "Transcribe Arabic and English speech in the language spoken; do not translate."
+    )
+    result = _generate_with_file(prompt, file_path, mime_type, timeout=timeout)
+    return result.text
+
+def ocr_pdf_pages(file_path: str, page_count: int) -> str:
+    """OCR a PDF of scanned pages, each page's text under a "--- Page N ---" line (blocking, raises on failure)"""
+    prompt = (
+        f"This PDF has {page_count} scanned pages. Perform OCR on every page and extract all text visible, including handwritten notes. "
+        "If there is an Arabic text, extract it accurately. "
+        f"Start the text of each page with a line \"--- Page N ---\", where N is the page number in this file (1 to {page_count})."
+    )
+    return _generate_with_file(prompt, file_path, "application/pdf").text
 
 def extract_text_from_file(file_path: str, media_type: str) -> str:
-    """Use Gemini to extract text, OCR images, or transcribe media"""
+    """Use Gemini to extract text, OCR images, or transcribe media (blocking, for job workers).
+
+    Errors propagate so the extraction job retries and finally marks the document failed.
+    """
     try:
         if media_type == "image":
-            # Direct byte upload is MUCH faster for images
-            with open(file_path, "rb") as f:
-                image_data = f.read()
-            
+            # Inline bytes are MUCH faster than the upload API for images,
+            # after downscaling/recompressing them for OCR
+            prepared = image_prep.prepare_for_ocr(file_path)
             prompt = "Perform OCR on this image. Extract all text visible, including handwritten notes. If there is an Arabic text, extract it accurately."
-            response = model.generate_content([
-                prompt,
-                {"mime_type": "image/jpeg", "data": image_data}
-            ])
-            return response.text
+            if len(prepared.parts) > 1:
+                prompt += (
+                    f" The image is a tall page split into {len(prepared.parts)} consecutive parts, top to bottom, that overlap slightly."
+                    " Return the text of the whole page once, in reading order."
+                )
+            result = llm.gateway.generate_sync([prompt, *prepared.parts])
+            return result.text
 
         # For large files (PDF, Audio, Video), use the Upload API
         mime_map = {
@@ -119,8 +712,6 @@ def extract_text_from_file(file_path: str, media_type: str) -> str:
         }
         
         mime_type = mime_map.get(media_type, "application/octet-stream")
-        uploaded_file = genai.upload_file(path=file_path, mime_type=mime_type)
-        
         prompt = ""
         if media_type == "pdf":
             prompt = "Please extract all the text and key information from this PDF precisely."
@@ -129,8 +720,8 @@ def extract_text_from_file(file_path: str, media_type: str) -> str:
         else:
             prompt = "Analyze this file and extract all text/information."
 
-        response = model.generate_content([prompt, uploaded_file])
-        return response.text
+        result = _generate_with_file(prompt, file_path, mime_type)
+        return result.text
     except Exception as e:
         print(f"Gemini Extraction Error: {e}")
-        return f"Extraction failed: {str(e)}"
+        raise
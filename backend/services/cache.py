@@ -1,20 +1,158 @@
-from functools import lru_cache
+import json
+import os
+import sys
+import threading
 import time
+from collections import OrderedDict
+from services import metrics
 
-# Simple in-memory cache for demonstration
-# In production, use Redis or Memcached
+# Bounded in-process cache with TTLs, LRU eviction and tag based invalidation.
+# In production with several workers, use Redis or Memcached.
 
-_memory_cache = {}
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "3600"))
+
+def _estimate_size(value) -> int:
+    try:
+        return len(json.dumps(value, default=str).encode())
+    except (TypeError, ValueError):
+        return sys.getsizeof(value)
+
+class TTLCache:
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES, default_ttl: float = CACHE_TTL_SECONDS, name: str = None):
+        self.name = name  # label for the cache metrics
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()  # key -> (value, expires_at, size, tags)
+        self._tags = {}  # tag -> set of keys
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: str):
+        value = self._get(key)
+        if self.name:
+            metrics.CACHE_REQUESTS.inc(cache=self.name, result="miss" if value is None else "hit")
+        return value
+
+    def _get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[1] <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: str, value, ttl: float = None, tags=()):
+        size = _estimate_size(value)
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + (self.default_ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires_at, size, tuple(tags))
+            self._bytes += size
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                self.invalidations += 1
+
+    def invalidate_tag(self, tag: str):
+        with self._lock:
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, key: str):
+        # Caller holds the lock
+        value, expires_at, size, tags = self._entries.pop(key)
+        self._bytes -= size
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+_default_cache = TTLCache(name="responses")
+
+def make_key(namespace: str, user_id: int = None, document_id: int = None, *parts) -> str:
+    """Build a namespaced key, e.g. analyze:u1:d42"""
+    key = [namespace]
+    if user_id is not None:
+        key.append(f"u{user_id}")
+    if document_id is not None:
+        key.append(f"d{document_id}")
+    key.extend(str(p) for p in parts)
+    return ":".join(key)
+
+def tags_for(user_id: int = None, document_id: int = None) -> list:
+    tags = []
+    if user_id is not None:
+        tags.append(f"user:{user_id}")
+    if document_id is not None:
+        tags.append(f"doc:{document_id}")
+    return tags
 
 def get_cached_result(key: str):
-    entry = _memory_cache.get(key)
-    if entry:
-        # Check expiry if needed, for MVP we keep it simple
-        return entry
-    return None
+    return _default_cache.get(key)
+
+def set_cached_result(key: str, value: any, ttl: float = None, tags=()):
+    _default_cache.set(key, value, ttl=ttl, tags=tags)
+
+def invalidate_document(document_id: int):
+    """Drop every cached entry derived from a document (call whenever it changes)"""
+    _default_cache.invalidate_tag(f"doc:{document_id}")
+
+def invalidate_user(user_id: int):
+    _default_cache.invalidate_tag(f"user:{user_id}")
 
-def set_cached_result(key: str, value: any):
-    _memory_cache[key] = value
+def cache_stats() -> dict:
+    return _default_cache.stats()
 
 def clear_cache():
-    _memory_cache.clear()
+    _default_cache.clear()
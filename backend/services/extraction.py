@@ -1,31 +1,171 @@
+import multiprocessing
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Optional
 import pypdf
-from typing import Optional
-from services import ai_engine
+from services import ai_engine, metrics
 
-def extract_text_from_pdf(file_path: str) -> Optional[str]:
-    # Try standard pypdf first (near instant)
-    text = ""
+# Pages yielding fewer non-whitespace characters than this are treated as scanned
+PDF_MIN_PAGE_CHARS = int(os.getenv("PDF_MIN_PAGE_CHARS", "40"))
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(os.cpu_count() or 2, 8))))
+PDF_OCR_CONCURRENCY = int(os.getenv("PDF_OCR_CONCURRENCY", "4"))
+# Consecutive scanned pages are OCRed together, up to this many per request
+PDF_OCR_PAGES_PER_CALL = int(os.getenv("PDF_OCR_PAGES_PER_CALL", "10"))
+# Below this page count the process pool costs more than it saves
+PDF_PARALLEL_MIN_PAGES = 16
+
+_PAGE_MARKER = re.compile(r"^[ \t]*-{2,}[ \t]*Page[ \t]+(\d+)[ \t]*-{2,}[ \t]*$", re.MULTILINE | re.IGNORECASE)
+
+_pool = None
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: forking a process that runs job worker threads is not safe
+        _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+def _extract_page_range(file_path: str, start: int, end: int) -> List[str]:
+    """Extract text for pages [start, end). Runs inside pool processes."""
+    reader = pypdf.PdfReader(file_path)
+    texts = []
+    for index in range(start, end):
+        try:
+            texts.append(reader.pages[index].extract_text() or "")
+        except Exception as e:
+            print(f"Error extracting page {index + 1} of {file_path}: {e}")
+            texts.append("")
+    return texts
+
+def _extract_pages(file_path: str, page_count: int) -> List[str]:
+    if page_count < PDF_PARALLEL_MIN_PAGES or PDF_WORKERS <= 1:
+        return _extract_page_range(file_path, 0, page_count)
+
+    batch = -(-page_count // PDF_WORKERS)
     try:
-        reader = pypdf.PdfReader(file_path)
-        for page in reader.pages:
-            extracted = page.extract_text()
-            if extracted:
-                text += extracted + "\n"
-        
-        # If we got substantial text, return it immediately (fast path)
-        if len(text.strip()) > 200:
-            return text.strip()
+        pool = _get_pool()
+        futures = [
+            pool.submit(_extract_page_range, file_path, start, min(start + batch, page_count))
+            for start in range(0, page_count, batch)
+        ]
+        texts = []
+        for future in futures:
+            texts.extend(future.result())
+        return texts
     except Exception as e:
-        print(f"Error extracting with pypdf: {e}")
+        print(f"Parallel PDF extraction failed, falling back to serial: {e}")
+        return _extract_page_range(file_path, 0, page_count)
+
+def _page_yield(text: str) -> int:
+    return len("".join(text.split()))
+
+def _has_images(page) -> bool:
+    """Whether the page draws an image (XObject, or a form that may contain one) or an inline image"""
+    resources = page.get("/Resources")
+    xobjects = resources.get_object().get("/XObject") if resources else None
+    if xobjects:
+        for xobject in xobjects.get_object().values():
+            if xobject.get_object().get("/Subtype") in ("/Image", "/Form"):
+                return True
+    try:
+        contents = page.get_contents()
+        return contents is not None and b"BI" in contents.get_data()
+    except Exception:
+        return True  # can't tell, let OCR decide
+
+def _ocr_groups(scanned: List[int]) -> List[List[int]]:
+    """Runs of consecutive pages, at most PDF_OCR_PAGES_PER_CALL each"""
+    groups = []
+    for index in scanned:
+        if groups and groups[-1][-1] == index - 1 and len(groups[-1]) < PDF_OCR_PAGES_PER_CALL:
+            groups[-1].append(index)
+        else:
+            groups.append([index])
+    return groups
 
-    # If pypdf failed or got very little text (likely a scanned PDF), use Gemini
+def _write_pages_pdf(reader: pypdf.PdfReader, indices: List[int]) -> str:
+    """Copy the pages into one temporary PDF"""
+    fd, pages_path = tempfile.mkstemp(suffix=".pdf")
     try:
-        print(f"Low text yield from pypdf for {file_path}, attempting Gemini AI extraction...")
-        ai_text = ai_engine.extract_text_from_file(file_path, "pdf")
-        if ai_text and not ai_text.startswith("Extraction failed"):
-            return ai_text.strip()
+        writer = pypdf.PdfWriter()
+        for index in indices:
+            writer.add_page(reader.pages[index])
+        with os.fdopen(fd, "wb") as f:
+            writer.write(f)
+    except BaseException:
+        os.remove(pages_path)
+        raise
+    return pages_path
+
+def _split_pages(text: str, count: int) -> List[Optional[str]]:
+    """Per-page texts from an OCR response with "--- Page N ---" lines; unmarked text goes to the first page"""
+    pages = [None] * count
+    markers = list(_PAGE_MARKER.finditer(text))
+    current = 0
+    bounds = [(0, markers[0].start() if markers else len(text), None)]
+    bounds += [(m.end(), markers[i + 1].start() if i + 1 < len(markers) else len(text), int(m.group(1)))
+               for i, m in enumerate(markers)]
+    for start, end, number in bounds:
+        if number is not None and 1 <= number <= count:
+            current = number - 1
+        body = text[start:end].strip()
+        if body:
+            pages[current] = f"{pages[current]}\n{body}" if pages[current] else body
+    return pages
+
+def _ocr_pages(pages_path: str, indices: List[int]) -> List[Optional[str]]:
+    """Raises when OCR fails, so the extraction job is retried"""
+    try:
+        with metrics.timed("pdf_ocr_pages"):
+            text = ai_engine.ocr_pdf_pages(pages_path, len(indices))
     except Exception as e:
-        print(f"Gemini PDF extraction failed: {e}")
+        print(f"Gemini OCR failed for pages {indices[0] + 1}-{indices[-1] + 1}: {e}")
+        raise
+    return _split_pages(text, len(indices))
+
+def extract_text_from_pdf(file_path: str) -> Optional[str]:
+    """Extract PDF text page by page, OCRing only pages without a usable text layer"""
+    try:
+        reader = pypdf.PdfReader(file_path)
+        page_count = len(reader.pages)
+    except Exception as e:
+        print(f"Error opening PDF with pypdf: {e}")
+        return _extract_whole_file_with_ai(file_path)
+
+    # Fast path: pypdf text layer, pages extracted in parallel for large documents
+    with metrics.timed("pdf_extract"):
+        pages = _extract_pages(file_path, page_count)
+
+    # Only low-yield (likely scanned) pages go to OCR; blank ones (no text, no image) are skipped
+    scanned = [
+        i for i, text in enumerate(pages)
+        if _page_yield(text) < PDF_MIN_PAGE_CHARS and (_page_yield(text) or _has_images(reader.pages[i]))
+    ]
+    if scanned:
+        groups = _ocr_groups(scanned)
+        print(f"{len(scanned)}/{page_count} low-yield pages in {file_path}, OCRing them in {len(groups)} requests...")
+        group_paths = []
+        try:
+            # pypdf objects aren't thread-safe: split pages serially, OCR them concurrently
+            for group in groups:
+                group_paths.append(_write_pages_pdf(reader, group))
+            with ThreadPoolExecutor(max_workers=PDF_OCR_CONCURRENCY) as executor:
+                ocr_texts = list(executor.map(_ocr_pages, group_paths, groups))
+        finally:
+            for group_path in group_paths:
+                os.remove(group_path)
+        for group, group_texts in zip(groups, ocr_texts):
+            for index, ocr_text in zip(group, group_texts):
+                if ocr_text:
+                    pages[index] = ocr_text
+
+    text = "\n\n".join(
+        f"--- Page {i + 1} ---\n{page.strip()}" for i, page in enumerate(pages) if page.strip()
+    )
+    return text or None
 
-    # Final fallback to whatever pypdf managed to get
-    return text.strip() if text else None
+def _extract_whole_file_with_ai(file_path: str) -> Optional[str]:
+    ai_text = ai_engine.extract_text_from_file(file_path, "pdf")
+    return ai_text.strip() or None
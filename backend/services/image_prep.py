@@ -0,0 +1,109 @@
+import io
+import os
+from collections import namedtuple
+from PIL import Image, ImageOps
+from services import metrics
+
+# Images are normalized before OCR: orientation fixed from EXIF, downscaled to a
+# resolution that is still comfortably readable, converted to grayscale JPEG and,
+# for very tall scans (receipts, screenshots of long pages), cut into tiles.
+# Phone photos shrink from 10-15 MB to a few hundred KB.
+
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "2048"))
+OCR_MAX_WIDTH = int(os.getenv("OCR_MAX_WIDTH", "1600"))
+OCR_TILE_HEIGHT = int(os.getenv("OCR_TILE_HEIGHT", "2400"))
+OCR_TILE_OVERLAP = int(os.getenv("OCR_TILE_OVERLAP", "80"))
+OCR_JPEG_QUALITY = int(os.getenv("OCR_JPEG_QUALITY", "85"))
+# Height/width ratio from which an image is tiled instead of downscaled as a whole
+OCR_TALL_RATIO = 2.5
+
+PreparedImage = namedtuple("PreparedImage", "parts original_bytes sent_bytes")
+
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+def sniff_mime(head: bytes, default: str = "image/jpeg") -> str:
+    """MIME type from the file's magic bytes (the extension or upload header can lie)"""
+    for signature, mime_type in _SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return default
+
+def _is_tall(width: int, height: int) -> bool:
+    return height > width * OCR_TALL_RATIO
+
+def _scale(width: int, height: int) -> float:
+    """Tall scans keep their length (they are tiled) and are capped in width only"""
+    if _is_tall(width, height):
+        return min(1.0, OCR_MAX_WIDTH / width)
+    return min(1.0, OCR_MAX_SIDE / max(width, height))
+
+def _tiles(image: Image.Image) -> list:
+    """Vertical slices of at most OCR_TILE_HEIGHT, overlapping so no text line is cut in half"""
+    width, height = image.size
+    if height <= OCR_TILE_HEIGHT:
+        return [image]
+    step = OCR_TILE_HEIGHT - OCR_TILE_OVERLAP
+    return [image.crop((0, top, width, min(top + OCR_TILE_HEIGHT, height))) for top in range(0, height - OCR_TILE_OVERLAP, step)]
+
+def _encode(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=OCR_JPEG_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+def prepare_for_ocr(file_path: str) -> PreparedImage:
+    """OCR-ready image parts as [{"mime_type", "data"}], in reading order"""
+    with metrics.timed("image_prep"):
+        return _prepare(file_path)
+
+def _prepare(file_path: str) -> PreparedImage:
+    original_bytes = os.path.getsize(file_path)
+    with open(file_path, "rb") as f:
+        mime_type = sniff_mime(f.read(16))
+
+    try:
+        with Image.open(file_path) as image:
+            # JPEG can decode directly at 1/2, 1/4 or 1/8 scale, which keeps peak
+            # memory far below that of the full-size bitmap. The EXIF rotation is
+            # not applied yet, so allow for either orientation.
+            width, height = image.size
+            scale = max(_scale(width, height), _scale(height, width))
+            image.draft("L", (round(width * scale), round(height * scale)))
+            image = ImageOps.exif_transpose(image)
+
+            width, height = image.size
+            scale = _scale(width, height)
+            if scale < 1.0:
+                image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+            if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+                # Transparent areas would turn black in grayscale
+                image = Image.alpha_composite(Image.new("RGBA", image.size, "white"), image.convert("RGBA"))
+            image = image.convert("L")
+            tiles = _tiles(image) if _is_tall(width, height) else [image]
+            parts = [{"mime_type": "image/jpeg", "data": _encode(tile)} for tile in tiles]
+    except (OSError, Image.DecompressionBombError) as e:
+        print(f"Image preprocessing failed for {file_path}, sending original: {e}")
+        with open(file_path, "rb") as f:
+            return PreparedImage([{"mime_type": mime_type, "data": f.read()}], original_bytes, original_bytes)
+
+    sent_bytes = sum(len(part["data"]) for part in parts)
+    if sent_bytes >= original_bytes:
+        # Small, already compact images (e.g. screenshots, or tall PNG scans whose
+        # JPEG tiles add up to more) are sent as they are
+        with open(file_path, "rb") as f:
+            return PreparedImage([{"mime_type": mime_type, "data": f.read()}], original_bytes, original_bytes)
+
+    saved = original_bytes - sent_bytes
+    if saved > 0:
+        metrics.BYTES.inc(saved, kind="image_prep_saved")
+    print(
+        f"Image prep {os.path.basename(file_path)}: {original_bytes // 1024} KB -> {sent_bytes // 1024} KB "
+        f"in {len(parts)} part(s), saved {saved // 1024} KB ({100 * saved / max(original_bytes, 1):.0f}%)"
+    )
+    return PreparedImage(parts, original_bytes, sent_bytes)
@@ -0,0 +1,223 @@
+import json
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import database
+import models
+from services import extraction, transcription, ocr, storage, cache, search, vector_index, study_pack, language, metrics
+
+# Background job queue. Jobs are persisted in the `jobs` table so pending work
+# survives restarts; a thread pool runs them outside the request/event loop.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Workers renew the heartbeat of their running jobs this often; a running job
+# that missed JOB_STALE_HEARTBEATS heartbeats belongs to a dead worker and is requeued
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "30"))
+JOB_STALE_HEARTBEATS = 3
+
+# Identifies this process (and boot), so a restart never mistakes old jobs for its own
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+_executor = None
+_executor_lock = threading.Lock()
+_running = set()  # ids of the jobs this process is running
+_running_lock = threading.Lock()
+_heartbeat_stop = threading.Event()
+_heartbeat_thread = None
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job-worker")
+        return _executor
+
+def enqueue(db, kind: str, document_id: int = None, course_id: int = None, result: str = None) -> models.Job:
+    """Persist a new job and hand it to the worker pool"""
+    job = models.Job(kind=kind, document_id=document_id, course_id=course_id, result=result)
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    submit(job.id)
+    return job
+
+def submit(job_id: int):
+    _get_executor().submit(_run_job, job_id)
+
+def _is_dead_local_worker(worker: str) -> bool:
+    """A worker of an earlier boot on this host whose process is gone (known without waiting for heartbeats)"""
+    host, _, rest = (worker or "").partition(":")
+    pid = rest.partition(":")[0]
+    if worker == WORKER_ID or host != socket.gethostname() or not pid.isdigit():
+        return False
+    if int(pid) == os.getpid():
+        return True  # same pid, different boot: e.g. pid 1 in a restarted container
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass
+    return False
+
+def requeue_orphaned(db) -> list:
+    """Requeue running jobs that no live worker owns (crashed or restarted); returns their ids"""
+    stale_before = datetime.utcnow() - timedelta(seconds=JOB_HEARTBEAT_SECONDS * JOB_STALE_HEARTBEATS)
+    running = (models.Job.status == "running") & (models.Job.worker.is_(None) | (models.Job.worker != WORKER_ID))
+    stale = models.Job.heartbeat_at.is_(None) | (models.Job.heartbeat_at < stale_before)
+    requeued = []
+    for job_id, worker, heartbeat_at in db.query(models.Job.id, models.Job.worker, models.Job.heartbeat_at).filter(running).all():
+        dead = _is_dead_local_worker(worker)
+        if not dead and heartbeat_at is not None and heartbeat_at >= stale_before:
+            continue
+        # Conditional update: another worker may requeue (and claim) it first
+        orphaned = running & (models.Job.worker == worker if worker else models.Job.worker.is_(None))
+        if not dead:
+            orphaned = orphaned & stale
+        if db.query(models.Job).filter(models.Job.id == job_id, orphaned).update(
+            {"status": "queued", "worker": None}, synchronize_session=False
+        ):
+            requeued.append(job_id)
+    db.commit()
+    return requeued
+
+def _heartbeat_loop():
+    while not _heartbeat_stop.wait(JOB_HEARTBEAT_SECONDS):
+        db = database.SessionLocal()
+        try:
+            with _running_lock:
+                running = list(_running)
+            if running:
+                db.query(models.Job).filter(
+                    models.Job.id.in_(running), models.Job.worker == WORKER_ID
+                ).update({"heartbeat_at": datetime.utcnow()}, synchronize_session=False)
+                db.commit()
+            # Also picks up jobs of workers that died while this one keeps running
+            for job_id in requeue_orphaned(db):
+                print(f"Requeued job {job_id} of a worker that stopped")
+                submit(job_id)
+        except Exception as e:
+            db.rollback()
+            print(f"Job heartbeat failed: {e}")
+        finally:
+            db.close()
+
+def start():
+    """Start the worker pool and requeue jobs left over from a previous run"""
+    global _heartbeat_thread
+    db = database.SessionLocal()
+    try:
+        requeue_orphaned(db)
+        pending = [job_id for (job_id,) in db.query(models.Job.id).filter(models.Job.status == "queued").order_by(models.Job.id)]
+    finally:
+        db.close()
+
+    for job_id in pending:
+        submit(job_id)
+    if _heartbeat_thread is None:
+        _heartbeat_stop.clear()
+        _heartbeat_thread = threading.Thread(target=_heartbeat_loop, name="job-heartbeat", daemon=True)
+        _heartbeat_thread.start()
+    print(f"Job workers started ({JOB_WORKERS} workers, {len(pending)} pending jobs)")
+
+def shutdown():
+    global _executor, _heartbeat_thread
+    _heartbeat_stop.set()
+    _heartbeat_thread = None
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+def _claim(db, job_id: int) -> bool:
+    """Atomically move a queued job to running so only one worker picks it up"""
+    claimed = db.query(models.Job).filter(
+        models.Job.id == job_id,
+        models.Job.status == "queued"
+    ).update({
+        "status": "running",
+        "started_at": datetime.utcnow(),
+        "worker": WORKER_ID,
+        "heartbeat_at": datetime.utcnow(),
+        "attempts": models.Job.attempts + 1
+    }, synchronize_session=False)
+    db.commit()
+    return claimed == 1
+
+def _run_job(job_id: int):
+    db = database.SessionLocal()
+    try:
+        if not _claim(db, job_id):
+            return
+        with _running_lock:
+            _running.add(job_id)
+        job = db.get(models.Job, job_id)
+        handler = HANDLERS.get(job.kind)
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown job kind: {job.kind}")
+            with metrics.timed(f"job_{job.kind}"):
+                handler(db, job)
+            job.status = "done"
+            job.error = None
+            job.finished_at = datetime.utcnow()
+            db.commit()
+            if job.document is not None:
+                cache.invalidate_document(job.document_id)
+                search.safe_index_document(db, job.document)
+                vector_index.safe_index_document(job.document)
+        except Exception as e:
+            db.rollback()
+            print(f"Job {job_id} ({job.kind}) failed on attempt {job.attempts}: {e}")
+            job.error = str(e)
+            if handler is not None and job.attempts < JOB_MAX_ATTEMPTS:
+                job.status = "queued"
+                db.commit()
+                submit(job_id)
+                return
+            job.status = "failed"
+            job.finished_at = datetime.utcnow()
+            if job.document is not None:
+                job.document.status = "failed"
+            db.commit()
+    finally:
+        with _running_lock:
+            _running.discard(job_id)
+        db.close()
+
+def _extract_document(db, job: models.Job):
+    """Extract/Transcribe/OCR an uploaded document and mark it ready"""
+    doc = job.document
+    if doc is None:
+        raise ValueError(f"Document {job.document_id} no longer exists")
+
+    # An identical upload may have finished while this job was queued
+    if doc.content_hash:
+        existing = storage.find_reusable_document(db, doc.content_hash)
+        if existing and existing.id != doc.id:
+            storage.copy_extraction(existing, doc)
+            return
+
+    if doc.media_type == 'pdf':
+        extracted_text = extraction.extract_text_from_pdf(doc.file_path)
+    elif doc.media_type == 'image':
+        extracted_text = ocr.extract_text_from_image(doc.file_path)
+    else:
+        # Audio/Video
+        extracted_text = transcription.transcribe_document(db, doc)
+
+    # Script proportions on a bounded sample, plus per-page/segment tags
+    stats = language.analyze_document(extracted_text or "")
+
+    doc.extracted_text = extracted_text
+    doc.language = language.primary_language(stats)
+    doc.language_stats = json.dumps(stats)
+    doc.status = "ready"
+
+HANDLERS = {
+    "extract": _extract_document,
+    "study_pack": study_pack.generate_course_pack,
+}
@@ -0,0 +1,106 @@
+import os
+import re
+import numpy as np
+
+# Arabic/English detection by script proportions.
+# Text is sampled (bounded number of evenly spaced windows) and counted at the
+# byte level: in UTF-8 every character of the Arabic block U+0600-U+06FF starts
+# with a lead byte 0xD8-0xDB, and Latin letters are ASCII A-Z/a-z (plus 0xC3 for
+# accented Latin-1 letters), so one np.bincount gives both counts.
+
+LANGUAGE_SAMPLE_CHARS = int(os.getenv("LANGUAGE_SAMPLE_CHARS", "65536"))
+LANGUAGE_SAMPLE_WINDOWS = 16
+LANGUAGE_SEGMENT_CHARS = int(os.getenv("LANGUAGE_SEGMENT_CHARS", "2000"))
+LANGUAGE_MAX_SEGMENTS = int(os.getenv("LANGUAGE_MAX_SEGMENTS", "500"))
+# Minority script share from which a text counts as mixed
+MIXED_THRESHOLD = float(os.getenv("LANGUAGE_MIXED_THRESHOLD", "0.2"))
+
+_PAGE_MARKER = re.compile(r"--- Page (\d+) ---")
+
+def _sample(text: str, budget: int = LANGUAGE_SAMPLE_CHARS) -> str:
+    """At most `budget` characters taken from evenly spaced windows across the text"""
+    if len(text) <= budget:
+        return text
+    window = budget // LANGUAGE_SAMPLE_WINDOWS
+    step = (len(text) - window) / (LANGUAGE_SAMPLE_WINDOWS - 1)
+    return "".join(text[int(i * step):int(i * step) + window] for i in range(LANGUAGE_SAMPLE_WINDOWS))
+
+def script_counts(text: str, budget: int = LANGUAGE_SAMPLE_CHARS):
+    """(arabic, latin) letter counts of a bounded sample of the text"""
+    if not text:
+        return 0, 0
+    data = np.frombuffer(_sample(text, budget).encode("utf-8", "ignore"), dtype=np.uint8)
+    counts = np.bincount(data, minlength=256)
+    arabic = int(counts[0xD8:0xDC].sum())
+    latin = int(counts[0x41:0x5B].sum() + counts[0x61:0x7B].sum() + counts[0xC3])
+    return arabic, latin
+
+def _classify(arabic: int, latin: int) -> dict:
+    total = arabic + latin
+    if total == 0:
+        return {"language": None, "ar": 0.0, "en": 0.0}
+    ar_share = arabic / total
+    minority = min(ar_share, 1 - ar_share)
+    if minority >= MIXED_THRESHOLD:
+        language = "mixed"
+    else:
+        language = "ar" if ar_share > 0.5 else "en"
+    return {"language": language, "ar": round(ar_share, 3), "en": round(1 - ar_share, 3)}
+
+def detect(text: str, budget: int = LANGUAGE_SAMPLE_CHARS) -> dict:
+    """{"language": "ar" | "en" | "mixed" | None, "ar": share, "en": share}"""
+    return _classify(*script_counts(text, budget))
+
+def primary_language(stats: dict, default: str = "en") -> str:
+    """The dominant language ("ar" or "en"), also for mixed text"""
+    if not stats.get("language"):
+        return default
+    return "ar" if stats["ar"] > stats["en"] else "en"
+
+def _segments(text: str) -> list:
+    """(start, end, page) spans: PDF pages when page markers exist, fixed windows otherwise"""
+    markers = list(_PAGE_MARKER.finditer(text))
+    if markers:
+        return [
+            (m.start(), markers[i + 1].start() if i + 1 < len(markers) else len(text), int(m.group(1)))
+            for i, m in enumerate(markers)
+        ]
+    size = max(LANGUAGE_SEGMENT_CHARS, -(-len(text) // LANGUAGE_MAX_SEGMENTS))
+    return [(start, min(start + size, len(text)), None) for start in range(0, len(text), size)]
+
+def tag_segments(text: str) -> list:
+    """Language runs over the text: consecutive segments with the same language are merged.
+
+    Each segment is judged on a small sample, so the cost is bounded by
+    LANGUAGE_MAX_SEGMENTS for transcripts (pages are tagged individually).
+    """
+    per_segment_budget = max(256, LANGUAGE_SAMPLE_CHARS // max(1, LANGUAGE_MAX_SEGMENTS) * 4)
+    runs = []
+    for start, end, page in _segments(text or ""):
+        language = detect(text[start:end], per_segment_budget)["language"]
+        if language is None:
+            continue
+        if page is not None:
+            runs.append({"page": page, "start": start, "end": end, "language": language})
+        elif runs and runs[-1]["language"] == language and runs[-1]["end"] == start:
+            runs[-1]["end"] = end
+        else:
+            runs.append({"start": start, "end": end, "language": language})
+    return runs
+
+def analyze_document(text: str) -> dict:
+    """Per-document distribution plus segment tags, stored as Document.language_stats"""
+    stats = detect(text)
+    stats["segments"] = tag_segments(text)
+    return stats
+
+def prompt_instruction(language: str, text: str = "") -> str:
+    """Output-language instruction for prompts, aware of code-switched (Arabic/English) input"""
+    target = "in Arabic" if language == "ar" else "in English"
+    if text and detect(text, 8192)["language"] == "mixed":
+        other = "English" if language == "ar" else "Arabic"
+        return (
+            f"{target} (the source mixes Arabic and English: read both, keep {other} technical terms and names "
+            f"in their original script with a translation in parentheses)"
+        )
+    return target
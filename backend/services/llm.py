@@ -0,0 +1,342 @@
+import asyncio
+import hashlib
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from dotenv import load_dotenv
+from services import metrics
+
+# Shared LLM gateway used by ai_engine and study_tools_ai.
+# All provider calls run on one background event loop so rate limiting,
+# retries and the in-flight cap apply across requests, job workers and threads.
+
+load_dotenv()
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-flash-latest")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "120"))
+# Prompts with uploaded files or inline media (extraction, OCR, transcription) take much longer
+LLM_FILE_TIMEOUT_SECONDS = float(os.getenv("LLM_FILE_TIMEOUT_SECONDS", "900"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "1.0"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "30"))
+
+# Requests per minute allowed per provider and API key
+LLM_RATE_LIMITS_RPM = {
+    "gemini": float(os.getenv("GEMINI_RPM", "60")),
+    "openai": float(os.getenv("OPENAI_RPM", "60")),
+}
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# Transient client errors that don't subclass TimeoutError/ConnectionError and carry
+# no status code: openai's and httpx's (matched by name, the SDKs are imported lazily)
+RETRYABLE_ERROR_NAMES = {"APITimeoutError", "APIConnectionError", "TransportError"}
+
+class LLMError(Exception):
+    """Raised when a provider call fails for good (non-retryable or retries exhausted)"""
+
+class LLMResponseError(LLMError):
+    """The provider answered, but not with something usable (e.g. malformed JSON)"""
+
+@dataclass
+class LLMResult:
+    text: str
+    provider: str
+    model: str
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+@dataclass
+class LLMUsage:
+    """Token counts a provider's stream yields after its last text delta"""
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+class TokenBucket:
+    """Token bucket limiter; only used from the gateway loop so no locking is needed"""
+
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or max(1.0, rate_per_minute / 10.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def _key_id(api_key: str) -> str:
+    return hashlib.sha256((api_key or "").encode()).hexdigest()[:12]
+
+class GeminiProvider:
+    name = "gemini"
+
+    def __init__(self, api_key: str, model_name: str = GEMINI_MODEL):
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        self.key_id = _key_id(api_key)
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+
+    async def generate(self, contents, **options) -> LLMResult:
+        response = await self.model.generate_content_async(contents, **options)
+        usage = getattr(response, "usage_metadata", None)
+        return LLMResult(
+            text=response.text,
+            provider=self.name,
+            model=self.model_name,
+            input_tokens=getattr(usage, "prompt_token_count", 0) or 0,
+            output_tokens=getattr(usage, "candidates_token_count", 0) or 0
+        )
+
+    async def stream(self, contents, **options):
+        """Yield text deltas as the model produces them, then their LLMUsage"""
+        response = await self.model.generate_content_async(contents, stream=True, **options)
+        usage = None
+        async for chunk in response:
+            # Every chunk carries the running totals
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            if chunk.text:
+                yield chunk.text
+        yield LLMUsage(
+            input_tokens=getattr(usage, "prompt_token_count", 0) or 0,
+            output_tokens=getattr(usage, "candidates_token_count", 0) or 0
+        )
+
+class OpenAIProvider:
+    name = "openai"
+
+    def __init__(self, api_key: str, model_name: str = OPENAI_MODEL):
+        from openai import AsyncOpenAI
+        self.key_id = _key_id(api_key)
+        self.model_name = model_name
+        # The SDK keeps one pooled HTTP client per AsyncOpenAI instance
+        self.client = AsyncOpenAI(api_key=api_key, max_retries=0)
+
+    async def generate(self, contents, **options) -> LLMResult:
+        """contents is a list of chat messages"""
+        response = await self.client.chat.completions.create(model=self.model_name, messages=contents, **options)
+        usage = response.usage
+        return LLMResult(
+            text=response.choices[0].message.content,
+            provider=self.name,
+            model=self.model_name,
+            input_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            output_tokens=getattr(usage, "completion_tokens", 0) or 0
+        )
+
+    async def stream(self, contents, **options):
+        response = await self.client.chat.completions.create(
+            model=self.model_name, messages=contents, stream=True, stream_options={"include_usage": True}, **options
+        )
+        usage = None
+        async for chunk in response:
+            # The usage arrives in a last chunk without choices
+            usage = getattr(chunk, "usage", None) or usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+        yield LLMUsage(
+            input_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            output_tokens=getattr(usage, "completion_tokens", 0) or 0
+        )
+
+def _status_code(exc: Exception):
+    for attr in ("code", "status_code"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+def _is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    if any(cls.__name__ in RETRYABLE_ERROR_NAMES for cls in type(exc).__mro__):
+        return True
+    return _status_code(exc) in RETRYABLE_STATUS_CODES
+
+_MEDIA_PART_KEYS = ("file_data", "inline_data", "data")
+
+def _has_media(contents) -> bool:
+    """Whether a Gemini prompt has uploaded-file or inline media parts (chat messages never do)"""
+    if isinstance(contents, str):
+        return False
+    return any(isinstance(part, dict) and any(key in part for key in _MEDIA_PART_KEYS) for part in contents)
+
+def default_timeout(contents) -> float:
+    return LLM_FILE_TIMEOUT_SECONDS if _has_media(contents) else LLM_TIMEOUT_SECONDS
+
+class LLMGateway:
+    def __init__(self):
+        self._factories = {}
+        self._providers = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._semaphore = None
+
+    def register(self, name: str, factory):
+        """Register a provider factory; the client is created on first use"""
+        with self._lock:
+            self._factories[name] = factory
+            self._providers.pop(name, None)
+
+    def get_provider(self, name: str):
+        with self._lock:
+            if name not in self._providers:
+                if name not in self._factories:
+                    raise LLMError(f"Unknown LLM provider: {name}")
+                self._providers[name] = self._factories[name]()
+            return self._providers[name]
+
+    def model_name(self, provider: str = "gemini") -> str:
+        return self.get_provider(provider).model_name
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="llm-gateway", daemon=True).start()
+            return self._loop
+
+    def _bucket(self, provider) -> TokenBucket:
+        key = (provider.name, provider.key_id)
+        if key not in self._buckets:
+            self._buckets[key] = TokenBucket(LLM_RATE_LIMITS_RPM.get(provider.name, 60.0))
+        return self._buckets[key]
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(LLM_MAX_IN_FLIGHT)
+        return self._semaphore
+
+    async def _call(self, provider_name: str, contents, options: dict, timeout: float = None) -> LLMResult:
+        """Runs on the gateway loop: rate limit, cap concurrency, time out and retry"""
+        semaphore = self._get_semaphore()
+        provider = self.get_provider(provider_name)
+        bucket = self._bucket(provider)
+
+        attempt = 0
+        while True:
+            await bucket.acquire()
+            started = None
+            try:
+                async with semaphore:
+                    started = time.perf_counter()
+                    result = await asyncio.wait_for(provider.generate(contents, **options), timeout or default_timeout(contents))
+                metrics.LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, provider=provider_name, outcome="ok")
+                metrics.LLM_TOKENS.inc(result.input_tokens, provider=provider_name, direction="input")
+                metrics.LLM_TOKENS.inc(result.output_tokens, provider=provider_name, direction="output")
+                return result
+            except Exception as e:
+                if started is not None:
+                    metrics.LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, provider=provider_name, outcome="error")
+                if attempt >= LLM_MAX_RETRIES or not _is_retryable(e):
+                    raise LLMError(f"{provider_name} request failed: {e!r}") from e
+                # Exponential backoff with full jitter
+                delay = random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** attempt))
+                print(f"LLM {provider_name} attempt {attempt + 1} failed ({e!r}), retrying in {delay:.1f}s")
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def _pump(self, provider_name: str, contents, options: dict, emit):
+        """Runs on the gateway loop: like _call, but hands each delta to emit as it arrives.
+
+        A failed stream is only retried if nothing was emitted yet.
+        """
+        semaphore = self._get_semaphore()
+        provider = self.get_provider(provider_name)
+        bucket = self._bucket(provider)
+
+        attempt = 0
+        while True:
+            await bucket.acquire()
+            started = False
+            began = None
+            try:
+                async with semaphore:
+                    began = time.perf_counter()
+                    deltas = provider.stream(contents, **options).__aiter__()
+                    while True:
+                        try:
+                            delta = await asyncio.wait_for(deltas.__anext__(), LLM_TIMEOUT_SECONDS)
+                        except StopAsyncIteration:
+                            metrics.LLM_REQUEST_SECONDS.observe(time.perf_counter() - began, provider=provider_name, outcome="ok")
+                            return
+                        if isinstance(delta, LLMUsage):
+                            metrics.LLM_TOKENS.inc(delta.input_tokens, provider=provider_name, direction="input")
+                            metrics.LLM_TOKENS.inc(delta.output_tokens, provider=provider_name, direction="output")
+                            continue
+                        started = True
+                        emit(delta)
+            except Exception as e:
+                if began is not None:
+                    metrics.LLM_REQUEST_SECONDS.observe(time.perf_counter() - began, provider=provider_name, outcome="error")
+                if started or attempt >= LLM_MAX_RETRIES or not _is_retryable(e):
+                    raise LLMError(f"{provider_name} stream failed: {e!r}") from e
+                delay = random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** attempt))
+                print(f"LLM {provider_name} stream attempt {attempt + 1} failed ({e!r}), retrying in {delay:.1f}s")
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def stream(self, contents, provider: str = "gemini", **options):
+        """Async generator of text deltas, usable from any event loop.
+
+        Deltas are pushed from the gateway loop into a queue on the caller's loop;
+        closing the generator early (e.g. client disconnected) cancels the upstream call.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        done = object()
+
+        def emit(item):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                pass  # caller's loop already closed
+
+        future = asyncio.run_coroutine_threadsafe(self._pump(provider, contents, options, emit), self._get_loop())
+        future.add_done_callback(lambda f: emit(done))
+        began = time.perf_counter()
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                yield item
+            future.result()
+        finally:
+            future.cancel()
+            metrics.add_request_time("llm", time.perf_counter() - began)
+
+    async def generate(self, contents, provider: str = "gemini", **options) -> LLMResult:
+        """Async entry point, usable from any event loop"""
+        began = time.perf_counter()
+        future = asyncio.run_coroutine_threadsafe(self._call(provider, contents, options), self._get_loop())
+        try:
+            return await asyncio.wrap_future(future)
+        finally:
+            # The call runs on the gateway loop, so it is attributed to the request here
+            metrics.add_request_time("llm", time.perf_counter() - began)
+
+    def generate_sync(self, contents, provider: str = "gemini", timeout: float = None, **options) -> LLMResult:
+        """Blocking entry point for worker threads (never call from the gateway loop).
+
+        timeout (seconds per attempt) defaults to LLM_FILE_TIMEOUT_SECONDS for prompts
+        with files or media, LLM_TIMEOUT_SECONDS otherwise.
+        """
+        future = asyncio.run_coroutine_threadsafe(self._call(provider, contents, options, timeout), self._get_loop())
+        return future.result()
+
+gateway = LLMGateway()
+gateway.register("gemini", lambda: GeminiProvider(os.getenv("GEMINI_API_KEY")))
+gateway.register("openai", lambda: OpenAIProvider(os.getenv("OPENAI_API_KEY")))
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from services import metrics
+
+# Disk-backed cache of LLM responses keyed by a fingerprint of
+# model + prompt template/version + parameters + input text.
+# Lives in its own SQLite file so it survives restarts and deploys.
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "./llm_cache.db")
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = False
+
+def _connect() -> sqlite3.Connection:
+    """One connection per thread (sqlite3 connections can't be shared across threads)"""
+    global _initialized
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(LLM_CACHE_PATH, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+    with _init_lock:
+        if not _initialized:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS llm_responses (
+                    key TEXT PRIMARY KEY,
+                    model TEXT,
+                    template TEXT,
+                    template_version TEXT,
+                    response TEXT,
+                    input_tokens INTEGER,
+                    output_tokens INTEGER,
+                    created_at REAL,
+                    expires_at REAL
+                );
+                CREATE INDEX IF NOT EXISTS ix_llm_responses_template ON llm_responses (template, template_version);
+                CREATE INDEX IF NOT EXISTS ix_llm_responses_expires ON llm_responses (expires_at);
+            """)
+            _initialized = True
+    return conn
+
+def fingerprint(model: str, template: str, version: str, params: dict, text: str) -> str:
+    payload = json.dumps(
+        {"model": model, "template": template, "version": version, "params": params},
+        sort_keys=True, ensure_ascii=False
+    )
+    hasher = hashlib.sha256(payload.encode())
+    hasher.update(b"\0")
+    hasher.update(text.encode())
+    return hasher.hexdigest()
+
+def get(key: str):
+    """Return the cached response text, or None on a miss/expiry"""
+    if not LLM_CACHE_ENABLED:
+        return None
+    row = _connect().execute(
+        "SELECT response FROM llm_responses WHERE key = ? AND expires_at > ?", (key, time.time())
+    ).fetchone()
+    metrics.CACHE_REQUESTS.inc(cache="llm_responses", result="hit" if row else "miss")
+    return row[0] if row else None
+
+def put(key: str, response: str, model: str, template: str, version: str,
+        input_tokens: int = 0, output_tokens: int = 0, ttl: float = None):
+    if not LLM_CACHE_ENABLED:
+        return
+    now = time.time()
+    conn = _connect()
+    conn.execute(
+        "INSERT OR REPLACE INTO llm_responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (key, model, template, version, response, input_tokens, output_tokens,
+         now, now + (LLM_CACHE_TTL_SECONDS if ttl is None else ttl))
+    )
+    conn.commit()
+
+def purge_template(template: str, keep_version: str = None) -> int:
+    """Delete cached responses of a template, except those of keep_version"""
+    conn = _connect()
+    if keep_version is None:
+        cursor = conn.execute("DELETE FROM llm_responses WHERE template = ?", (template,))
+    else:
+        cursor = conn.execute(
+            "DELETE FROM llm_responses WHERE template = ? AND template_version != ?", (template, keep_version)
+        )
+    conn.commit()
+    return cursor.rowcount
+
+def purge_stale(current_versions: dict) -> int:
+    """Drop expired rows and rows produced by outdated prompt template versions"""
+    conn = _connect()
+    removed = conn.execute("DELETE FROM llm_responses WHERE expires_at <= ?", (time.time(),)).rowcount
+    conn.commit()
+    for template, version in current_versions.items():
+        removed += purge_template(template, keep_version=version)
+    return removed
+
+def stats() -> dict:
+    row = _connect().execute(
+        "SELECT COUNT(*), COALESCE(SUM(input_tokens), 0), COALESCE(SUM(output_tokens), 0) FROM llm_responses"
+    ).fetchone()
+    return {"entries": row[0], "input_tokens": row[1], "output_tokens": row[2]}
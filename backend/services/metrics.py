@@ -0,0 +1,232 @@
+import bisect
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# In-process metrics rendered in the Prometheus text format on /metrics.
+# Counters and histograms keep one series per label set; collectors report
+# values that are already counted elsewhere (e.g. cache hits) at scrape time.
+# Each HTTP request also collects its own stage timings, returned in the
+# Server-Timing header, so a slow request can be attributed to disk, pypdf,
+# the database or the LLM.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+_lock = threading.Lock()
+_metrics = []
+_collectors = []
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for name, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple((name, labels.get(name, "")) for name in self.labelnames)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with _lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = tuple((name, labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with _lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        samples = []
+        for key, values in series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", key + (("le", _format_value(float(bound))),), cumulative))
+            samples.append((f"{self.name}_bucket", key + (("le", "+Inf"),), values[-1]))
+            samples.append((f"{self.name}_sum", key, values[-2]))
+            samples.append((f"{self.name}_count", key, values[-1]))
+        return samples
+
+def counter(name: str, help: str, labelnames=()) -> Counter:
+    metric = Counter(name, help, labelnames)
+    _metrics.append(metric)
+    return metric
+
+def histogram(name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+    metric = Histogram(name, help, labelnames, buckets)
+    _metrics.append(metric)
+    return metric
+
+def register_collector(collect):
+    """collect() -> [(name, type, help, [(labels dict, value), ...]), ...], called on every scrape"""
+    _collectors.append(collect)
+
+def render() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    for collect in _collectors:
+        try:
+            families = collect()
+        except Exception as e:
+            print(f"Metrics collector {collect.__name__} failed: {e}")
+            continue
+        for name, kind, help, samples in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(tuple(labels.items()))} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+# Metrics recorded across the app
+HTTP_REQUEST_SECONDS = histogram(
+    "learnsync_http_request_duration_seconds", "HTTP request latency", ("method", "route", "status")
+)
+STAGE_SECONDS = histogram(
+    "learnsync_stage_duration_seconds", "Time spent per processing stage (file save, pdf extraction, OCR, ...)", ("stage",)
+)
+LLM_REQUEST_SECONDS = histogram(
+    "learnsync_llm_request_duration_seconds", "LLM provider call latency per attempt", ("provider", "outcome")
+)
+LLM_TOKENS = counter("learnsync_llm_tokens_total", "LLM tokens used", ("provider", "direction"))
+LLM_JSON_ERRORS = counter("learnsync_llm_json_errors_total", "LLM responses that were not valid JSON", ("template",))
+DB_QUERY_SECONDS = histogram(
+    "learnsync_db_query_duration_seconds", "Database statement latency", ("statement",), buckets=DB_BUCKETS
+)
+CACHE_REQUESTS = counter("learnsync_cache_requests_total", "Cache lookups", ("cache", "result"))
+BYTES = counter("learnsync_bytes_total", "Bytes processed", ("kind",))
+SINGLEFLIGHT = counter(
+    "learnsync_singleflight_total", "Coalesced computations by role (leader, coalesced, remote_wait, remote_reuse)",
+    ("operation", "role")
+)
+
+# Per-request stage timings (seconds by stage), see timed() and the middleware below
+_request_stages = ContextVar("request_stages", default=None)
+
+def add_request_time(stage: str, seconds: float):
+    stages = _request_stages.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+def record_stage(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    add_request_time(stage, seconds)
+
+@contextmanager
+def timed(stage: str):
+    """Time a block as a processing stage, both in the histogram and for the current request"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+def server_timing(stages: dict) -> str:
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in stages.items())
+
+_STATEMENT = re.compile(r"\s*(\w+)")
+
+def instrument_engine(engine):
+    """Time every statement executed through a (sync) SQLAlchemy engine"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["metrics_started"].pop()
+        match = _STATEMENT.match(statement)
+        DB_QUERY_SECONDS.observe(elapsed, statement=match.group(1).upper() if match else "OTHER")
+        add_request_time("db", elapsed)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        # after_cursor_execute doesn't run for failed statements
+        started = context.connection.info.get("metrics_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+class MetricsMiddleware:
+    """ASGI middleware: request latency by route template, plus a Server-Timing header"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stages = {}
+        token = _request_stages.set(stages)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                stages["total"] = time.perf_counter() - started
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(stages).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_stages.reset(token)
+            route = scope.get("route")
+            # Unmatched paths share one label to keep the number of series bounded
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                method=scope["method"], route=getattr(route, "path", "unmatched"), status=str(status)
+            )
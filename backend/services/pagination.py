@@ -0,0 +1,32 @@
+import base64
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+# Keyset (cursor) pagination over (timestamp, id), newest first.
+# Unlike OFFSET, each page is an index range scan so cost stays flat as tables grow.
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{row_id}".encode()).decode()
+
+def decode_cursor(cursor: str):
+    """Return (timestamp, id); raises ValueError for malformed cursors"""
+    try:
+        timestamp, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def keyset_page(query, timestamp_column, id_column, cursor: str = None, limit: int = 50):
+    """Return (rows, next_cursor); next_cursor is None on the last page"""
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            timestamp_column < timestamp,
+            and_(timestamp_column == timestamp, id_column < row_id)
+        ))
+    rows = query.order_by(timestamp_column.desc(), id_column.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, timestamp_column.key), getattr(last, id_column.key))
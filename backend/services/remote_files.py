@@ -0,0 +1,266 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+import database
+import models
+from services import llm, metrics
+
+# Registry of files uploaded to the Gemini File API, keyed by content hash and
+# MIME type. Re-extracting the same PDF or lecture reuses the live remote file
+# instead of uploading it again; handles close to expiry are re-uploaded, and
+# expired or idle ones are garbage-collected in the background. A handle the
+# model rejects (deleted remotely) is forgotten with invalidate() and uploaded again.
+
+# Gemini keeps uploads for 48 hours
+REMOTE_FILE_TTL_HOURS = float(os.getenv("REMOTE_FILE_TTL_HOURS", "48"))
+# Handles expiring sooner than this are refreshed, so a long request can't outlive its file
+REMOTE_FILE_EXPIRY_MARGIN_SECONDS = float(os.getenv("REMOTE_FILE_EXPIRY_MARGIN_SECONDS", "3600"))
+REMOTE_FILE_IDLE_HOURS = float(os.getenv("REMOTE_FILE_IDLE_HOURS", "12"))
+REMOTE_FILE_GC_INTERVAL_SECONDS = float(os.getenv("REMOTE_FILE_GC_INTERVAL_SECONDS", "1800"))
+# Video has to be processed by Gemini before it can be used in a prompt
+REMOTE_FILE_PROCESSING_TIMEOUT_SECONDS = float(os.getenv("REMOTE_FILE_PROCESSING_TIMEOUT_SECONDS", "600"))
+
+class GeminiFileAPI:
+    """genai File API: upload(path, mime_type) -> dict, delete(name)"""
+
+    def __init__(self):
+        import google.generativeai as genai
+        api_key = os.getenv("GEMINI_API_KEY")
+        genai.configure(api_key=api_key)
+        self.genai = genai
+        self.key_id = llm._key_id(api_key)
+
+    def upload(self, path: str, mime_type: str) -> dict:
+        remote = self.genai.upload_file(path=path, mime_type=mime_type)
+        deadline = time.monotonic() + REMOTE_FILE_PROCESSING_TIMEOUT_SECONDS
+        while getattr(remote.state, "name", "ACTIVE") == "PROCESSING" and time.monotonic() < deadline:
+            time.sleep(2)
+            remote = self.genai.get_file(remote.name)
+        state = getattr(remote.state, "name", "ACTIVE")
+        if state != "ACTIVE":
+            # Not usable in a prompt yet (or ever); raise so the job is retried later
+            _delete_remote(self, remote.name)
+            if state == "PROCESSING":
+                raise RuntimeError(f"Gemini did not finish processing {remote.name} "
+                                   f"within {REMOTE_FILE_PROCESSING_TIMEOUT_SECONDS:.0f}s")
+            raise RuntimeError(f"Gemini could not process {remote.name} ({state})")
+        expires_at = remote.expiration_time.replace(tzinfo=None) if remote.expiration_time else None
+        return {"name": remote.name, "uri": remote.uri, "size_bytes": remote.size_bytes, "expires_at": expires_at}
+
+    def delete(self, name: str):
+        self.genai.delete_file(name)
+
+class LocalFileAPI:
+    """In-memory stand-in for the File API, for tests and offline benchmarks"""
+    key_id = "local"
+
+    def __init__(self, ttl_seconds: float = REMOTE_FILE_TTL_HOURS * 3600):
+        self.ttl_seconds = ttl_seconds
+        self.files = {}
+        self.uploads = 0
+        self.deletes = 0
+
+    def upload(self, path: str, mime_type: str) -> dict:
+        self.uploads += 1
+        name = f"files/{uuid.uuid4().hex[:12]}"
+        self.files[name] = path
+        return {
+            "name": name,
+            "uri": f"local://{name}",
+            "size_bytes": os.path.getsize(path),
+            "expires_at": datetime.utcnow() + timedelta(seconds=self.ttl_seconds)
+        }
+
+    def delete(self, name: str):
+        self.deletes += 1
+        self.files.pop(name, None)
+
+_api = None
+_key_locks = {}
+_key_locks_guard = threading.Lock()
+
+def get_file_api():
+    global _api
+    if _api is None:
+        _api = GeminiFileAPI()
+    return _api
+
+def set_file_api(api):
+    """Swap the File API implementation (e.g. LocalFileAPI in tests)"""
+    global _api
+    _api = api
+
+def content_hash_of(path: str) -> str:
+    """SHA-256 of a file; blobs in the upload store are already named by it"""
+    name = os.path.splitext(os.path.basename(path))[0]
+    if len(name) == 64 and all(c in "0123456789abcdef" for c in name):
+        return name
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def file_part(mime_type: str, uri: str) -> dict:
+    """Prompt part referencing an uploaded file"""
+    return {"file_data": {"mime_type": mime_type, "file_uri": uri}}
+
+def _lock_for(key: tuple) -> threading.Lock:
+    with _key_locks_guard:
+        return _key_locks.setdefault(key, threading.Lock())
+
+def _is_live(row: models.RemoteFile, now: datetime) -> bool:
+    return row.expires_at is not None and row.expires_at - timedelta(seconds=REMOTE_FILE_EXPIRY_MARGIN_SECONDS) > now
+
+def _find(db, key: tuple):
+    content_hash, mime_type, key_id = key
+    return db.query(models.RemoteFile).filter(
+        models.RemoteFile.content_hash == content_hash,
+        models.RemoteFile.mime_type == mime_type,
+        models.RemoteFile.key_id == key_id
+    ).first()
+
+def _delete_remote(api, name: str):
+    try:
+        api.delete(name)
+    except Exception as e:
+        # Already expired or deleted remotely
+        print(f"Could not delete remote file {name}: {e}")
+
+def get_or_upload(path: str, mime_type: str) -> dict:
+    """Prompt part for the file, uploading it only if no live upload of the same content exists"""
+    api = get_file_api()
+    content_hash = content_hash_of(path)
+    key = (content_hash, mime_type, api.key_id)
+
+    # One upload per content at a time within this process; across processes
+    # the unique constraint decides and the loser's upload is deleted
+    with _lock_for(key):
+        db = database.SessionLocal()
+        try:
+            now = datetime.utcnow()
+            row = _find(db, key)
+            if row is not None and _is_live(row, now):
+                metrics.CACHE_REQUESTS.inc(cache="remote_files", result="hit")
+                row.last_used_at = now
+                db.commit()
+                return file_part(mime_type, row.uri)
+
+            metrics.CACHE_REQUESTS.inc(cache="remote_files", result="miss")
+            started = time.perf_counter()
+            uploaded = api.upload(path, mime_type)
+            elapsed = time.perf_counter() - started
+            metrics.record_stage("file_upload", elapsed)
+            metrics.BYTES.inc(uploaded.get("size_bytes") or 0, kind="remote_upload")
+            print(f"Uploaded {os.path.basename(path)} as {uploaded['name']} in {elapsed:.1f}s")
+            values = {
+                "name": uploaded["name"],
+                "uri": uploaded["uri"],
+                "size_bytes": uploaded.get("size_bytes") or 0,
+                "created_at": now,
+                "last_used_at": now,
+                "expires_at": uploaded.get("expires_at") or now + timedelta(hours=REMOTE_FILE_TTL_HOURS),
+            }
+            if row is not None:
+                # Only replace the handle this process saw; if another process
+                # refreshed it first, keep theirs and delete this upload
+                replaced = db.query(models.RemoteFile).filter(
+                    models.RemoteFile.id == row.id, models.RemoteFile.name == row.name
+                ).update(values, synchronize_session=False)
+                db.commit()
+                if replaced:
+                    _delete_remote(api, row.name)
+                    return file_part(mime_type, uploaded["uri"])
+            else:
+                db.add(models.RemoteFile(content_hash=content_hash, mime_type=mime_type, key_id=api.key_id, **values))
+                try:
+                    db.commit()
+                    return file_part(mime_type, uploaded["uri"])
+                except IntegrityError:
+                    db.rollback()
+            _delete_remote(api, uploaded["name"])
+            db.expire_all()
+            existing = _find(db, key)
+            if existing is None:
+                raise RuntimeError(f"Remote file for {os.path.basename(path)} was removed while uploading it")
+            return file_part(mime_type, existing.uri)
+        finally:
+            db.close()
+
+def invalidate(path: str, mime_type: str, uri: str):
+    """Forget the registry row pointing at uri, e.g. after the model reported the file missing"""
+    api = get_file_api()
+    content_hash, key_id = content_hash_of(path), api.key_id
+    db = database.SessionLocal()
+    try:
+        removed = db.query(models.RemoteFile).filter(
+            models.RemoteFile.content_hash == content_hash,
+            models.RemoteFile.mime_type == mime_type,
+            models.RemoteFile.key_id == key_id,
+            models.RemoteFile.uri == uri
+        ).delete(synchronize_session=False)
+        db.commit()
+        if removed:
+            print(f"Forgot remote file {uri} of {os.path.basename(path)}")
+    finally:
+        db.close()
+
+def collect_garbage(now: datetime = None) -> int:
+    """Forget expired handles and delete uploads idle for REMOTE_FILE_IDLE_HOURS; returns how many were removed"""
+    now = now or datetime.utcnow()
+    api = get_file_api()
+    db = database.SessionLocal()
+    try:
+        rows = db.query(models.RemoteFile).filter(
+            (models.RemoteFile.expires_at <= now) |
+            (models.RemoteFile.last_used_at < now - timedelta(hours=REMOTE_FILE_IDLE_HOURS))
+        ).all()
+        for row in rows:
+            if row.key_id == api.key_id and row.expires_at > now:
+                _delete_remote(api, row.name)
+            db.delete(row)
+        db.commit()
+        return len(rows)
+    finally:
+        db.close()
+
+_gc_stop = threading.Event()
+_gc_thread = None
+
+def _gc_loop():
+    while not _gc_stop.wait(REMOTE_FILE_GC_INTERVAL_SECONDS):
+        try:
+            removed = collect_garbage()
+            if removed:
+                print(f"Removed {removed} expired/idle remote files")
+        except Exception as e:
+            print(f"Remote file cleanup failed: {e}")
+
+def start_gc():
+    global _gc_thread
+    if _gc_thread is None:
+        _gc_stop.clear()
+        _gc_thread = threading.Thread(target=_gc_loop, name="remote-file-gc", daemon=True)
+        _gc_thread.start()
+
+def stop_gc():
+    global _gc_thread
+    _gc_stop.set()
+    _gc_thread = None
+
+def stats() -> dict:
+    db = database.SessionLocal()
+    try:
+        live_after = datetime.utcnow() + timedelta(seconds=REMOTE_FILE_EXPIRY_MARGIN_SECONDS)
+        total = db.query(func.count(models.RemoteFile.id)).scalar()
+        live, live_bytes = db.query(func.count(models.RemoteFile.id), func.sum(models.RemoteFile.size_bytes)).filter(
+            models.RemoteFile.expires_at > live_after
+        ).one()
+        return {"files": total, "live": live, "live_bytes": live_bytes or 0}
+    finally:
+        db.close()
@@ -0,0 +1,232 @@
+import json
+import re
+from bisect import bisect_right
+from sqlalchemy import or_, text
+from sqlalchemy.orm import load_only
+import models
+
+# Full-text search over documents using SQLite FTS5.
+# Text is normalized before indexing and querying so Arabic spelling variants
+# and diacritics match: alef forms fold to bare alef, alef maqsura to yaa,
+# taa marbuta to haa, and harakat/tatweel are stripped. Snippets are cut from
+# the normalized index and mapped back onto the original text for display.
+# On other databases (PostgreSQL) the FTS table is skipped and search falls
+# back to a case-insensitive substring match.
+
+_ARABIC_DIACRITICS = re.compile("[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]")
+_ARABIC_FOLDING = str.maketrans({
+    "\u0623": "\u0627",  # alef with hamza above -> alef
+    "\u0625": "\u0627",  # alef with hamza below -> alef
+    "\u0622": "\u0627",  # alef with madda -> alef
+    "\u0671": "\u0627",  # alef wasla -> alef
+    "\u0649": "\u064A",  # alef maqsura -> yaa
+    "\u0629": "\u0647",  # taa marbuta -> haa
+})
+_WORD = re.compile(r"\w+")
+_HIGHLIGHT = re.compile("</?b>")
+_ELLIPSIS = "…"
+# User terms only match these columns, never the scope tokens (owner1 would prefix-match "own")
+_CONTENT_COLUMNS = ("filename", "body", "summary", "concepts")
+
+def normalize_arabic(value: str) -> str:
+    return _ARABIC_DIACRITICS.sub("", value or "").translate(_ARABIC_FOLDING)
+
+def _scope_tokens(owner_id: int, course_id: int = None) -> str:
+    # Ownership is indexed as tokens so scoping uses the FTS index instead of a post-filter
+    tokens = [f"owner{owner_id}"]
+    if course_id is not None:
+        tokens.append(f"course{course_id}")
+    return " ".join(tokens)
+
+def _concepts_text(key_concepts: str) -> str:
+    if not key_concepts:
+        return ""
+    try:
+        concepts = json.loads(key_concepts)
+        return "\n".join(f"{c.get('term', '')}: {c.get('definition', '')}" for c in concepts if isinstance(c, dict))
+    except (ValueError, TypeError):
+        return key_concepts
+
+def _uses_fts(bind) -> bool:
+    return bind.dialect.name == "sqlite"
+
+def init_index(conn) -> bool:
+    """Create the FTS table if needed (see migrations.py); returns True when it was just created"""
+    if not _uses_fts(conn):
+        return False
+    exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'documents_fts'")).first()
+    if exists:
+        return False
+    conn.execute(text(
+        "CREATE VIRTUAL TABLE documents_fts USING fts5("
+        "filename, body, summary, concepts, scope, "
+        "tokenize = 'unicode61 remove_diacritics 2')"
+    ))
+    return True
+
+def index_document(db, doc: models.Document):
+    """(Re)index one document; the FTS rowid is the document id"""
+    if not _uses_fts(db.get_bind()):
+        return
+    db.execute(text("DELETE FROM documents_fts WHERE rowid = :id"), {"id": doc.id})
+    db.execute(
+        text("INSERT INTO documents_fts (rowid, filename, body, summary, concepts, scope) "
+             "VALUES (:id, :filename, :body, :summary, :concepts, :scope)"),
+        {
+            "id": doc.id,
+            "filename": normalize_arabic(doc.filename),
+            "body": normalize_arabic(doc.extracted_text),
+            "summary": normalize_arabic(doc.summary),
+            "concepts": normalize_arabic(_concepts_text(doc.key_concepts)),
+            "scope": _scope_tokens(doc.owner_id, doc.course_id),
+        }
+    )
+
+def safe_index_document(db, doc: models.Document):
+    """Index and commit without letting an indexing failure break the caller"""
+    try:
+        index_document(db, doc)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Search indexing failed for document {doc.id}: {e}")
+
+def remove_document(db, document_id: int):
+    if not _uses_fts(db.get_bind()):
+        return
+    db.execute(text("DELETE FROM documents_fts WHERE rowid = :id"), {"id": document_id})
+
+def rebuild_index(db):
+    if not _uses_fts(db.get_bind()):
+        return
+    db.execute(text("DELETE FROM documents_fts"))
+    for doc in db.query(models.Document).filter(models.Document.extracted_text.isnot(None)).yield_per(200):
+        index_document(db, doc)
+    db.commit()
+
+def _match_expression(query: str) -> str:
+    """Turn free text into an FTS5 query on the content columns: every word must match, the last one as a prefix"""
+    words = _WORD.findall(normalize_arabic(query))
+    if not words:
+        return ""
+    terms = [f'"{w}"' for w in words[:-1]] + [f'"{words[-1]}"*']
+    return "{%s} : (%s)" % (" ".join(_CONTENT_COLUMNS), " ".join(terms))
+
+def _best_snippet(row) -> tuple:
+    """(column, snippet) of the first content column with a highlighted hit"""
+    for column in ("body", "summary", "concepts", "filename"):
+        snippet = getattr(row, column)
+        if snippet and "<b>" in snippet:
+            return column, snippet
+    return "body", row.body or ""
+
+def _original_snippet(marked: str, original: str) -> str:
+    """A snippet FTS cut from normalized text, cut again from the original text at the same place"""
+    if not original:
+        return marked
+    head, tail = marked.startswith(_ELLIPSIS), marked.endswith(_ELLIPSIS)
+    core = marked[len(_ELLIPSIS) if head else 0:len(marked) - len(_ELLIPSIS) if tail else len(marked)]
+    # Markers alternate, so every odd part is a highlighted hit
+    plain, bounds = "", []
+    for i, part in enumerate(_HIGHLIGHT.split(core)):
+        if i:
+            bounds.append(len(plain))
+        plain += part
+    start = normalize_arabic(original).find(plain)
+    if not plain or start < 0:
+        return marked  # indexed before the document last changed
+
+    # Normalizing only drops diacritics and folds letters one to one, so a
+    # normalized offset maps to the original by skipping the dropped characters
+    dropped = [m.start() for m in _ARABIC_DIACRITICS.finditer(original)]
+
+    def to_original(offset: int) -> int:
+        position = offset
+        while True:
+            shifted = offset + bisect_right(dropped, position)
+            if shifted == position:
+                return position
+            position = shifted
+
+    cuts = [to_original(start + bound) for bound in [0, *bounds, len(plain)]]
+    pieces = []
+    for i in range(len(cuts) - 1):
+        if i:
+            pieces.append("</b>" if i % 2 == 0 else "<b>")
+        pieces.append(original[cuts[i]:cuts[i + 1]])
+    return (_ELLIPSIS if head else "") + "".join(pieces) + (_ELLIPSIS if tail else "")
+
+def _column_text(doc: models.Document, column: str) -> str:
+    if column == "concepts":
+        return _concepts_text(doc.key_concepts)
+    return {"filename": doc.filename, "body": doc.extracted_text, "summary": doc.summary}[column]
+
+def _search_without_fts(db, owner_id: int, query: str, course_id: int = None, limit: int = 20) -> list:
+    words = _WORD.findall(query)
+    if not words:
+        return []
+    columns = (models.Document.filename, models.Document.summary, models.Document.extracted_text)
+    q = db.query(models.Document).options(
+        load_only(models.Document.filename, models.Document.media_type, models.Document.course_id, models.Document.upload_date)
+    ).filter(models.Document.owner_id == owner_id)
+    if course_id is not None:
+        q = q.filter(models.Document.course_id == course_id)
+    for word in words:
+        q = q.filter(or_(*[column.ilike(f"%{word}%") for column in columns]))
+    return [
+        {
+            "id": d.id,
+            "filename": d.filename,
+            "media_type": d.media_type,
+            "course_id": d.course_id,
+            "upload_date": d.upload_date,
+            "snippet": "",
+            "rank": 0.0,
+        }
+        for d in q.order_by(models.Document.upload_date.desc()).limit(limit)
+    ]
+
+def search_documents(db, owner_id: int, query: str, course_id: int = None, limit: int = 20) -> list:
+    if not _uses_fts(db.get_bind()):
+        return _search_without_fts(db, owner_id, query, course_id, limit)
+    match = _match_expression(query)
+    if not match:
+        return []
+    scope = " AND ".join(f'scope : "{token}"' for token in _scope_tokens(owner_id, course_id).split())
+    rows = db.execute(
+        text(
+            "SELECT rowid, "
+            "snippet(documents_fts, 1, '<b>', '</b>', '…', 12) AS body, "
+            "snippet(documents_fts, 2, '<b>', '</b>', '…', 12) AS summary, "
+            "snippet(documents_fts, 3, '<b>', '</b>', '…', 12) AS concepts, "
+            "snippet(documents_fts, 0, '<b>', '</b>', '…', 12) AS filename, "
+            "bm25(documents_fts, 2.0, 1.0, 1.5, 1.5, 0.0) AS rank "
+            "FROM documents_fts WHERE documents_fts MATCH :match ORDER BY rank LIMIT :limit"
+        ),
+        {"match": f"({scope}) AND {match}", "limit": limit}
+    ).all()
+    if not rows:
+        return []
+
+    docs = {
+        d.id: d for d in db.query(models.Document)
+        .options(load_only(models.Document.filename, models.Document.media_type, models.Document.course_id, models.Document.upload_date,
+                           models.Document.extracted_text, models.Document.summary, models.Document.key_concepts))
+        .filter(models.Document.id.in_([r.rowid for r in rows]))
+    }
+    results = []
+    for r in rows:
+        doc = docs.get(r.rowid)
+        if doc is None:
+            continue
+        column, snippet = _best_snippet(r)
+        results.append({
+            "id": r.rowid,
+            "filename": doc.filename,
+            "media_type": doc.media_type,
+            "course_id": doc.course_id,
+            "upload_date": doc.upload_date,
+            "snippet": _original_snippet(snippet, _column_text(doc, column)),
+            "rank": r.rank,
+        })
+    return results
@@ -0,0 +1,153 @@
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+import database
+import models
+from services import metrics
+
+# Request coalescing: concurrent callers asking for the same computation (same
+# key, e.g. operation + document + parameters) await one in-flight task and
+# share its result or exception, instead of each calling the LLM and committing.
+#
+# Within a process the flights live in a map per event loop. With lease=True the
+# leader also holds a row in flight_leases, so a leader in another worker process
+# makes this one wait for it and then recheck() for its result (e.g. the row it
+# saved, or its LLM response in the cache) before computing anything itself.
+
+# A leader renews its lease while it works; a crashed leader's lease expires
+SINGLEFLIGHT_LEASE_SECONDS = float(os.getenv("SINGLEFLIGHT_LEASE_SECONDS", "60"))
+SINGLEFLIGHT_POLL_SECONDS = float(os.getenv("SINGLEFLIGHT_POLL_SECONDS", "0.2"))
+# Set to 0 with a single worker process to skip the lease writes
+SINGLEFLIGHT_DB_LEASES = os.getenv("SINGLEFLIGHT_DB_LEASES", "1") == "1"
+
+_PROCESS = f"{socket.gethostname()}:{os.getpid()}"
+
+# (event loop, key) -> asyncio.Task; tasks can only be awaited on their own loop
+_flights = {}
+
+def _operation(key: str) -> str:
+    return key.split(":", 1)[0]
+
+def _acquire(key: str, owner: str) -> bool:
+    """Take the lease if nobody holds it or the holder's lease expired"""
+    db = database.SessionLocal()
+    try:
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=SINGLEFLIGHT_LEASE_SECONDS)
+        db.add(models.FlightLease(key=key, owner=owner, expires_at=expires_at))
+        try:
+            db.commit()
+            return True
+        except IntegrityError:
+            db.rollback()
+        taken = db.query(models.FlightLease).filter(
+            models.FlightLease.key == key, models.FlightLease.expires_at <= now
+        ).update({"owner": owner, "expires_at": expires_at}, synchronize_session=False)
+        db.commit()
+        return taken == 1
+    finally:
+        db.close()
+
+def _renew(key: str, owner: str):
+    db = database.SessionLocal()
+    try:
+        db.query(models.FlightLease).filter(
+            models.FlightLease.key == key, models.FlightLease.owner == owner
+        ).update({"expires_at": datetime.utcnow() + timedelta(seconds=SINGLEFLIGHT_LEASE_SECONDS)},
+                 synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+def _release(key: str, owner: str):
+    db = database.SessionLocal()
+    try:
+        db.query(models.FlightLease).filter(
+            models.FlightLease.key == key, models.FlightLease.owner == owner
+        ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+def _is_held(key: str) -> bool:
+    db = database.SessionLocal()
+    try:
+        return db.query(models.FlightLease.key).filter(
+            models.FlightLease.key == key, models.FlightLease.expires_at > datetime.utcnow()
+        ).first() is not None
+    finally:
+        db.close()
+
+async def _heartbeat(key: str, owner: str):
+    while True:
+        await asyncio.sleep(SINGLEFLIGHT_LEASE_SECONDS / 3)
+        try:
+            await asyncio.to_thread(_renew, key, owner)
+        except SQLAlchemyError as e:
+            print(f"Could not renew lease {key}: {e}")
+
+async def _with_lease(key: str, compute, recheck):
+    owner = f"{_PROCESS}:{uuid.uuid4().hex[:8]}"
+    while True:
+        try:
+            acquired = await asyncio.to_thread(_acquire, key, owner)
+        except SQLAlchemyError as e:
+            # No lease table (migrations not applied) or database trouble: don't block the work on it
+            print(f"Single-flight lease unavailable, computing without it: {e}")
+            return await compute()
+        if acquired:
+            break
+
+        metrics.SINGLEFLIGHT.inc(operation=_operation(key), role="remote_wait")
+        while await asyncio.to_thread(_is_held, key):
+            await asyncio.sleep(SINGLEFLIGHT_POLL_SECONDS)
+        if recheck is not None:
+            result = await recheck()
+            if result is not None:
+                metrics.SINGLEFLIGHT.inc(operation=_operation(key), role="remote_reuse")
+                return result
+
+    heartbeat = asyncio.create_task(_heartbeat(key, owner))
+    try:
+        return await compute()
+    finally:
+        heartbeat.cancel()
+        try:
+            await asyncio.to_thread(_release, key, owner)
+        except SQLAlchemyError as e:
+            print(f"Could not release lease {key}: {e}")
+
+def _forget(flight_key: tuple, task: asyncio.Task):
+    if _flights.get(flight_key) is task:
+        del _flights[flight_key]
+    # Mark the exception as retrieved; the callers that were waiting have seen it
+    if not task.cancelled():
+        task.exception()
+
+async def run(key: str, compute, recheck=None, lease: bool = False):
+    """Result of compute() (an async callable), shared by every concurrent caller with the same key.
+
+    recheck (async, only with lease=True) looks for a result another process
+    produced while this one waited for its lease; None means compute it here.
+    """
+    loop = asyncio.get_running_loop()
+    flight_key = (loop, key)
+    task = _flights.get(flight_key)
+    if task is None:
+        metrics.SINGLEFLIGHT.inc(operation=_operation(key), role="leader")
+        work = _with_lease(key, compute, recheck) if lease and SINGLEFLIGHT_DB_LEASES else compute()
+        # A task, so the work finishes for the others even if the first caller disconnects
+        task = loop.create_task(work)
+        _flights[flight_key] = task
+        task.add_done_callback(lambda done: _forget(flight_key, done))
+    else:
+        metrics.SINGLEFLIGHT.inc(operation=_operation(key), role="coalesced")
+    return await asyncio.shield(task)
+
+def _collect():
+    return [("learnsync_singleflight_in_flight", "gauge", "Coalesced computations currently running", [({}, len(_flights))])]
+
+metrics.register_collector(_collect)
@@ -0,0 +1,88 @@
+import json
+from datetime import datetime, timedelta
+import models
+
+# SM-2 spaced repetition for flashcards. Each (user, card) pair has a CardReview
+# row; the due queue is a range scan on the (user_id, due_at) index.
+
+MIN_EASE = 1.3
+
+def schedule(review: models.CardReview, grade: int, now: datetime = None):
+    """Apply an answer graded 0 (blackout) to 5 (perfect) and set the next due date"""
+    now = now or datetime.utcnow()
+    ease = review.ease_factor or 2.5
+    if grade < 3:
+        # Lapse: start the card over, keep the (lowered) ease
+        review.repetitions = 0
+        review.interval_days = 1
+        review.lapses = (review.lapses or 0) + 1
+    else:
+        review.repetitions = (review.repetitions or 0) + 1
+        if review.repetitions == 1:
+            review.interval_days = 1
+        elif review.repetitions == 2:
+            review.interval_days = 6
+        else:
+            review.interval_days = max(1, round((review.interval_days or 1) * ease))
+    review.ease_factor = max(MIN_EASE, ease + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02))
+    review.last_reviewed_at = now
+    review.due_at = now + timedelta(days=review.interval_days)
+
+def due_cards(db, user_id: int, limit: int = 20, now: datetime = None) -> list:
+    """Next due cards across all of the user's decks, most overdue first: [(CardReview, Flashcard)]"""
+    return db.query(models.CardReview, models.Flashcard).join(
+        models.Flashcard, models.CardReview.flashcard_id == models.Flashcard.id
+    ).filter(
+        models.CardReview.user_id == user_id,
+        models.CardReview.due_at <= (now or datetime.utcnow())
+    ).order_by(models.CardReview.due_at).limit(limit).all()
+
+def new_reviews(user_id: int, cards: list) -> list:
+    """Review state for freshly created cards: due immediately"""
+    return [models.CardReview(user_id=user_id, flashcard=card) for card in cards]
+
+def _legacy_items(blob: str, key: str):
+    """Items of a legacy JSON blob: a list, or an object holding the list under `key`; None if unusable"""
+    try:
+        items = json.loads(blob)
+    except ValueError:
+        return None
+    if isinstance(items, dict):
+        items = items.get(key)
+    return items if isinstance(items, list) else None
+
+def backfill_legacy(db) -> int:
+    """Move quiz/deck JSON blobs written before normalization into rows; returns how many were moved.
+
+    Blobs that can't be parsed (the first releases stored raw LLM output) are
+    logged and left in place.
+    """
+    moved = 0
+    for quiz in db.query(models.Quiz).filter(models.Quiz.questions.isnot(None), ~models.Quiz.items.any()):
+        questions = _legacy_items(quiz.questions, "questions")
+        if questions is None:
+            print(f"Skipping quiz {quiz.id}: legacy questions are not a JSON list")
+            continue
+        quiz.items = [
+            models.QuizQuestion(position=position, question=q.get("question"),
+                                options=json.dumps(q.get("options", []), ensure_ascii=False),
+                                correct_answer_index=q.get("correct_answer_index"))
+            for position, q in enumerate(questions, start=1) if isinstance(q, dict)
+        ]
+        quiz.questions = None
+        moved += 1
+    for deck in db.query(models.FlashcardDeck).filter(models.FlashcardDeck.cards.isnot(None), ~models.FlashcardDeck.items.any()):
+        cards = _legacy_items(deck.cards, "cards")
+        if cards is None:
+            print(f"Skipping flashcard deck {deck.id}: legacy cards are not a JSON list")
+            continue
+        deck.items = [
+            models.Flashcard(position=position, term=c.get("term"), definition=c.get("definition"))
+            for position, c in enumerate(cards, start=1) if isinstance(c, dict)
+        ]
+        if deck.document is not None:
+            db.add_all(new_reviews(deck.document.owner_id, deck.items))
+        deck.cards = None
+        moved += 1
+    db.commit()
+    return moved
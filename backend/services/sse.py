@@ -0,0 +1,10 @@
+import json
+from fastapi.encoders import jsonable_encoder
+
+# Server-sent events helpers for streamed endpoints
+
+# Disable proxy buffering (nginx) so events reach the client as they are produced
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def format_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data), ensure_ascii=False)}\n\n"
@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from collections import namedtuple
+import models
+from services import metrics
+
+# Content-addressed blob store: identical uploads share one file on disk,
+# sharded by the first bytes of their SHA-256 to keep directories small.
+UPLOAD_DIR = "uploads"
+BLOB_DIR = f"{UPLOAD_DIR}/blobs"
+TMP_DIR = f"{UPLOAD_DIR}/tmp"
+CHUNK_SIZE = 1024 * 1024
+
+# Per media type upload caps in MB (override with MAX_UPLOAD_MB_<TYPE>)
+MAX_UPLOAD_MB = {
+    "pdf": int(os.getenv("MAX_UPLOAD_MB_PDF", "50")),
+    "image": int(os.getenv("MAX_UPLOAD_MB_IMAGE", "20")),
+    "audio": int(os.getenv("MAX_UPLOAD_MB_AUDIO", "300")),
+    "video": int(os.getenv("MAX_UPLOAD_MB_VIDEO", "1024")),
+}
+
+StoredUpload = namedtuple("StoredUpload", ["path", "content_hash", "size", "bytes_per_sec"])
+
+class UploadTooLarge(ValueError):
+    def __init__(self, media_type: str, limit_bytes: int):
+        self.media_type = media_type
+        self.limit_bytes = limit_bytes
+        super().__init__(f"{media_type} uploads are limited to {limit_bytes // (1024 * 1024)} MB")
+
+def blob_path(content_hash: str, ext: str = "") -> str:
+    return "/".join([BLOB_DIR, content_hash[:2], content_hash[2:4], content_hash + ext])
+
+def max_upload_bytes(media_type: str) -> int:
+    return MAX_UPLOAD_MB.get(media_type, MAX_UPLOAD_MB["pdf"]) * 1024 * 1024
+
+def _commit_blob(out, tmp_path: str, path: str):
+    """fsync the temp file and atomically move it into place (blocking)"""
+    out.flush()
+    os.fsync(out.fileno())
+    out.close()
+    if os.path.exists(path):
+        # Same content already stored, keep the existing blob
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+
+async def save_upload(upload, media_type: str) -> StoredUpload:
+    """Stream an UploadFile into the blob store in chunks, hashing while writing.
+
+    Disk writes run in worker threads so large uploads don't block the event loop.
+    Raises UploadTooLarge as soon as the per media type limit is exceeded.
+    """
+    limit = max_upload_bytes(media_type)
+    if upload.size is not None and upload.size > limit:
+        raise UploadTooLarge(media_type, limit)
+
+    os.makedirs(TMP_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=TMP_DIR, suffix=".part")
+    out = os.fdopen(fd, "wb")
+    hasher = hashlib.sha256()
+    size = 0
+    started = time.perf_counter()
+    try:
+        while True:
+            chunk = await upload.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > limit:
+                raise UploadTooLarge(media_type, limit)
+            hasher.update(chunk)
+            await asyncio.to_thread(out.write, chunk)
+
+        content_hash = hasher.hexdigest()
+        ext = os.path.splitext(upload.filename or "")[1].lower()
+        path = blob_path(content_hash, ext)
+        await asyncio.to_thread(_commit_blob, out, tmp_path, path)
+    except BaseException:
+        out.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    elapsed = time.perf_counter() - started
+    metrics.record_stage("file_save", elapsed)
+    metrics.BYTES.inc(size, kind="upload")
+    bytes_per_sec = size / elapsed if elapsed > 0 else float(size)
+    print(f"Stored {upload.filename}: {size} bytes in {elapsed:.2f}s ({bytes_per_sec / (1024 * 1024):.1f} MB/s)")
+    return StoredUpload(path, content_hash, size, bytes_per_sec)
+
+def find_reusable_document(db, content_hash: str):
+    """Return an already processed document with the same content, preferring analyzed ones"""
+    return db.query(models.Document).filter(
+        models.Document.content_hash == content_hash,
+        models.Document.status == "ready",
+        models.Document.extracted_text.isnot(None)
+    ).order_by(models.Document.summary.is_(None), models.Document.id.desc()).first()
+
+def copy_extraction(source, target):
+    """Copy extracted text and analysis from one document to another"""
+    target.extracted_text = source.extracted_text
+    target.language = source.language
+    target.language_stats = source.language_stats
+    target.summary = source.summary
+    target.key_concepts = source.key_concepts
+    target.status = "ready"
@@ -0,0 +1,148 @@
+import asyncio
+import json
+import os
+from datetime import datetime
+import models
+from services import ai_engine, cache, llm, search, srs
+
+# Course-wide study pack: analysis, quiz and flashcards for every ready document
+# in a course, generated concurrently by one background job ("study_pack").
+STUDY_PACK_CONCURRENCY = int(os.getenv("STUDY_PACK_CONCURRENCY", "4"))
+
+def _latest(db, model, document_id: int):
+    return db.query(model).filter(model.document_id == document_id).order_by(model.id.desc()).first()
+
+def created_since(db, model, document_id: int, since: datetime):
+    """Newest quiz or deck of a document created at or after `since`, if any"""
+    return db.query(model).filter(model.document_id == document_id, model.created_at >= since) \
+        .order_by(model.id.desc()).first()
+
+def is_up_to_date(db, doc: models.Document) -> bool:
+    """A document needs nothing new if it is analyzed and has a quiz and a deck"""
+    return bool(doc.summary) and _latest(db, models.Quiz, doc.id) is not None \
+        and _latest(db, models.FlashcardDeck, doc.id) is not None
+
+def course_documents(db, course_id: int) -> list:
+    return db.query(models.Document).filter(
+        models.Document.course_id == course_id,
+        models.Document.status == "ready",
+        models.Document.extracted_text.isnot(None)
+    ).order_by(models.Document.id).all()
+
+def add_quiz(db, document_id: int, filename: str, questions: list) -> models.Quiz:
+    """Add a quiz with one row per question (caller commits)"""
+    quiz = models.Quiz(document_id=document_id, title=f"Quiz for {filename}", items=[
+        models.QuizQuestion(position=position, question=q.get("question"),
+                            options=json.dumps(q.get("options", []), ensure_ascii=False),
+                            correct_answer_index=q.get("correct_answer_index"))
+        for position, q in enumerate(questions, start=1) if isinstance(q, dict)
+    ])
+    db.add(quiz)
+    return quiz
+
+def add_deck(db, document_id: int, owner_id: int, filename: str, cards: list) -> models.FlashcardDeck:
+    """Add a deck with one row per card, scheduled for review by the owner (caller commits)"""
+    deck = models.FlashcardDeck(document_id=document_id, title=f"Flashcards for {filename}", items=[
+        models.Flashcard(position=position, term=c.get("term"), definition=c.get("definition"))
+        for position, c in enumerate(cards, start=1) if isinstance(c, dict)
+    ])
+    db.add(deck)
+    db.add_all(srs.new_reviews(owner_id, deck.items))
+    return deck
+
+def quiz_payload(quiz: models.Quiz) -> dict:
+    questions = [
+        {"id": q.position, "question": q.question, "options": json.loads(q.options), "correct_answer_index": q.correct_answer_index}
+        for q in quiz.items
+    ]
+    return {"id": quiz.id, "title": quiz.title, "created_at": quiz.created_at,
+            "questions": questions, "document_id": quiz.document_id}
+
+def deck_payload(deck: models.FlashcardDeck) -> dict:
+    cards = [{"id": c.id, "term": c.term, "definition": c.definition} for c in deck.items]
+    return {"id": deck.id, "title": deck.title, "created_at": deck.created_at,
+            "cards": cards, "document_id": deck.document_id}
+
+def save_study_set(db, doc: models.Document, artifacts: dict):
+    """Store a combined generation on the document plus a new quiz and deck, in one commit"""
+    doc.summary = artifacts["summary"]
+    doc.key_concepts = json.dumps(artifacts["concepts"])
+    quiz = add_quiz(db, doc.id, doc.filename, artifacts["questions"])
+    deck = add_deck(db, doc.id, doc.owner_id, doc.filename, artifacts["cards"])
+    db.commit()
+    cache.invalidate_document(doc.id)
+    search.safe_index_document(db, doc)
+    return quiz, deck
+
+async def _fan_out(db, job: models.Job, docs: list, outcomes: dict, refresh: bool):
+    semaphore = asyncio.Semaphore(STUDY_PACK_CONCURRENCY)
+    errors = []
+
+    async def run(doc):
+        async with semaphore:
+            try:
+                # One combined call per document instead of analysis + quiz + flashcards
+                artifacts = await ai_engine.generate_study_artifacts(doc.extracted_text, doc.language)
+            except llm.LLMError as e:
+                print(f"Study pack: document {doc.id} failed: {e}")
+                errors.append(e)
+                outcomes[doc.id] = "failed"
+            else:
+                # The session belongs to this thread, which also runs this event loop
+                save_study_set(db, doc, artifacts)
+                outcomes[doc.id] = "generated"
+            job.progress += 1
+            job.result = json.dumps({"refresh": refresh, "documents": outcomes})
+            db.commit()
+
+    await asyncio.gather(*(run(doc) for doc in docs))
+    if errors and len(errors) == len(docs):
+        raise llm.LLMError(f"All {len(docs)} documents failed: {errors[-1]}")
+
+def _state(job: models.Job):
+    state = json.loads(job.result or "{}")
+    return state.get("refresh", False), {int(k): v for k, v in state.get("documents", {}).items()}
+
+def generate_course_pack(db, job: models.Job):
+    """Job handler: fill in missing study material for every document of job.course_id.
+
+    job.result holds {"refresh": bool, "documents": {document_id: outcome}}; on a retry,
+    documents generated by the previous attempt are not generated again.
+    """
+    refresh, previous = _state(job)
+    docs = course_documents(db, job.course_id)
+    outcomes = {}
+    pending = []
+    for doc in docs:
+        if previous.get(doc.id) == "generated":
+            outcomes[doc.id] = "generated"
+        elif not refresh and is_up_to_date(db, doc):
+            outcomes[doc.id] = "skipped"
+        else:
+            pending.append(doc)
+
+    job.total = len(docs)
+    job.progress = len(docs) - len(pending)
+    job.result = json.dumps({"refresh": refresh, "documents": outcomes})
+    db.commit()
+    print(f"Study pack for course {job.course_id}: {len(pending)} to generate, {len(docs) - len(pending)} up to date")
+
+    asyncio.run(_fan_out(db, job, pending, outcomes, refresh))
+
+def build_pack(db, job: models.Job) -> dict:
+    """Combined study pack: the latest material of every document in the course"""
+    _, outcomes = _state(job)
+    documents = []
+    for doc in course_documents(db, job.course_id):
+        quiz = _latest(db, models.Quiz, doc.id)
+        deck = _latest(db, models.FlashcardDeck, doc.id)
+        documents.append({
+            "document_id": doc.id,
+            "filename": doc.filename,
+            "status": outcomes.get(doc.id, "pending" if job.status in ("queued", "running") else "skipped"),
+            "summary": doc.summary,
+            "key_concepts": json.loads(doc.key_concepts) if doc.key_concepts else [],
+            "quiz": quiz_payload(quiz) if quiz else None,
+            "flashcards": deck_payload(deck) if deck else None,
+        })
+    return {"course_id": job.course_id, "job": job, "documents": documents}
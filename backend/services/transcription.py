@@ -1,14 +1,279 @@
-from services import ai_engine
 import os
+import re
+import shutil
+import subprocess
+import tempfile
+import unicodedata
+import wave
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from difflib import SequenceMatcher
+import numpy as np
+import models
+from services import ai_engine, llm, metrics
 
-def transcribe_media(file_path: str) -> str:
-    """Use Gemini 2.0 Flash for High-Quality Audio/Video Transcription"""
+# Long recordings are split into overlapping segments that are transcribed
+# concurrently and merged on their timestamps. Segments are stored in
+# transcript_segments, so a retry only redoes the ones that failed.
+# WAV is split locally with the wave module and downmixed to the same 16 kHz mono
+# as ffmpeg produces for the other formats; those need ffmpeg, without
+# it they are sent as one request like before, with a timeout sized to the
+# recording instead of the fixed LLM_FILE_TIMEOUT_SECONDS.
+
+TRANSCRIBE_SEGMENT_SECONDS = float(os.getenv("TRANSCRIBE_SEGMENT_SECONDS", "600"))
+TRANSCRIBE_OVERLAP_SECONDS = float(os.getenv("TRANSCRIBE_OVERLAP_SECONDS", "10"))
+TRANSCRIBE_CONCURRENCY = int(os.getenv("TRANSCRIBE_CONCURRENCY", "4"))
+# Request timeout on top of LLM_FILE_TIMEOUT_SECONDS, per second of media
+TRANSCRIBE_TIMEOUT_PER_MEDIA_SECOND = float(os.getenv("TRANSCRIBE_TIMEOUT_PER_MEDIA_SECOND", "0.5"))
+
+# Without ffprobe an unsplit file's length is estimated from its size at this
+# bitrate; low, so that the estimate (and the timeout) errs on the long side
+_MIN_BYTES_PER_SECOND = 32_000 / 8
+
+# Overlap lines this close in time and this similar are the same line heard twice
+_REPEAT_WINDOW_SECONDS = 5
+_REPEAT_SIMILARITY = 0.85
+
+# Segments are uploaded as 16-bit mono at this rate, enough for speech
+_SEGMENT_RATE = 16000
+# WAV segments are converted this many source frames at a time
+_WAV_BLOCK_FRAMES = 1 << 16
+
+MIME_TYPES = {".mp3": "audio/mpeg", ".wav": "audio/wav", ".mp4": "video/mp4"}
+
+_TIMESTAMP = re.compile(r"^\s*\[(?:(\d+):)?(\d{1,2}):(\d{2})(?:\.\d+)?\]\s*(.*)$")
+
+def _is_wav(file_path: str) -> bool:
+    return os.path.splitext(file_path)[1].lower() == ".wav"
+
+def media_duration(file_path: str):
+    """Length in seconds, or None if it can't be determined locally"""
+    if _is_wav(file_path):
+        try:
+            with wave.open(file_path, "rb") as audio:
+                return audio.getnframes() / float(audio.getframerate())
+        except (wave.Error, EOFError) as e:
+            print(f"Could not read WAV header of {file_path}: {e}")
+            return None
+    if shutil.which("ffprobe"):
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", file_path],
+            capture_output=True, text=True
+        )
+        try:
+            return float(result.stdout.strip())
+        except ValueError:
+            return None
+    return None
+
+def _can_split(file_path: str) -> bool:
+    return _is_wav(file_path) or shutil.which("ffmpeg") is not None
+
+def plan_segments(duration):
+    """(start, end) windows of TRANSCRIBE_SEGMENT_SECONDS overlapping by TRANSCRIBE_OVERLAP_SECONDS"""
+    if not duration or duration <= TRANSCRIBE_SEGMENT_SECONDS:
+        return [(0.0, duration)]
+    step = TRANSCRIBE_SEGMENT_SECONDS - TRANSCRIBE_OVERLAP_SECONDS
+    spans = []
+    start = 0.0
+    while start < duration:
+        end = min(start + TRANSCRIBE_SEGMENT_SECONDS, duration)
+        spans.append((start, end))
+        if end >= duration:
+            break
+        start += step
+    return spans
+
+def _mono_samples(frames: bytes, width: int, channels: int) -> np.ndarray:
+    """PCM frames as float samples in [-1, 1), channels averaged"""
+    if width == 1:
+        samples = np.frombuffer(frames, np.uint8).astype(np.float32) - 128
+    elif width == 3:
+        raw = np.frombuffer(frames, np.uint8).reshape(-1, 3).astype(np.int32)
+        samples = ((raw[:, 0] << 8 | raw[:, 1] << 16 | raw[:, 2] << 24) >> 8).astype(np.float32)
+    else:
+        samples = np.frombuffer(frames, {2: "<i2", 4: "<i4"}[width]).astype(np.float32)
+    return samples.reshape(-1, channels).mean(axis=1) / float(1 << (8 * width - 1))
+
+def _cut_wav(file_path: str, start: float, end: float, out_path: str):
+    """Copy [start, end) of a WAV file block by block, downmixed and resampled to 16 kHz mono"""
+    with wave.open(file_path, "rb") as source, wave.open(out_path, "wb") as target:
+        rate, width, channels = source.getframerate(), source.getsampwidth(), source.getnchannels()
+        target.setnchannels(1)
+        target.setsampwidth(2)
+        target.setframerate(_SEGMENT_RATE)
+        source.setpos(min(int(start * rate), source.getnframes()))
+        total = min(int((end - start) * rate), source.getnframes() - source.tell())
+        wanted = int(total * _SEGMENT_RATE / rate)
+        # Output sample k sits at source frame k * step; linear interpolation
+        # between frames, carrying the last frame of a block into the next one
+        step = rate / _SEGMENT_RATE
+        read = written = 0
+        carry = np.empty(0, np.float32)
+        while read < total and written < wanted:
+            block = _mono_samples(source.readframes(min(_WAV_BLOCK_FRAMES, total - read)), width, channels)
+            if not len(block):
+                break
+            samples = np.concatenate([carry, block])
+            first = read - len(carry)
+            read += len(block)
+            stop = wanted if read >= total else min(wanted, int((read - 1) / step) + 1)
+            positions = np.arange(written, stop) * step - first
+            resampled = np.interp(positions, np.arange(len(samples)), samples)
+            target.writeframes((np.clip(resampled, -1, 1 - 1 / 32768) * 32768).astype("<i2").tobytes())
+            written, carry = stop, block[-1:]
+
+def _cut_segment(file_path: str, start: float, end: float, out_path: str):
+    """Write [start, end) of the recording to out_path as 16 kHz mono WAV"""
+    if _is_wav(file_path):
+        _cut_wav(file_path, start, end, out_path)
+        return
+    # Audio track only, mono 16 kHz is plenty for speech and keeps uploads small
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-y", "-ss", str(start), "-t", str(end - start), "-i", file_path,
+         "-vn", "-ac", "1", "-ar", str(_SEGMENT_RATE), out_path],
+        check=True
+    )
+
+def _transcribe(file_path: str, segment: dict) -> str:
+    """Runs in a worker thread: cut the segment (if the file is split) and transcribe it"""
+    with metrics.timed("transcribe_segment"):
+        return _transcribe_clip(file_path, segment)
+
+def _timeout(duration: float) -> float:
+    return llm.LLM_FILE_TIMEOUT_SECONDS + duration * TRANSCRIBE_TIMEOUT_PER_MEDIA_SECOND
+
+def _unsplit_timeout(file_path: str, duration) -> float:
+    if duration is None:
+        duration = os.path.getsize(file_path) / _MIN_BYTES_PER_SECOND
+        print(f"Transcribing {file_path} in one request (install ffmpeg to split long recordings), "
+              f"allowing up to {_timeout(duration):.0f}s")
+    return _timeout(duration)
+
+def _transcribe_clip(file_path: str, segment: dict) -> str:
+    if segment["single"]:
+        mime_type = MIME_TYPES.get(os.path.splitext(file_path)[1].lower(), "audio/mpeg")
+        timeout = _unsplit_timeout(file_path, segment["end"])
+        return ai_engine.transcribe_segment(file_path, mime_type, segment["end"], timeout)
+    fd, clip_path = tempfile.mkstemp(suffix=".wav")
+    os.close(fd)
     try:
-        ext = os.path.splitext(file_path)[1].lower()
-        media_type = "video" if ext == ".mp4" else "audio"
-        
-        text = ai_engine.extract_text_from_file(file_path, media_type)
-        return text.strip()
-    except Exception as e:
-        print(f"Gemini Transcription error: {e}")
-        return "Failed to transcribe media."
+        _cut_segment(file_path, segment["start"], segment["end"], clip_path)
+        duration = segment["end"] - segment["start"]
+        return ai_engine.transcribe_segment(clip_path, "audio/wav", duration, _timeout(duration))
+    finally:
+        os.remove(clip_path)
+
+def _parse_lines(segment: models.TranscriptSegment):
+    """(absolute seconds, text) per line; untimed lines inherit the previous time"""
+    lines = []
+    current = segment.start_seconds
+    for raw in (segment.text or "").splitlines():
+        match = _TIMESTAMP.match(raw)
+        if match:
+            hours, minutes, seconds, text = match.groups()
+            current = segment.start_seconds + int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds)
+        else:
+            text = raw.strip()
+        if text:
+            lines.append((current, text))
+    return lines
+
+def _format_time(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+def _normalize(text: str) -> str:
+    """Casefolded words without punctuation, which transcribing the same speech twice rarely reproduces exactly"""
+    stripped = "".join(" " if unicodedata.category(char).startswith("P") else char for char in text.casefold())
+    return " ".join(stripped.split())
+
+def _is_repeat(line: tuple, kept: list) -> bool:
+    """Whether a kept line is the same speech: said within a few seconds, in (nearly) the same words"""
+    seconds, text = line[0], _normalize(line[1])
+    return any(
+        abs(seconds - other_seconds) <= _REPEAT_WINDOW_SECONDS
+        and SequenceMatcher(None, text, other_text).ratio() >= _REPEAT_SIMILARITY
+        for other_seconds, other_text in kept
+    )
+
+def _merge_overlap(previous: list, current: list, cut: float) -> list:
+    """Lines spoken inside an overlap, taken from both segments.
+
+    The earlier segment is preferred before the cut (the middle of the overlap)
+    and the later one after it; lines only one side caught are kept, repeats dropped.
+    """
+    preferred = [line for line in previous if line[0] < cut] + [line for line in current if line[0] >= cut]
+    kept = [(seconds, _normalize(text)) for seconds, text in preferred]
+    lines = list(preferred)
+    for line in previous + current:
+        if line in preferred or _is_repeat(line, kept):
+            continue
+        kept.append((line[0], _normalize(line[1])))
+        lines.append(line)
+    return sorted(lines, key=lambda line: line[0])
+
+def merge_segments(segments: list) -> str:
+    """Join segment transcripts into one transcript on absolute timestamps"""
+    merged = []
+    for i, segment in enumerate(segments):
+        lines = _parse_lines(segment)
+        previous_end = segments[i - 1].end_seconds if i > 0 else None
+        if previous_end is not None:
+            before = [line for line in merged if line[0] >= segment.start_seconds]
+            merged = merged[:len(merged) - len(before)]
+            after = [line for line in lines if line[0] < previous_end]
+            lines = lines[len(after):]
+            merged.extend(_merge_overlap(before, after, (segment.start_seconds + previous_end) / 2))
+        merged.extend(lines)
+    return "\n".join(f"[{_format_time(seconds)}] {text}" for seconds, text in merged)
+
+def _ensure_segments(db, doc: models.Document) -> list:
+    segments = db.query(models.TranscriptSegment).filter(
+        models.TranscriptSegment.document_id == doc.id
+    ).order_by(models.TranscriptSegment.index).all()
+    if segments:
+        return segments
+    duration = media_duration(doc.file_path) if _can_split(doc.file_path) else None
+    segments = [
+        models.TranscriptSegment(document_id=doc.id, index=index, start_seconds=start, end_seconds=end)
+        for index, (start, end) in enumerate(plan_segments(duration))
+    ]
+    db.add_all(segments)
+    db.commit()
+    return segments
+
+def transcribe_document(db, doc: models.Document) -> str:
+    """Transcribe the pending/failed segments of a recording concurrently and merge all of them.
+
+    Raises if any segment failed, so the job is retried for just those segments.
+    """
+    segments = _ensure_segments(db, doc)
+    todo = [s for s in segments if s.status != "done"]
+    single = len(segments) == 1
+    if todo:
+        print(f"Transcribing {len(todo)}/{len(segments)} segments of {doc.file_path}")
+        with ThreadPoolExecutor(max_workers=TRANSCRIBE_CONCURRENCY, thread_name_prefix="transcribe") as pool:
+            futures = {
+                pool.submit(_transcribe, doc.file_path, {"start": s.start_seconds, "end": s.end_seconds, "single": single}): s
+                for s in todo
+            }
+            # Results are written from this thread, which owns the session
+            for future in as_completed(futures):
+                segment = futures[future]
+                segment.attempts = (segment.attempts or 0) + 1
+                try:
+                    segment.text = future.result().strip()
+                    segment.status = "done"
+                    segment.error = None
+                except Exception as e:
+                    print(f"Transcription of segment {segment.index} ({segment.start_seconds:.0f}s) failed: {e}")
+                    segment.status = "failed"
+                    segment.error = str(e)
+                db.commit()
+
+    failed = [s.index for s in segments if s.status != "done"]
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(segments)} transcript segments failed: {failed}")
+    if single:
+        return segments[0].text
+    return merge_segments(segments)
@@ -0,0 +1,291 @@
+import os
+import re
+import tempfile
+import threading
+import zlib
+import numpy as np
+import models, database
+from services.search import normalize_arabic
+
+# Offline retrieval index: documents are split into chunks and embedded as
+# hashed TF-IDF vectors, stored per course as NumPy arrays on disk.
+# Raw (sublinear) term frequencies are stored and IDF is applied at query time,
+# so adding a document only appends rows and updates document frequencies.
+#
+# On disk a course is a directory with a compacted base file plus one shard per
+# document added since, all as sparse (CSR) arrays; adding a document writes
+# only its own shard, and shards are folded into the base once there are
+# VECTOR_INDEX_MAX_SHARDS of them. A document's shard replaces its base rows.
+
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "indexes")
+VECTOR_FEATURES = int(os.getenv("VECTOR_FEATURES", "4096"))
+VECTOR_CHUNK_CHARS = int(os.getenv("VECTOR_CHUNK_CHARS", "1500"))
+VECTOR_INDEX_MAX_SHARDS = int(os.getenv("VECTOR_INDEX_MAX_SHARDS", "32"))
+VECTOR_CHUNK_OVERLAP = 200
+
+_WORD = re.compile(r"\w+")
+
+_indexes = {}
+_locks = {}
+_registry_lock = threading.Lock()
+
+def _course_lock(course_id: int) -> threading.Lock:
+    with _registry_lock:
+        return _locks.setdefault(course_id, threading.Lock())
+
+def _chunk_spans(text: str):
+    """(start, end) offsets of overlapping retrieval chunks"""
+    spans = []
+    start = 0
+    while start < len(text):
+        end = min(start + VECTOR_CHUNK_CHARS, len(text))
+        if end < len(text):
+            boundary = text.rfind(" ", start + VECTOR_CHUNK_CHARS // 2, end)
+            if boundary > start:
+                end = boundary
+        spans.append((start, end))
+        if end >= len(text):
+            break
+        start = max(end - VECTOR_CHUNK_OVERLAP, start + 1)
+    return spans
+
+def embed(texts) -> np.ndarray:
+    """Hashed, sublinear term-frequency vectors (one row per text)"""
+    matrix = np.zeros((len(texts), VECTOR_FEATURES), dtype=np.float32)
+    for row, value in enumerate(texts):
+        words = _WORD.findall(normalize_arabic(value).lower())
+        if not words:
+            continue
+        buckets = np.fromiter((zlib.crc32(w.encode()) % VECTOR_FEATURES for w in words), dtype=np.int64, count=len(words))
+        matrix[row] = np.log1p(np.bincount(buckets, minlength=VECTOR_FEATURES))
+    return matrix
+
+def _write_rows(path: str, tf: np.ndarray, doc_ids: np.ndarray, spans: np.ndarray):
+    """Atomically write rows with the term frequencies as CSR (indptr, indices, values)"""
+    rows, columns = np.nonzero(tf)
+    indptr = np.searchsorted(rows, np.arange(len(tf) + 1))
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".npz.part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, features=VECTOR_FEATURES, indptr=indptr, indices=columns.astype(np.int32),
+                     values=tf[rows, columns], doc_ids=doc_ids, spans=spans)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def _read_rows(path: str):
+    """(tf, doc_ids, spans) written by _write_rows, or None if the file is gone or from other settings"""
+    try:
+        with np.load(path) as data:
+            if int(data["features"]) != VECTOR_FEATURES:
+                return None
+            doc_ids, spans = data["doc_ids"], data["spans"]
+            tf = np.zeros((len(doc_ids), VECTOR_FEATURES), dtype=np.float32)
+            tf[np.repeat(np.arange(len(doc_ids)), np.diff(data["indptr"])), data["indices"]] = data["values"]
+    except FileNotFoundError:
+        return None  # compacted away by another process while we listed the directory
+    return tf, doc_ids, spans
+
+class CourseIndex:
+    def __init__(self, course_id: int):
+        self.course_id = course_id
+        self.dir = os.path.join(VECTOR_INDEX_DIR, f"course_{course_id}")
+        self.base_path = os.path.join(self.dir, "base.npz")
+        self.tf = np.zeros((0, VECTOR_FEATURES), dtype=np.float32)
+        self.doc_ids = np.zeros(0, dtype=np.int64)
+        self.spans = np.zeros((0, 2), dtype=np.int64)
+        self.df = np.zeros(VECTOR_FEATURES, dtype=np.float32)
+        # document id -> mtime of the shard file it was loaded from (or written to)
+        self.shards = {}
+        self.version = None
+
+    def _shard_path(self, document_id: int) -> str:
+        return os.path.join(self.dir, f"doc_{document_id}.npz")
+
+    def _dir_version(self):
+        # Creating, replacing or deleting a file in the directory changes its mtime
+        return os.stat(self.dir).st_mtime_ns if os.path.isdir(self.dir) else None
+
+    def load(self) -> bool:
+        self.version = self._dir_version()
+        base = _read_rows(self.base_path)
+        if base is None:
+            return False
+        parts = [base]
+        self.shards = {}
+        for name in os.listdir(self.dir):
+            if not (name.startswith("doc_") and name.endswith(".npz")):
+                continue
+            path = os.path.join(self.dir, name)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            shard = _read_rows(path)
+            if shard is not None:
+                self.shards[int(name[len("doc_"):-len(".npz")])] = mtime
+                parts.append(shard)
+        if self.shards:
+            # Base rows of documents that were re-added since the last compaction are outdated
+            keep = ~np.isin(base[1], list(self.shards))
+            parts[0] = (base[0][keep], base[1][keep], base[2][keep])
+        self.tf = np.vstack([part[0] for part in parts])
+        self.doc_ids = np.concatenate([part[1] for part in parts]).astype(np.int64)
+        self.spans = np.vstack([part[2].reshape(-1, 2) for part in parts]).astype(np.int64)
+        self.df = (self.tf > 0).sum(axis=0).astype(np.float32)
+        return True
+
+    def is_stale(self) -> bool:
+        """True if another process changed the index files since we loaded them"""
+        return self._dir_version() != self.version
+
+    def save(self):
+        """Write everything as the base file and drop the shards it includes"""
+        os.makedirs(self.dir, exist_ok=True)
+        _write_rows(self.base_path, self.tf, self.doc_ids, self.spans)
+        for document_id, mtime in self.shards.items():
+            path = self._shard_path(document_id)
+            try:
+                # A shard rewritten by another process since we loaded it is newer than our base rows
+                if os.stat(path).st_mtime_ns == mtime:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.shards = {}
+        self.version = self._dir_version()
+
+    def save_document(self, document_id: int):
+        """Persist one document's rows as its shard, compacting when there are too many shards"""
+        os.makedirs(self.dir, exist_ok=True)
+        if not os.path.exists(self.base_path):
+            self.save()
+            return
+        mask = self.doc_ids == document_id
+        path = self._shard_path(document_id)
+        _write_rows(path, self.tf[mask], self.doc_ids[mask], self.spans[mask])
+        self.shards[document_id] = os.stat(path).st_mtime_ns
+        if len(self.shards) > VECTOR_INDEX_MAX_SHARDS:
+            print(f"Compacting vector index of course {self.course_id} ({len(self.shards)} shards)")
+            self.save()
+        else:
+            self.version = self._dir_version()
+
+    def remove_document(self, document_id: int):
+        mask = self.doc_ids == document_id
+        if mask.any():
+            self.df -= (self.tf[mask] > 0).sum(axis=0)
+            keep = ~mask
+            self.tf, self.doc_ids, self.spans = self.tf[keep], self.doc_ids[keep], self.spans[keep]
+
+    def add_document(self, document_id: int, text: str):
+        self.remove_document(document_id)
+        spans = _chunk_spans(text or "")
+        if not spans:
+            return
+        vectors = embed([text[start:end] for start, end in spans])
+        self.tf = np.vstack([self.tf, vectors])
+        self.doc_ids = np.concatenate([self.doc_ids, np.full(len(spans), document_id, dtype=np.int64)])
+        self.spans = np.vstack([self.spans, np.array(spans, dtype=np.int64)])
+        self.df += (vectors > 0).sum(axis=0)
+
+    def _weighted(self):
+        idf = np.log((1 + len(self.doc_ids)) / (1 + self.df)) + 1
+        weighted = self.tf * idf
+        norms = np.linalg.norm(weighted, axis=1)
+        norms[norms == 0] = 1
+        return weighted / norms[:, None], idf
+
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        """Cosine similarity of every chunk (rows) against every query vector (columns)"""
+        if len(self.doc_ids) == 0:
+            return np.zeros((0, len(queries)), dtype=np.float32)
+        chunks, idf = self._weighted()
+        weighted = queries * idf
+        norms = np.linalg.norm(weighted, axis=1)
+        norms[norms == 0] = 1
+        return chunks @ (weighted / norms[:, None]).T
+
+def _build(course_id: int) -> CourseIndex:
+    # Uses its own session so callers (sync or async routes, job workers) needn't pass one
+    index = CourseIndex(course_id)
+    db = database.SessionLocal()
+    try:
+        docs = db.query(models.Document.id, models.Document.extracted_text).filter(
+            models.Document.course_id == course_id,
+            models.Document.extracted_text.isnot(None)
+        ).yield_per(100)
+        for doc_id, text in docs:
+            index.add_document(doc_id, text)
+    finally:
+        db.close()
+    index.save()
+    # Shards (and the single-file index of earlier releases) are all covered by the new base
+    legacy = os.path.join(VECTOR_INDEX_DIR, f"course_{course_id}.npz")
+    leftovers = [os.path.join(index.dir, name) for name in os.listdir(index.dir) if name.startswith("doc_")]
+    for path in leftovers + [legacy]:
+        if os.path.exists(path):
+            os.remove(path)
+    index.version = index._dir_version()
+    return index
+
+def _load_or_build(course_id: int) -> CourseIndex:
+    # Caller holds the course lock
+    index = _indexes.get(course_id)
+    if index is not None and not index.is_stale():
+        return index
+    index = CourseIndex(course_id)
+    if not index.load():
+        index = _build(course_id)
+    _indexes[course_id] = index
+    return index
+
+def index_document(document_id: int, course_id: int, text: str):
+    """Incrementally add (or replace) one document in its course index"""
+    if course_id is None or not text:
+        return
+    with _course_lock(course_id):
+        index = _load_or_build(course_id)
+        index.add_document(document_id, text)
+        index.save_document(document_id)
+
+def safe_index_document(doc: models.Document):
+    try:
+        index_document(doc.id, doc.course_id, doc.extracted_text)
+    except Exception as e:
+        print(f"Vector indexing failed for document {doc.id}: {e}")
+
+def retrieve(course_id: int, questions, k: int = 5) -> list:
+    """Top-k chunks for each question: a list (per question) of (document_id, start, end, score)"""
+    with _course_lock(course_id):
+        index = _load_or_build(course_id)
+        scores = index.scores(embed(questions))
+        doc_ids, spans = index.doc_ids, index.spans
+
+    results = []
+    for column in range(scores.shape[1]):
+        column_scores = scores[:, column]
+        top = min(k, len(column_scores))
+        best = np.argpartition(-column_scores, top - 1)[:top] if top else []
+        best = sorted(best, key=lambda i: -column_scores[i])
+        results.append([
+            (int(doc_ids[i]), int(spans[i][0]), int(spans[i][1]), float(column_scores[i]))
+            for i in best if column_scores[i] > 0
+        ])
+    return results
+
+def related_documents(course_id: int, document_id: int, k: int = 5) -> list:
+    """Other documents in the course ranked by their best chunk-to-chunk similarity"""
+    with _course_lock(course_id):
+        index = _load_or_build(course_id)
+        own = index.doc_ids == document_id
+        if not own.any():
+            return []
+        scores = index.scores(index.tf[own])
+        doc_ids = index.doc_ids
+
+    best_per_chunk = scores.max(axis=1)
+    ranked = {}
+    for doc_id, score in zip(doc_ids[~own], best_per_chunk[~own]):
+        ranked[int(doc_id)] = max(ranked.get(int(doc_id), 0.0), float(score))
+    return sorted(((d, s) for d, s in ranked.items() if s > 0), key=lambda item: -item[1])[:k]
@@ -71,10 +71,10 @@ export const DocumentDetail = () => {
     const fetchDocument = async () => {
         try {
             const token = localStorage.getItem('token');
-            const response = await axios.get('http://localhost:8000/documents/', {
+            const response = await axios.get(`http://localhost:8000/documents/${id}`, {
                 headers: { Authorization: `Bearer ${token}` }
             });
-            const found = response.data.find((d: any) => d.id === Number(id));
+            const found = response.data;
 
             if (found) {
                 if (typeof found.key_concepts === 'string') {
@@ -173,7 +173,7 @@ export const DocumentDetail = () => {
     const ArrowIcon = isRTL ? ArrowLeft : ArrowRight;
     const isMedia = document.media_type === 'audio' || document.media_type === 'video';
     const isImage = document.media_type === 'image';
-    const mediaUrl = `http://localhost:8000/static/${document.filename}`;
+    const mediaUrl = `http://localhost:8000/static/${document.file_path.replace(/\\/g, '/').replace(/^uploads\//, '')}`;
 
     return (
         <Layout>